@@ -2,7 +2,10 @@ from sqladmin import Admin, ModelView
 from .models import User, Location, MediaData, Driver, DriverLocation, Assignment
 from .db import engine
 from fastapi import FastAPI
-from markupsafe import Markup
+from markupsafe import Markup, escape
+from .media_urls import signed_media_url, stored_image_paths
+from .derivatives import derivative_path, BASE_DIR
+import os
 
 class UserAdmin(ModelView, model=User):
     column_list = [User.id, User.first_name, User.last_name,User.mobile]
@@ -10,6 +13,9 @@ class LocationAdmin(ModelView, model=Location):
     column_list = [Location.id, Location.user_id, Location.latitude, Location.longitude, Location.landmark]
     column_searchable_list = [Location.landmark]
     column_sortable_list = [Location.id, Location.user_id]
+def thumbnail_or_original(path: str) -> str:
+    thumbnail = derivative_path(path, "thumb")
+    return thumbnail if os.path.exists(os.path.join(BASE_DIR, thumbnail)) else path
 class MediaAdmin(ModelView, model=MediaData):
     column_list = [
         MediaData.id,
@@ -20,8 +26,11 @@ class MediaAdmin(ModelView, model=MediaData):
     ]
 
     column_formatters = {
-        "image_path": lambda m, attr: Markup(
-            f'<img src="/{attr}" style="max-height: 100px;" />') if attr else ""
+        "image_path": lambda m, attr: Markup("".join(
+            f'<a href="{escape(signed_media_url(path)[0])}">'
+            f'<img src="{escape(signed_media_url(thumbnail_or_original(path))[0])}" style="max-height: 100px;" /></a>'
+            for path in stored_image_paths(m.image_path)
+        ))
     }
 class DriverAdmin(ModelView,model=Driver):
     column_list = "__all__"
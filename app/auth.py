@@ -37,7 +37,9 @@ async def get_current_driver(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: AsyncSession = Depends(get_db)
 ):
-    token = credentials.credentials
+    return await get_driver_from_token(credentials.credentials, db)
+
+async def get_driver_from_token(token: str, db: AsyncSession):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         driver_id = payload.get("driver_id")
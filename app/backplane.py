@@ -0,0 +1,363 @@
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.future import select
+
+from .db import AsyncSessionLocal, engine
+from .models import BackplaneMessage, BackplaneWorker, DriverConnection
+
+# "local" (one worker), "postgres" (LISTEN/NOTIFY) or "redis"
+WS_BACKPLANE = os.getenv("WS_BACKPLANE", "local")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# NOTIFY payloads are capped at 8000 bytes; bigger messages spill to a table
+NOTIFY_MAX_PAYLOAD_BYTES = 7500
+SPILL_RETENTION = timedelta(hours=1)
+# Each worker heartbeats this often; a worker silent for the TTL is treated
+# as dead and its driver registrations as stale
+BACKPLANE_HEARTBEAT_SECONDS = float(os.getenv("BACKPLANE_HEARTBEAT_SECONDS", "10"))
+BACKPLANE_WORKER_TTL_SECONDS = float(os.getenv("BACKPLANE_WORKER_TTL_SECONDS", "30"))
+# Reconnect backoff for a dropped listener (Postgres LISTEN / Redis subscribe)
+BACKPLANE_RECONNECT_MAX_SECONDS = float(os.getenv("BACKPLANE_RECONNECT_MAX_SECONDS", "30"))
+
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def channel_for(worker_id: str) -> str:
+    # Fixed-length name, safe as a Postgres identifier and a Redis channel
+    return "ws_" + hashlib.sha1(worker_id.encode()).hexdigest()[:20]
+
+
+class Backplane:
+    # Routes WebSocket messages to whichever worker holds the driver's socket.
+    # Each worker registers the drivers connected to it and listens on its own
+    # channel; publish() looks the driver up and forwards the message there.
+    # deliver(driver_id, message, droppable) -> bool queues to a local socket
+    # and is set by the connection manager at start().
+    name = "local"
+
+    def __init__(self):
+        self.deliver = None
+        self.local_drivers: set[int] = set()
+        self.counters = {
+            "published": 0, "received": 0, "unroutable": 0, "stale_owner": 0, "missed": 0, "errors": 0,
+            "reconnects": 0,
+        }
+
+    async def start(self, deliver):
+        self.deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def register(self, driver_id: int):
+        self.local_drivers.add(driver_id)
+
+    async def unregister(self, driver_id: int):
+        self.local_drivers.discard(driver_id)
+
+    async def publish(self, driver_id: int, message: dict, droppable: bool = False) -> bool:
+        # One worker holds every socket, so there is nowhere else to look
+        self.counters["unroutable"] += 1
+        return False
+
+    async def _receive(self, envelope: dict):
+        self.counters["received"] += 1
+        if not await self.deliver(envelope["driver_id"], envelope["message"], envelope.get("droppable", False)):
+            # Driver left this worker after the sender looked them up, or
+            # their send queue was full
+            self.counters["missed"] += 1
+
+    def _envelope(self, driver_id: int, message: dict, droppable: bool) -> str:
+        return json.dumps({"driver_id": driver_id, "message": message, "droppable": droppable}, default=str)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "worker_id": WORKER_ID,
+            "local_drivers": len(self.local_drivers),
+            **self.counters,
+        }
+
+
+class PostgresBackplane(Backplane):
+    # Registry in driver_connections, delivery via NOTIFY on the owning
+    # worker's channel. LISTEN uses one dedicated connection per worker.
+    # Workers heartbeat into backplane_workers; a supervisor task sends the
+    # heartbeat and reopens the LISTEN connection if it dropped.
+    name = "postgres"
+
+    def __init__(self):
+        super().__init__()
+        self.channel = channel_for(WORKER_ID)
+        self.listen_conn = None
+        self.supervisor: asyncio.Task | None = None
+        self.tasks: set[asyncio.Task] = set()
+
+    async def start(self, deliver):
+        await super().start(deliver)
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(BackplaneMessage).where(
+                BackplaneMessage.created_at < datetime.utcnow() - SPILL_RETENTION
+            ))
+            await db.commit()
+        await self._heartbeat()
+        await self._listen()
+        self.supervisor = asyncio.create_task(self._supervise())
+
+    async def _listen(self):
+        self.listen_conn = await engine.connect()
+        raw = await self.listen_conn.get_raw_connection()
+        await raw.driver_connection.add_listener(self.channel, self._on_notify)
+        print(f"Backplane listening on {self.channel} as {WORKER_ID}")
+
+    async def _close_listener(self):
+        if self.listen_conn is None:
+            return
+        try:
+            raw = await self.listen_conn.get_raw_connection()
+            if not raw.driver_connection.is_closed():
+                await raw.driver_connection.remove_listener(self.channel, self._on_notify)
+            await self.listen_conn.close()
+        except Exception as e:
+            print(f"Failed to close backplane listener: {e}")
+        self.listen_conn = None
+
+    async def _listener_alive(self) -> bool:
+        if self.listen_conn is None or self.listen_conn.closed:
+            return False
+        raw = await self.listen_conn.get_raw_connection()
+        return not raw.driver_connection.is_closed()
+
+    async def _heartbeat(self):
+        async with AsyncSessionLocal() as db:
+            stmt = pg_insert(BackplaneWorker).values(worker_id=WORKER_ID, heartbeat_at=datetime.utcnow())
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=[BackplaneWorker.worker_id],
+                set_={"heartbeat_at": stmt.excluded.heartbeat_at},
+            ))
+            await db.commit()
+
+    async def _supervise(self):
+        failures = 0
+        while True:
+            # Back off exponentially while the database is unreachable
+            delay = BACKPLANE_HEARTBEAT_SECONDS if not failures else min(
+                BACKPLANE_RECONNECT_MAX_SECONDS, 2 ** failures
+            )
+            await asyncio.sleep(delay)
+            try:
+                await self._heartbeat()
+                if not await self._listener_alive():
+                    # NOTIFYs sent while we weren't listening are lost;
+                    # assignments are replayed from the outbox
+                    await self._close_listener()
+                    await self._listen()
+                    self.counters["reconnects"] += 1
+                failures = 0
+            except Exception as e:
+                failures += 1
+                self.counters["errors"] += 1
+                print(f"Backplane heartbeat/listener failed (attempt {failures}): {e}")
+
+    async def stop(self):
+        if self.supervisor is not None:
+            self.supervisor.cancel()
+            await asyncio.gather(self.supervisor, return_exceptions=True)
+            self.supervisor = None
+        await self._close_listener()
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(DriverConnection).where(DriverConnection.worker_id == WORKER_ID))
+            await db.execute(delete(BackplaneWorker).where(BackplaneWorker.worker_id == WORKER_ID))
+            await db.commit()
+        self.local_drivers.clear()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        task = asyncio.create_task(self._handle(payload))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _handle(self, payload: str):
+        try:
+            envelope = json.loads(payload)
+            if "ref" in envelope:
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(
+                        delete(BackplaneMessage)
+                        .where(BackplaneMessage.id == envelope["ref"])
+                        .returning(BackplaneMessage.payload)
+                    )
+                    stored = result.scalar_one_or_none()
+                    await db.commit()
+                if stored is None:
+                    self.counters["missed"] += 1
+                    return
+                envelope = json.loads(stored)
+            await self._receive(envelope)
+        except Exception as e:
+            self.counters["errors"] += 1
+            print(f"Backplane failed to handle message: {e}")
+
+    async def register(self, driver_id: int):
+        await super().register(driver_id)
+        async with AsyncSessionLocal() as db:
+            stmt = pg_insert(DriverConnection).values(
+                driver_id=driver_id, worker_id=WORKER_ID, connected_at=datetime.utcnow()
+            )
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=[DriverConnection.driver_id],
+                set_={"worker_id": stmt.excluded.worker_id, "connected_at": stmt.excluded.connected_at},
+            ))
+            await db.commit()
+
+    async def unregister(self, driver_id: int):
+        await super().unregister(driver_id)
+        async with AsyncSessionLocal() as db:
+            # Only our own entry; the driver may already have reconnected elsewhere
+            await db.execute(delete(DriverConnection).where(
+                DriverConnection.driver_id == driver_id, DriverConnection.worker_id == WORKER_ID
+            ))
+            await db.commit()
+
+    async def publish(self, driver_id: int, message: dict, droppable: bool = False) -> bool:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(DriverConnection.worker_id, BackplaneWorker.heartbeat_at)
+                .outerjoin(BackplaneWorker, BackplaneWorker.worker_id == DriverConnection.worker_id)
+                .where(DriverConnection.driver_id == driver_id)
+            )
+            row = result.one_or_none()
+            if row is None or row.worker_id == WORKER_ID:
+                self.counters["unroutable"] += 1
+                return False
+            worker_id, heartbeat_at = row
+            if heartbeat_at is None or heartbeat_at < datetime.utcnow() - timedelta(seconds=BACKPLANE_WORKER_TTL_SECONDS):
+                # The owning worker died without unregistering; clear its
+                # entry so the next send doesn't look there either
+                await db.execute(delete(DriverConnection).where(
+                    DriverConnection.driver_id == driver_id, DriverConnection.worker_id == worker_id
+                ))
+                await db.commit()
+                self.counters["stale_owner"] += 1
+                return False
+
+            payload = self._envelope(driver_id, message, droppable)
+            if len(payload.encode()) > NOTIFY_MAX_PAYLOAD_BYTES:
+                result = await db.execute(
+                    pg_insert(BackplaneMessage).values(payload=payload).returning(BackplaneMessage.id)
+                )
+                payload = json.dumps({"ref": result.scalar_one()})
+            await db.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": channel_for(worker_id), "payload": payload},
+            )
+            await db.commit()  # NOTIFY goes out on commit, with the spilled row visible
+        self.counters["published"] += 1
+        return True
+
+
+class RedisBackplane(Backplane):
+    # Registry in a Redis hash, delivery via PUBLISH on the owning worker's
+    # channel. Works with any Redis-compatible server.
+    name = "redis"
+    REGISTRY_KEY = "ws:drivers"
+
+    def __init__(self):
+        super().__init__()
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("WS_BACKPLANE=redis needs the redis package (pip install redis)") from e
+        self.redis = aioredis.from_url(REDIS_URL, decode_responses=True)
+        self.channel = channel_for(WORKER_ID)
+        self.pubsub = None
+        self.task: asyncio.Task | None = None
+
+    async def start(self, deliver):
+        await super().start(deliver)
+        self.pubsub = self.redis.pubsub()
+        await self.pubsub.subscribe(self.channel)
+        self.task = asyncio.create_task(self._listen())
+        print(f"Backplane listening on {self.channel} as {WORKER_ID}")
+
+    async def _listen(self):
+        failures = 0
+        while True:
+            try:
+                async for item in self.pubsub.listen():
+                    failures = 0
+                    if item["type"] != "message":
+                        continue
+                    try:
+                        await self._receive(json.loads(item["data"]))
+                    except Exception as e:
+                        self.counters["errors"] += 1
+                        print(f"Backplane failed to handle message: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Connection dropped: resubscribe with exponential backoff
+                failures += 1
+                self.counters["reconnects"] += 1
+                print(f"Backplane subscription lost (attempt {failures}): {e}")
+                await asyncio.sleep(min(BACKPLANE_RECONNECT_MAX_SECONDS, 2 ** failures))
+                try:
+                    await self.pubsub.aclose()
+                    self.pubsub = self.redis.pubsub()
+                    await self.pubsub.subscribe(self.channel)
+                except Exception as e:
+                    print(f"Backplane resubscribe failed: {e}")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.pubsub is not None:
+            await self.pubsub.unsubscribe(self.channel)
+            await self.pubsub.aclose()
+            self.pubsub = None
+        for driver_id in list(self.local_drivers):
+            await self.unregister(driver_id)
+        await self.redis.aclose()
+
+    async def register(self, driver_id: int):
+        await super().register(driver_id)
+        await self.redis.hset(self.REGISTRY_KEY, str(driver_id), WORKER_ID)
+
+    async def unregister(self, driver_id: int):
+        await super().unregister(driver_id)
+        if await self.redis.hget(self.REGISTRY_KEY, str(driver_id)) == WORKER_ID:
+            await self.redis.hdel(self.REGISTRY_KEY, str(driver_id))
+
+    async def publish(self, driver_id: int, message: dict, droppable: bool = False) -> bool:
+        worker_id = await self.redis.hget(self.REGISTRY_KEY, str(driver_id))
+        if worker_id is None or worker_id == WORKER_ID:
+            self.counters["unroutable"] += 1
+            return False
+        receivers = await self.redis.publish(channel_for(worker_id), self._envelope(driver_id, message, droppable))
+        if not receivers:
+            # Registry points at a worker that is gone; clear the entry
+            if await self.redis.hget(self.REGISTRY_KEY, str(driver_id)) == worker_id:
+                await self.redis.hdel(self.REGISTRY_KEY, str(driver_id))
+            self.counters["stale_owner"] += 1
+            return False
+        self.counters["published"] += 1
+        return True
+
+
+def create_backplane(kind: str = WS_BACKPLANE) -> Backplane:
+    if kind == "postgres":
+        return PostgresBackplane()
+    if kind == "redis":
+        return RedisBackplane()
+    return Backplane()
+
+
+backplane = create_backplane()
@@ -0,0 +1,268 @@
+import asyncio
+import os
+
+from fastapi import HTTPException
+
+from .crud import upsert_assignments
+from .db import AsyncSessionLocal
+from .location_store import live_locations
+from .routing import score_drivers_eta
+
+# "greedy" assigns each request on its own, "batch" collects requests over a
+# short window and assigns them together
+DISPATCH_MODE = os.getenv("DISPATCH_MODE", "greedy")
+BATCH_WINDOW_MS = int(os.getenv("BATCH_WINDOW_MS", "1500"))
+# Flush early once this many requests are waiting
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "50"))
+# Callers left without a driver (every candidate went to another caller)
+# wait for this many more batches before getting a 404
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "2"))
+
+# Cost for request/driver pairs that aren't candidates for each other
+UNREACHABLE = 10 ** 6
+
+
+def solve_assignment(cost: list[list[float]]) -> list[tuple[int, int]]:
+    # Minimum-cost assignment (Hungarian algorithm with potentials).
+    # Returns (row, col) pairs; every row is matched when rows <= cols.
+    if not cost or not cost[0]:
+        return []
+    n, m = len(cost), len(cost[0])
+    if n > m:
+        transposed = [list(col) for col in zip(*cost)]
+        return [(row, col) for col, row in solve_assignment(transposed)]
+
+    inf = float("inf")
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)  # p[j]: row matched to column j (1-based, 0 = free)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            delta = inf
+            j1 = 0
+            row = cost[i0 - 1]
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    return [(p[j] - 1, j - 1) for j in range(1, m + 1) if p[j]]
+
+
+class PendingDispatch:
+    def __init__(self, user_id: int, lat: float, lon: float, media_id):
+        self.user_id = user_id
+        self.lat = lat
+        self.lon = lon
+        self.media_id = media_id
+        self.retries = 0
+        # Drivers given to other callers in batches this request lost
+        self.excluded: set[int] = set()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class BatchDispatcher:
+    # Collects dispatch requests for BATCH_WINDOW_MS, builds a request x driver
+    # ETA matrix and assigns drivers globally so two callers never get the
+    # same driver in one batch. All assignments of a batch are written in one
+    # transaction. Callers that lose all their candidates to other callers
+    # are carried over to the next batch instead of sharing a driver.
+    #
+    # get_candidates(db, lat, lon) -> drivers,
+    # notify(db, driver_id, user_id, media_id, assignment_id) and
+    # remember(assignment_id, user_id, media_id, ranked_driver_ids,
+    # offered_at) come from the service so this module doesn't depend on it.
+
+    def __init__(self, get_candidates, notify, remember=None,
+                 window_ms: int = BATCH_WINDOW_MS, max_size: int = BATCH_MAX_SIZE):
+        self.get_candidates = get_candidates
+        self.notify = notify
+        self.remember = remember
+        self.window_ms = window_ms
+        self.max_size = max_size
+        self.pending: list[PendingDispatch] = []
+        self.timer: asyncio.Task | None = None
+        self.tasks: set[asyncio.Task] = set()
+        self.counters = {"batches": 0, "requests": 0, "contended_fallbacks": 0, "retried": 0}
+
+    async def submit(self, user_id: int, lat: float, lon: float, media_id) -> dict:
+        request = PendingDispatch(user_id, lat, lon, media_id)
+        self._enqueue(request)
+        return await request.future
+
+    def _enqueue(self, request: PendingDispatch):
+        self.pending.append(request)
+        if len(self.pending) >= self.max_size:
+            self._flush_now()
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window_ms / 1000)
+        self.timer = None
+        await self.flush(self._take())
+
+    def _flush_now(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        task = asyncio.create_task(self.flush(self._take()))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _take(self) -> list[PendingDispatch]:
+        batch, self.pending = self.pending, []
+        return batch
+
+    async def flush(self, batch: list[PendingDispatch]):
+        if not batch:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                results = await self._dispatch(db, batch)
+            for request in batch:
+                result = results.get(request.user_id)
+                if request.future.done():  # caller went away
+                    continue
+                if result is None:
+                    self._enqueue(request)
+                elif isinstance(result, Exception):
+                    request.future.set_exception(result)
+                else:
+                    request.future.set_result(result)
+        except Exception as e:
+            print(f"Batch dispatch failed for {len(batch)} requests: {e}")
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+    async def _dispatch(self, db, batch: list[PendingDispatch]) -> dict:
+        self.counters["batches"] += 1
+        self.counters["requests"] += len(batch)
+
+        # Candidates per request (one session, so sequential), then ETAs
+        # for every request scored concurrently
+        candidate_lists = [
+            [d for d in await self.get_candidates(db, r.lat, r.lon) if d.id not in r.excluded]
+            for r in batch
+        ]
+        drivers = {}
+        positions = {}
+        for candidates in candidate_lists:
+            for driver in candidates:
+                position = live_locations.position_of(driver)
+                if position:
+                    drivers[driver.id] = driver
+                    positions[driver.id] = position
+        scored = await asyncio.gather(*(
+            score_drivers_eta(
+                request.lat, request.lon,
+                [(d.id, *positions[d.id]) for d in candidates if d.id in positions]
+            )
+            for request, candidates in zip(batch, candidate_lists)
+        ))
+
+        driver_ids = list(drivers)
+        cost = [
+            [etas.get(driver_id, UNREACHABLE) for driver_id in driver_ids]
+            for etas, _ in scored
+        ]
+        matched = {
+            row: driver_ids[col]
+            for row, col in solve_assignment(cost)
+            if cost[row][col] < UNREACHABLE
+        }
+
+        chosen = {}
+        taken = set(matched.values())
+        retry = set()
+        for row, request in enumerate(batch):
+            etas, estimated_ids = scored[row]
+            driver_id = matched.get(row)
+            if driver_id is None and etas:
+                # Every candidate of this caller went to someone else. Fall
+                # back to a candidate nobody got, or try again next batch;
+                # a driver is never given two rides.
+                free = [d for d in etas if d not in taken]
+                if free:
+                    driver_id = min(free, key=etas.get)
+                    taken.add(driver_id)
+                    self.counters["contended_fallbacks"] += 1
+                elif request.retries < BATCH_MAX_RETRIES:
+                    request.retries += 1
+                    request.excluded |= set(etas)
+                    retry.add(request.user_id)
+                    self.counters["retried"] += 1
+            if driver_id is not None:
+                chosen[request.user_id] = (request, drivers[driver_id], etas[driver_id], estimated_ids)
+
+        # One statement and one transaction for every assignment in the batch
+        assignments = {}
+        if chosen:
+            upserted = await upsert_assignments(
+                db, {user_id: driver.id for user_id, (_, driver, _, _) in chosen.items()}
+            )
+            assignments = {assignment.user_id: assignment for assignment in upserted}
+        await db.commit()
+
+        results = {user_id: None for user_id in retry}
+        for row, request in enumerate(batch):
+            if request.user_id in retry:
+                continue
+            if request.user_id not in chosen:
+                results[request.user_id] = HTTPException(status_code=404, detail="No available drivers found")
+                continue
+            _, driver, eta, estimated_ids = chosen[request.user_id]
+            assignment = assignments[request.user_id]
+            await self.notify(
+                db=db,
+                driver_id=driver.id,
+                user_id=request.user_id,
+                media_id=str(request.media_id),
+                assignment_id=assignment.id
+            )
+            if self.remember is not None:
+                etas = scored[row][0]
+                ranked = [driver.id] + [d for d in sorted(etas, key=etas.get) if d != driver.id]
+                self.remember(assignment.id, request.user_id, request.media_id, ranked, assignment.assigned_at)
+            results[request.user_id] = {
+                "media_id": request.media_id,
+                "driver_id": driver.id,
+                "first_name": driver.driver_name,
+                "mobile": driver.mobile,
+                "ambulance_number": driver.ambulance_number,
+                "eta_minutes": eta,
+                "eta_estimated": driver.id in estimated_ids,
+                "assignment_id": assignment.id,
+                "estimated_eta_driver_ids": sorted(estimated_ids),
+                "batch_size": len(batch),
+            }
+        return results
+
+    def stats(self) -> dict:
+        return {"mode": DISPATCH_MODE, "waiting": len(self.pending), **self.counters}
@@ -1,13 +1,21 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from .models import User,Location
-from fastapi import UploadFile
-from app.models import MediaData,Driver
+from fastapi import UploadFile, HTTPException
+from app.models import MediaData,Driver,DriverLocation,Assignment
+from sqlalchemy import func, and_, case, cast, literal_column, null, String
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.orm import contains_eager
+from datetime import datetime
 from uuid import uuid4
+import asyncio
+import hashlib
 import os
 from typing import Optional, List  # Import Optional for clarity
 
 from .schemas import DriverCreate
+from .media_urls import digest_cache
+from .derivatives import image_derivatives
 
 
 async def get_user_by_mobile(db: AsyncSession, mobile: str):
@@ -26,46 +34,126 @@ async def get_user_location(db: AsyncSession, user_id: int):
     return result.scalar_one_or_none()
 
 
-async def create_or_update_location(db: AsyncSession, user_id: int, location_data):
-    existing = await get_user_location(db, user_id)
-    result = await db.execute(select(MediaData).where(MediaData.user_id == user_id))
-    media = result.scalar_one_or_none()
-
-    if not media:
-        media = MediaData(user_id=user_id, media_id=str(uuid4()))
-    elif not media.media_id:
-        media.media_id = str(uuid4())
-    if existing:
-        existing.latitude = location_data.latitude
-        existing.longitude = location_data.longitude
-        existing.landmark = location_data.landmark
-    else:
-        existing = Location(user_id=user_id, **location_data.dict())
-        db.add(existing)
+async def upsert_location(db: AsyncSession, user_id: int, location_data) -> Location:
+    values = location_data.dict()
+    stmt = pg_insert(Location).values(user_id=user_id, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Location.user_id],
+        set_={name: stmt.excluded[name] for name in values},
+    ).returning(Location)
+    result = await db.execute(stmt, execution_options={"populate_existing": True})
+    return result.scalar_one()
+
+
+async def ensure_media_id(db: AsyncSession, user_id: int) -> str:
+    # Existing media_id for the user, or a new one stored in the same statement
+    stmt = pg_insert(MediaData).values(user_id=user_id, media_id=str(uuid4()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MediaData.user_id],
+        set_={"media_id": func.coalesce(MediaData.media_id, stmt.excluded.media_id)},
+    ).returning(MediaData.media_id)
+    result = await db.execute(stmt)
+    return result.scalar_one()
+
 
+async def create_or_update_location(db: AsyncSession, user_id: int, location_data):
+    await upsert_location(db, user_id, location_data)
+    media_id = await ensure_media_id(db, user_id)
     await db.commit()
-    await db.refresh(existing)
-    return media.media_id
+    return media_id
+
+
+async def upsert_driver_locations(db: AsyncSession, rows: List[dict]):
+    # rows: {"driver_id", "latitude", "longitude", "updated_at"}; one statement for all
+    stmt = pg_insert(DriverLocation).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DriverLocation.driver_id],
+        set_={
+            "latitude": stmt.excluded.latitude,
+            "longitude": stmt.excluded.longitude,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    await db.execute(stmt)
+
+
+async def upsert_assignments(db: AsyncSession, driver_by_user: dict) -> List[Assignment]:
+    # {user_id: driver_id} -> assignments, (re)set to pending for that driver
+    stmt = pg_insert(Assignment).values([
+        {"user_id": user_id, "driver_id": driver_id, "status": "pending", "assigned_at": datetime.utcnow()}
+        for user_id, driver_id in driver_by_user.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Assignment.user_id],
+        set_={
+            "driver_id": stmt.excluded.driver_id,
+            "status": stmt.excluded.status,
+            "assigned_at": stmt.excluded.assigned_at,
+            "responded_at": None,
+        },
+    ).returning(Assignment)
+    result = await db.execute(stmt, execution_options={"populate_existing": True})
+    return result.scalars().all()
+
+
+async def upsert_assignment(db: AsyncSession, user_id: int, driver_id: int) -> Assignment:
+    assignments = await upsert_assignments(db, {user_id: driver_id})
+    return assignments[0]
 
 # Get absolute path to the app directory
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-async def save_file(file: UploadFile, folder: str) -> str:
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", str(15 * 1024 * 1024)))
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(50 * 1024 * 1024)))
+
+
+async def save_file(file: UploadFile, folder: str, max_bytes: int = MAX_UPLOAD_FILE_BYTES) -> tuple[str, int]:
+    # Streams the upload to disk chunk by chunk with the file I/O in a
+    # thread, then renames it into place, so readers never see a partial
+    # file. The sha256 is computed on the way and cached for media URLs.
+    # Returns (relative path, size).
     ext = file.filename.split(".")[-1]
     filename = f"{uuid4()}.{ext}"
 
     # Construct absolute path inside app/uploads/<folder>
     relative_path = os.path.join("uploads", folder, filename)
     absolute_path = os.path.join(BASE_DIR, relative_path)
+    temp_path = f"{absolute_path}.part"
 
     # Ensure the folder exists
-    os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+    await asyncio.to_thread(os.makedirs, os.path.dirname(absolute_path), exist_ok=True)
+
+    f = await asyncio.to_thread(open, temp_path, "wb")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"{file.filename} exceeds the upload size limit")
+            await asyncio.to_thread(write_chunk, f, digest, chunk)
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.replace, temp_path, absolute_path)
+        digest_cache.put(absolute_path, await asyncio.to_thread(os.stat, absolute_path), digest.hexdigest())
+    except BaseException:
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(remove_file, temp_path)
+        raise
+
+    return relative_path, size  # relative path for storing in DB
 
-    with open(absolute_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
 
-    return relative_path  # return relative path for storing in DB
+def write_chunk(f, digest, chunk: bytes):
+    f.write(chunk)
+    digest.update(chunk)
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
 
 from uuid import UUID
@@ -82,56 +170,85 @@ async def update_or_create_media(
     mobile_number: Optional[str] = None,
     media_id: Optional[UUID] = None
 ):
-    from .models import MediaData
+    # Files are saved one at a time against a shared per-request budget; if
+    # any of them fails, the ones already written are removed again
+    saved = []
+    remaining = MAX_UPLOAD_REQUEST_BYTES
 
-    result = await db.execute(select(MediaData).where(MediaData.user_id == user_id))
-    media = result.scalar_one_or_none()
+    async def save_all(files, folder):
+        nonlocal remaining
+        paths = []
+        for file in files:
+            if not file.filename:
+                continue
+            path, size = await save_file(file, folder, min(MAX_UPLOAD_FILE_BYTES, remaining))
+            saved.append(path)
+            paths.append(path)
+            remaining -= size
+        return paths
 
-    if not media:
-        media = MediaData(
-            user_id=user_id,
-            media_id=str(media_id) if media_id else None,
-        )
-    elif media_id and str(media.media_id) != str(media_id):
-        media.image_path = []
-        media.audio_path = []
-        media.mobile_number = None
-        media.media_id = str(media_id)
-
-    # if images:
-    #     image_path = []
-    #     for image in images:
-    #         if image.filename:
-    #             path = await save_file(image, "images")
-    #             print(path,"image path")
-    #             image_path.append(path)
-    #     print(image_path,"list of paths")
-    #     media.image_path = image_path
-    #
-    # if audios:
-    #     audio_paths = []
-    #     for audio in audios:
-    #         if audio.filename:
-    #             path = await save_file(audio, "audio")
-    #             print(path,"audio path")
-    #             audio_paths.append(path)
-    #     media.audio_path = audio_paths
-    if images:
-        media.image_path = [
-            await save_file(image, "images")
-            for image in images if image.filename
-        ]
-    if audios:
-        media.audio_path = [
-            await save_file(audio, "audio")
-            for audio in audios if audio.filename
-        ]
+    try:
+        image_paths = await save_all(images, "images") if images else None
+        audio_paths = await save_all(audios, "audio") if audios else None
+    except BaseException:
+        for path in saved:
+            await asyncio.to_thread(remove_file, os.path.join(BASE_DIR, path))
+        raise
+    media = await upsert_media(
+        db, user_id,
+        media_id=str(media_id) if media_id else None,
+        image_paths=image_paths,
+        audio_paths=audio_paths,
+        mobile_number=mobile_number,
+    )
+    # Thumbnails and previews render in the background from here on
+    for path in image_paths or []:
+        image_derivatives.enqueue(path)
+    return media
+
+
+async def upsert_media(
+    db: AsyncSession,
+    user_id: int,
+    media_id: Optional[str] = None,
+    image_paths: Optional[List[str]] = None,
+    audio_paths: Optional[List[str]] = None,
+    mobile_number: Optional[str] = None,
+) -> MediaData:
+    # One statement. A different media_id starts a new request, so fields not
+    # given here are cleared; otherwise they are left as they are.
+    values = {"user_id": user_id, "media_id": media_id}
+    if image_paths is not None:
+        values["image_path"] = image_paths
+    if audio_paths is not None:
+        values["audio_path"] = audio_paths
     if mobile_number is not None:
-        media.mobile_number = mobile_number
-    print(type(media.image_path), media.image_path)
-    db.add(media)
+        values["mobile_number"] = mobile_number
+
+    stmt = pg_insert(MediaData).values(**values)
+    new_request = and_(
+        stmt.excluded.media_id.isnot(None),
+        MediaData.media_id.is_distinct_from(stmt.excluded.media_id),
+    )
+    empty = cast(literal_column("'{}'"), ARRAY(String))
+
+    def field(name, reset_value):
+        if name in values:
+            return stmt.excluded[name]
+        return case((new_request, reset_value), else_=getattr(MediaData, name))
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MediaData.user_id],
+        set_={
+            "media_id": func.coalesce(stmt.excluded.media_id, MediaData.media_id),
+            "image_path": field("image_path", empty),
+            "audio_path": field("audio_path", empty),
+            "mobile_number": field("mobile_number", null()),
+        },
+    ).returning(MediaData)
+    result = await db.execute(stmt, execution_options={"populate_existing": True})
+    media = result.scalar_one()
     await db.commit()
-    await db.refresh(media)
     return media
 
 
@@ -151,5 +268,30 @@ async def get_all_drivers(db: AsyncSession):
     return result.scalars().all()
 
 
+async def get_nearest_available_drivers(
+    db: AsyncSession, lat: float, lon: float, k: int, radius_km: float, fresh_after: Optional[datetime] = None
+):
+    # Uses the earthdistance GiST index from migrations/001_driver_locations_earthdistance.sql.
+    # With fresh_after, drivers whose position is older are left out.
+    user_point = func.ll_to_earth(lat, lon)
+    driver_point = func.ll_to_earth(DriverLocation.latitude, DriverLocation.longitude)
+    query = (
+        select(Driver)
+        .join(Driver.location)
+        .options(contains_eager(Driver.location))
+        .where(
+            Driver.is_available == True,
+            func.earth_box(user_point, radius_km * 1000).op("@>")(driver_point),
+            func.earth_distance(user_point, driver_point) <= radius_km * 1000,
+        )
+        .order_by(func.earth_distance(user_point, driver_point))
+        .limit(k)
+    )
+    if fresh_after is not None:
+        query = query.where(DriverLocation.updated_at >= fresh_after)
+    result = await db.execute(query)
+    return result.scalars().all()
+
+
 
 
@@ -0,0 +1,149 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+# Processes decoding and resizing uploads; 0 renders in a thread instead
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv("IMAGE_DERIVATIVE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Longest edge in pixels of each derivative
+IMAGE_THUMBNAIL_PX = int(os.getenv("IMAGE_THUMBNAIL_PX", "320"))
+IMAGE_PREVIEW_PX = int(os.getenv("IMAGE_PREVIEW_PX", "1280"))
+# "webp" or "jpeg"
+IMAGE_DERIVATIVE_FORMAT = os.getenv("IMAGE_DERIVATIVE_FORMAT", "webp").lower()
+IMAGE_DERIVATIVE_QUALITY = int(os.getenv("IMAGE_DERIVATIVE_QUALITY", "80"))
+# How long a sent message waits for derivatives still being rendered before
+# giving up on the follow-up that carries them
+IMAGE_DERIVATIVE_WAIT_SECONDS = float(os.getenv("IMAGE_DERIVATIVE_WAIT_SECONDS", "10"))
+# Largest upload (width x height) that is decoded at all; a 48 MP phone
+# photo fits, a decompression bomb does not
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "50000000"))
+
+# Pillow's own guard (default ~179 MP) refuses to open anything over twice
+# this; render_derivatives() refuses the rest. Set on import, so in the
+# worker processes too.
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+# Smallest first
+DERIVATIVE_SIZES = {"thumb": IMAGE_THUMBNAIL_PX, "preview": IMAGE_PREVIEW_PX}
+EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def derivative_path(stored_path: str, kind: str) -> str:
+    # Next to the original: uploads/images/<uuid>.png -> uploads/images/<uuid>.thumb.webp
+    stem = os.path.splitext(stored_path.strip())[0]
+    return f"{stem}.{kind}.{EXTENSIONS[IMAGE_DERIVATIVE_FORMAT]}"
+
+
+def render_derivatives(source: str, targets: list[tuple[str, int]]) -> int:
+    # Runs in a worker process. Decodes once, bakes the EXIF orientation
+    # into the pixels and writes each target without any metadata (EXIF,
+    # GPS, XMP, ICC). Returns the bytes written.
+    written = 0
+    with Image.open(source) as original:
+        # Only the header has been read so far
+        width, height = original.size
+        if width * height > IMAGE_MAX_PIXELS:
+            raise ValueError(f"{width}x{height} is over IMAGE_MAX_PIXELS ({IMAGE_MAX_PIXELS})")
+        largest = max(size for _, size in targets)
+        # JPEG can decode straight at a reduced scale, much cheaper than
+        # decoding full resolution and shrinking afterwards
+        original.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(original)
+        if IMAGE_DERIVATIVE_FORMAT == "jpeg" or not image.has_transparency_data:
+            image = image.convert("RGB")
+        else:
+            image = image.convert("RGBA")
+        image.info = {}
+        for path, size in targets:
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+            temp_path = f"{path}.part"
+            resized.save(temp_path, format=IMAGE_DERIVATIVE_FORMAT.upper(), quality=IMAGE_DERIVATIVE_QUALITY)
+            os.replace(temp_path, path)
+            written += os.path.getsize(path)
+    return written
+
+
+class ImageDerivatives:
+    # Thumbnail and preview for every uploaded image, rendered in a process
+    # pool so decoding phone photos never holds up a request worker. Uploads
+    # enqueue their files as soon as they are saved; senders never wait for
+    # them and follow up once rendering() is done.
+
+    def __init__(self):
+        self.executor: ProcessPoolExecutor | None = None
+        self.pending: dict[str, asyncio.Future] = {}
+        self.counters = {"rendered": 0, "failed": 0, "bytes_written": 0, "render_seconds": 0.0}
+
+    def _targets(self, stored_path: str) -> list[tuple[str, int]]:
+        return [
+            (os.path.join(BASE_DIR, derivative_path(stored_path, kind)), size)
+            for kind, size in DERIVATIVE_SIZES.items()
+        ]
+
+    def enqueue(self, stored_path: str) -> asyncio.Future:
+        # One render per file, however many callers ask for it
+        future = self.pending.get(stored_path)
+        if future is None:
+            future = asyncio.ensure_future(self._render(stored_path))
+            self.pending[stored_path] = future
+            future.add_done_callback(lambda _: self.pending.pop(stored_path, None))
+        return future
+
+    async def _render(self, stored_path: str) -> bool:
+        targets = self._targets(stored_path)
+        if all(os.path.exists(path) for path, _ in targets):
+            return True
+        source = os.path.join(BASE_DIR, stored_path.strip())
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            written = await loop.run_in_executor(self.executor, render_derivatives, source, targets)
+        except Exception as e:
+            self.counters["failed"] += 1
+            print(f"Failed to render derivatives for {stored_path}: {e}")
+            return False
+        self.counters["rendered"] += 1
+        self.counters["bytes_written"] += written
+        self.counters["render_seconds"] += time.perf_counter() - started
+        return True
+
+    def rendering(self, stored_paths: list[str]) -> list[asyncio.Future]:
+        # Renders still needed for these files, started if nobody asked yet
+        return [
+            self.enqueue(path) for path in stored_paths
+            if not all(os.path.exists(target) for target, _ in self._targets(path))
+        ]
+
+    async def start(self):
+        if self.executor is None and IMAGE_DERIVATIVE_WORKERS > 0:
+            # spawn: forking a process that runs an event loop and threads is unsafe
+            self.executor = ProcessPoolExecutor(
+                max_workers=IMAGE_DERIVATIVE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    async def stop(self):
+        if self.pending:
+            await asyncio.gather(*self.pending.values(), return_exceptions=True)
+        if self.executor is not None:
+            await asyncio.to_thread(self.executor.shutdown)
+            self.executor = None
+
+    def stats(self) -> dict:
+        rendered = self.counters["rendered"]
+        return {
+            "workers": IMAGE_DERIVATIVE_WORKERS,
+            "format": IMAGE_DERIVATIVE_FORMAT,
+            "rendering": len(self.pending),
+            **self.counters,
+            "render_seconds": round(self.counters["render_seconds"], 3),
+            "avg_render_ms": round(self.counters["render_seconds"] / rendered * 1000, 1) if rendered else None,
+        }
+
+
+image_derivatives = ImageDerivatives()
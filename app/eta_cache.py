@@ -0,0 +1,125 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+
+ETA_CACHE_CELL_METERS = float(os.getenv("ETA_CACHE_CELL_METERS", "100"))
+ETA_CACHE_TTL_SECONDS = float(os.getenv("ETA_CACHE_TTL_SECONDS", "300"))
+ETA_CACHE_MAX_ENTRIES = int(os.getenv("ETA_CACHE_MAX_ENTRIES", "50000"))
+
+METERS_PER_DEGREE_LAT = 111_320.0
+
+
+class EtaCache:
+    # ETA minutes keyed by origin/destination snapped to a grid of
+    # `cell_meters`. Entries expire after `ttl_seconds` and the least recently
+    # used ones are evicted past `max_entries`. Lookups for a key that is
+    # already being fetched wait on that fetch instead of starting another.
+
+    def __init__(
+        self,
+        cell_meters: float = ETA_CACHE_CELL_METERS,
+        ttl_seconds: float = ETA_CACHE_TTL_SECONDS,
+        max_entries: int = ETA_CACHE_MAX_ENTRIES,
+    ):
+        self.cell_meters = cell_meters
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple, tuple[float, int]] = OrderedDict()
+        self.inflight: dict[tuple, asyncio.Future] = {}
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+            "shared_inflight": 0,
+        }
+
+    def _snap(self, lat: float, lon: float) -> tuple[int, int]:
+        lat_step = self.cell_meters / METERS_PER_DEGREE_LAT
+        row = math.floor(lat / lat_step)
+        # Longitude step widens with latitude so cells stay roughly square;
+        # use the row's latitude so both ends of a key agree on the step.
+        lon_step = lat_step / max(math.cos(math.radians(row * lat_step)), 0.01)
+        return row, math.floor(lon / lon_step)
+
+    def key(self, origin_lat, origin_lon, dest_lat, dest_lon) -> tuple:
+        return self._snap(origin_lat, origin_lon) + self._snap(dest_lat, dest_lon)
+
+    def get(self, key: tuple):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self.entries[key]
+            self.counters["expired"] += 1
+            self.counters["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return value
+
+    def set(self, key: tuple, value: int):
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def pending(self, key: tuple):
+        # Future of an in-flight lookup for this key, if another caller owns one
+        future = self.inflight.get(key)
+        if future is not None:
+            self.counters["shared_inflight"] += 1
+        return future
+
+    def claim(self, key: tuple) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        return future
+
+    def release(self, key: tuple, value=None):
+        # Publish the outcome of a claimed lookup; None means it failed and
+        # waiters should fall back on their own.
+        if value is not None:
+            self.set(key, value)
+        future = self.inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    async def get_or_fetch(self, key: tuple, fetch):
+        value = self.get(key)
+        if value is not None:
+            return value
+        future = self.pending(key)
+        if future is not None:
+            value = await asyncio.shield(future)
+            if value is not None:
+                return value
+            return await fetch()
+
+        self.claim(key)
+        value = None
+        try:
+            value = await fetch()
+            return value
+        finally:
+            self.release(key, value)
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "cell_meters": self.cell_meters,
+            "ttl_seconds": self.ttl_seconds,
+            "inflight": len(self.inflight),
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+            **self.counters,
+        }
+
+
+eta_cache = EtaCache()
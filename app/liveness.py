@@ -0,0 +1,134 @@
+import asyncio
+import math
+import os
+from datetime import datetime, timedelta
+
+from .spatial_index import driver_index
+
+# Drivers silent for this long drop out of dispatch (0 = off)
+DRIVER_LIVENESS_TTL_SECONDS = float(os.getenv("DRIVER_LIVENESS_TTL_SECONDS", "90"))
+# Wheel resolution; a driver expires between TTL and TTL + one tick after its last ping
+DRIVER_LIVENESS_TICK_SECONDS = float(os.getenv("DRIVER_LIVENESS_TICK_SECONDS", "1"))
+
+
+def live_cutoff() -> datetime | None:
+    # Dispatch treats a driver as live if driver_locations.updated_at is newer
+    # than this. That table is written by every worker (the live location
+    # store flushes well within the TTL), so it holds for heartbeats that
+    # reached another process too; the wheel below only sees this one's.
+    if DRIVER_LIVENESS_TTL_SECONDS <= 0:
+        return None
+    return datetime.utcnow() - timedelta(seconds=DRIVER_LIVENESS_TTL_SECONDS)
+
+
+class DriverLiveness:
+    # Hashed timing wheel of driver heartbeats. A ping moves the driver into
+    # the slot that comes due TTL from now and each tick expires one slot, so
+    # both pings and expiry cost O(1) per driver regardless of fleet size.
+    # Expired drivers leave this process's spatial index and rejoin on their
+    # next ping. Only pings that reach this process count, which is why
+    # dispatch with several workers reads candidates from Postgres and
+    # checks live_cutoff() instead of trusting the index.
+
+    def __init__(self, ttl_seconds: float = DRIVER_LIVENESS_TTL_SECONDS,
+                 tick_seconds: float = DRIVER_LIVENESS_TICK_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.tick_seconds = tick_seconds
+        self.ticks_to_expire = max(1, math.ceil(ttl_seconds / tick_seconds)) if ttl_seconds > 0 else 0
+        self.wheel: list[set[int]] = [set() for _ in range(self.ticks_to_expire + 1)]
+        self.slot_of: dict[int, int] = {}
+        self.cursor = 0
+        # Expired while still connected; counted as rejoined when they ping
+        self.stale: set[int] = set()
+        # Closed their socket but still in the wheel; not kept as stale
+        self.departed: set[int] = set()
+        self.task: asyncio.Task | None = None
+        # Called with each expired driver id, e.g. to drop cached positions
+        self.on_expire = None
+        self.counters = {"expired": 0, "rejoined": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ticks_to_expire > 0
+
+    def touch(self, driver_id: int) -> bool:
+        # Returns True if the driver had gone stale and is now back
+        if not self.enabled:
+            return False
+        slot = (self.cursor + self.ticks_to_expire) % len(self.wheel)
+        current = self.slot_of.get(driver_id)
+        if current != slot:
+            if current is not None:
+                self.wheel[current].discard(driver_id)
+            self.wheel[slot].add(driver_id)
+            self.slot_of[driver_id] = slot
+        self.departed.discard(driver_id)
+        if driver_id in self.stale:
+            self.stale.discard(driver_id)
+            self.counters["rejoined"] += 1
+            return True
+        return False
+
+    def forget(self, driver_id: int):
+        slot = self.slot_of.pop(driver_id, None)
+        if slot is not None:
+            self.wheel[slot].discard(driver_id)
+        self.stale.discard(driver_id)
+        self.departed.discard(driver_id)
+
+    def disconnected(self, driver_id: int):
+        # The driver still expires from dispatch on schedule unless it pings
+        # again (e.g. over HTTP), but is not remembered once it has
+        self.stale.discard(driver_id)
+        if driver_id in self.slot_of:
+            self.departed.add(driver_id)
+
+    def is_live(self, driver_id: int) -> bool:
+        return not self.enabled or driver_id in self.slot_of
+
+    def tick(self) -> list[int]:
+        self.cursor = (self.cursor + 1) % len(self.wheel)
+        expired = list(self.wheel[self.cursor])
+        self.wheel[self.cursor] = set()
+        for driver_id in expired:
+            del self.slot_of[driver_id]
+            if driver_id in self.departed:
+                self.departed.discard(driver_id)
+            else:
+                self.stale.add(driver_id)
+            driver_index.remove(driver_id)
+            if self.on_expire is not None:
+                self.on_expire(driver_id)
+        if expired:
+            self.counters["expired"] += len(expired)
+            print(f"{len(expired)} drivers went stale after {self.ttl_seconds}s without a heartbeat")
+        return expired
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            self.tick()
+
+    async def start(self, on_expire=None):
+        self.on_expire = on_expire
+        if self.enabled and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "ttl_seconds": self.ttl_seconds,
+            "live": len(self.slot_of),
+            "stale": len(self.stale),
+            "departed": len(self.departed),
+            **self.counters,
+        }
+
+
+driver_liveness = DriverLiveness()
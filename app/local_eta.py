@@ -0,0 +1,83 @@
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+from .spatial_index import EARTH_RADIUS_KM
+
+LOCAL_ETA_SPEED_KMH = float(os.getenv("LOCAL_ETA_SPEED_KMH", "40"))
+LOCAL_ETA_CIRCUITY = float(os.getenv("LOCAL_ETA_CIRCUITY", "1.3"))
+# Optional JSON file with per-region and time-of-day factors, e.g.
+# {"regions": [{"name": "kochi", "bbox": [9.85, 76.2, 10.1, 76.4],
+#               "speed_kmh": 25, "circuity": 1.4}],
+#  "hourly_speed_factor": {"8": 0.7, "9": 0.7, "18": 0.75}}
+LOCAL_ETA_PROFILE = os.getenv("LOCAL_ETA_PROFILE")
+
+
+class LocalEtaEngine:
+    # Straight-line ETA for a whole candidate array at once: haversine
+    # distance times a road circuity factor, divided by a speed. Regions
+    # (lat/lon bounding boxes, matched on the destination) and hour-of-day
+    # factors adjust the defaults.
+
+    def __init__(
+        self,
+        speed_kmh: float = LOCAL_ETA_SPEED_KMH,
+        circuity: float = LOCAL_ETA_CIRCUITY,
+        regions: list[dict] | None = None,
+        hourly_speed_factor: dict[int, float] | None = None,
+    ):
+        self.speed_kmh = speed_kmh
+        self.circuity = circuity
+        self.regions = regions or []
+        self.hourly_speed_factor = hourly_speed_factor or {}
+
+    @classmethod
+    def from_profile(cls, path: str | None = LOCAL_ETA_PROFILE):
+        if not path:
+            return cls()
+        with open(path) as f:
+            profile = json.load(f)
+        return cls(
+            speed_kmh=profile.get("speed_kmh", LOCAL_ETA_SPEED_KMH),
+            circuity=profile.get("circuity", LOCAL_ETA_CIRCUITY),
+            regions=profile.get("regions", []),
+            hourly_speed_factor={int(h): f for h, f in profile.get("hourly_speed_factor", {}).items()},
+        )
+
+    def _factors(self, lat: float, lon: float, now: datetime | None):
+        speed, circuity = self.speed_kmh, self.circuity
+        for region in self.regions:
+            south, west, north, east = region["bbox"]
+            if south <= lat <= north and west <= lon <= east:
+                speed = region.get("speed_kmh", speed)
+                circuity = region.get("circuity", circuity)
+                break
+        hour = (now or datetime.now()).hour
+        return speed * self.hourly_speed_factor.get(hour, 1.0), circuity
+
+    def estimate_minutes(self, dest_lat: float, dest_lon: float, lats, lons, now: datetime | None = None) -> np.ndarray:
+        # lats/lons: origins (driver positions) as array-likes of equal length
+        speed, circuity = self._factors(dest_lat, dest_lon, now)
+        phi1 = np.radians(np.asarray(lats, dtype=np.float64))
+        lambda1 = np.radians(np.asarray(lons, dtype=np.float64))
+        phi2 = np.radians(dest_lat)
+        lambda2 = np.radians(dest_lon)
+        a = (
+            np.sin((phi2 - phi1) / 2) ** 2
+            + np.cos(phi1) * np.cos(phi2) * np.sin((lambda2 - lambda1) / 2) ** 2
+        )
+        km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+        return np.rint(km * circuity / speed * 60).astype(np.int64)
+
+    def score(self, dest_lat: float, dest_lon: float, drivers, now: datetime | None = None) -> dict[int, int]:
+        # drivers: list of (driver_id, latitude, longitude)
+        if not drivers:
+            return {}
+        ids, lats, lons = zip(*drivers)
+        minutes = self.estimate_minutes(dest_lat, dest_lon, lats, lons, now)
+        return dict(zip(ids, minutes.tolist()))
+
+
+local_eta_engine = LocalEtaEngine.from_profile()
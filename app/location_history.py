@@ -0,0 +1,186 @@
+import asyncio
+import os
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from .db import AsyncSessionLocal
+from .models import DriverLocationHistory
+from .spatial_index import haversine_km
+
+# Downsampling: keep a ping only if the driver moved this far...
+HISTORY_MIN_DISTANCE_M = float(os.getenv("HISTORY_MIN_DISTANCE_M", "25"))
+# ...or this much time passed since the last kept point
+HISTORY_MIN_INTERVAL_SECONDS = float(os.getenv("HISTORY_MIN_INTERVAL_SECONDS", "30"))
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "30"))
+HISTORY_RETENTION_CHECK_SECONDS = float(os.getenv("HISTORY_RETENTION_CHECK_SECONDS", "21600"))
+# Longest start..end window one track request may ask for
+HISTORY_MAX_WINDOW_HOURS = float(os.getenv("HISTORY_MAX_WINDOW_HOURS", "24"))
+# Cap on points held while the database is unreachable
+HISTORY_MAX_BUFFER = int(os.getenv("HISTORY_MAX_BUFFER", "200000"))
+
+TABLE = DriverLocationHistory.__tablename__
+
+
+def partition_name(day: date) -> str:
+    return f"{TABLE}_{day:%Y%m%d}"
+
+
+class LocationHistory:
+    # Downsampled driver tracks, buffered in memory and bulk-inserted into
+    # the day-partitioned driver_location_history table whenever the live
+    # location flusher runs, in a transaction of their own so a history
+    # failure never holds up live positions. Old days are removed by
+    # dropping their partition.
+
+    def __init__(self):
+        self.last_kept: dict[int, tuple[float, float, datetime]] = {}
+        self.buffer: list[dict] = []
+        self.partitions: set[date] = set()
+        self.retention_task: asyncio.Task | None = None
+        self.counters = {
+            "pings": 0, "kept": 0, "inserted": 0, "write_errors": 0, "dropped_buffer": 0, "dropped_invalid": 0,
+            "partitions_dropped": 0,
+        }
+
+    def observe(self, driver_id: int, lat: float, lon: float, recorded_at: datetime):
+        self.counters["pings"] += 1
+        last = self.last_kept.get(driver_id)
+        if last:
+            last_lat, last_lon, last_at = last
+            moved_m = haversine_km(last_lat, last_lon, lat, lon) * 1000
+            elapsed = (recorded_at - last_at).total_seconds()
+            if moved_m < HISTORY_MIN_DISTANCE_M and elapsed < HISTORY_MIN_INTERVAL_SECONDS:
+                return
+        self.last_kept[driver_id] = (lat, lon, recorded_at)
+        self.buffer.append({"driver_id": driver_id, "recorded_at": recorded_at, "latitude": lat, "longitude": lon})
+        self.counters["kept"] += 1
+        if len(self.buffer) > HISTORY_MAX_BUFFER:
+            overflow = len(self.buffer) - HISTORY_MAX_BUFFER
+            del self.buffer[:overflow]
+            self.counters["dropped_buffer"] += overflow
+
+    def forget(self, driver_id: int):
+        # The next ping after this one is always kept
+        self.last_kept.pop(driver_id, None)
+
+    def take(self) -> list[dict]:
+        rows, self.buffer = self.buffer, []
+        return rows
+
+    def restore(self, rows: list[dict]):
+        # Put back rows whose insert failed, ahead of anything newer
+        self.buffer = (rows + self.buffer)[-HISTORY_MAX_BUFFER:]
+
+    async def ensure_partitions(self, db: AsyncSession, days) -> set[date]:
+        # Returns the days it created; the caller adds them to self.partitions
+        # once its transaction has committed
+        created = set()
+        for day in sorted(set(days) - self.partitions):
+            await db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+            ))
+            created.add(day)
+        return created
+
+    async def flush(self):
+        rows = self.take()
+        if not rows:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                created = await self.ensure_partitions(db, {row["recorded_at"].date() for row in rows})
+                # A point already written (e.g. by a flush whose commit was
+                # reported failed) is skipped instead of failing the batch
+                await db.execute(pg_insert(DriverLocationHistory).on_conflict_do_nothing(), rows)
+                await db.commit()
+        except (IntegrityError, DataError) as e:
+            # The same rows would fail again on every retry
+            print(f"Dropping {len(rows)} location history points that can't be written: {e}")
+            self.counters["dropped_invalid"] += len(rows)
+            return
+        except Exception as e:
+            print(f"Failed to write {len(rows)} location history points: {e}")
+            self.counters["write_errors"] += 1
+            self.restore(rows)
+            return
+        self.partitions |= created
+        self.counters["inserted"] += len(rows)
+
+    async def track(self, db: AsyncSession, driver_id: int, start: datetime, end: datetime) -> dict:
+        # Stored timestamps are naive UTC
+        start, end = (
+            t.astimezone(timezone.utc).replace(tzinfo=None) if t.tzinfo else t
+            for t in (start, end)
+        )
+        result = await db.execute(
+            select(
+                DriverLocationHistory.recorded_at,
+                DriverLocationHistory.latitude,
+                DriverLocationHistory.longitude,
+            )
+            .where(
+                DriverLocationHistory.driver_id == driver_id,
+                DriverLocationHistory.recorded_at >= start,
+                DriverLocationHistory.recorded_at < end,
+            )
+            .order_by(DriverLocationHistory.recorded_at)
+        )
+        rows = result.all()
+        # Columnar payload: parallel arrays instead of one object per point
+        return {
+            "driver_id": driver_id,
+            "t": [round(row.recorded_at.replace(tzinfo=timezone.utc).timestamp(), 3) for row in rows],
+            "lat": [round(row.latitude, 6) for row in rows],
+            "lon": [round(row.longitude, 6) for row in rows],
+        }
+
+    async def drop_expired_partitions(self, retention_days: int = HISTORY_RETENTION_DAYS):
+        cutoff = datetime.utcnow().date() - timedelta(days=retention_days)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = :parent"
+            ), {"parent": TABLE})
+            for name in result.scalars().all():
+                try:
+                    day = datetime.strptime(name.rsplit("_", 1)[-1], "%Y%m%d").date()
+                except ValueError:
+                    continue
+                if day < cutoff:
+                    await db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                    self.partitions.discard(day)
+                    self.counters["partitions_dropped"] += 1
+                    print(f"Dropped location history partition {name}")
+            await db.commit()
+
+    async def _retention_loop(self):
+        while True:
+            try:
+                await self.drop_expired_partitions()
+            except Exception as e:
+                print(f"Location history retention failed: {e}")
+            await asyncio.sleep(HISTORY_RETENTION_CHECK_SECONDS)
+
+    async def start(self):
+        if self.retention_task is None:
+            self.retention_task = asyncio.create_task(self._retention_loop())
+
+    async def stop(self):
+        if self.retention_task is not None:
+            self.retention_task.cancel()
+            await asyncio.gather(self.retention_task, return_exceptions=True)
+            self.retention_task = None
+
+    def stats(self) -> dict:
+        return {"buffered": len(self.buffer), "known_partitions": len(self.partitions), **self.counters}
+
+
+location_history = LocationHistory()
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from .crud import upsert_driver_locations
+from .db import AsyncSessionLocal
+from .location_history import location_history
+
+LOCATION_FLUSH_INTERVAL_SECONDS = float(os.getenv("LOCATION_FLUSH_INTERVAL_SECONDS", "5"))
+# Flush early once the oldest unflushed ping is this old...
+LOCATION_MAX_LAG_SECONDS = float(os.getenv("LOCATION_MAX_LAG_SECONDS", "15"))
+# ...or once this many drivers have unflushed pings
+LOCATION_FLUSH_MAX_PENDING = int(os.getenv("LOCATION_FLUSH_MAX_PENDING", "5000"))
+# Rows per upsert statement; 4 parameters a row must stay under asyncpg's
+# 32767 bind parameters
+LOCATION_UPSERT_BATCH_ROWS = int(os.getenv("LOCATION_UPSERT_BATCH_ROWS", "2000"))
+
+
+class LiveLocationStore:
+    # Latest position per driver, kept in memory and written behind to
+    # driver_locations in one transaction of bulk upserts per flush, followed
+    # by the downsampled location history. Dispatch reads positions from
+    # here, so Postgres load follows the flush rate, not the ping rate.
+
+    def __init__(
+        self,
+        flush_interval: float = LOCATION_FLUSH_INTERVAL_SECONDS,
+        max_lag: float = LOCATION_MAX_LAG_SECONDS,
+        max_pending: int = LOCATION_FLUSH_MAX_PENDING,
+    ):
+        self.flush_interval = flush_interval
+        self.max_lag = max_lag
+        self.max_pending = max_pending
+        self.positions: dict[int, tuple[float, float, datetime]] = {}
+        self.dirty: set[int] = set()
+        # Went silent while a write was still pending; dropped once written
+        self.evicting: set[int] = set()
+        self.oldest_dirty_at: float | None = None
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.flushing: asyncio.Future | None = None
+        self.counters = {"pings": 0, "flushes": 0, "rows_flushed": 0, "flush_errors": 0}
+
+    def record(self, driver_id: int, lat: float, lon: float):
+        now_utc = datetime.utcnow()
+        self.positions[driver_id] = (lat, lon, now_utc)
+        self.evicting.discard(driver_id)
+        location_history.observe(driver_id, lat, lon, now_utc)
+        self.dirty.add(driver_id)
+        self.counters["pings"] += 1
+        now = time.monotonic()
+        if self.oldest_dirty_at is None:
+            self.oldest_dirty_at = now
+        if len(self.dirty) >= self.max_pending or now - self.oldest_dirty_at >= self.max_lag:
+            self.wakeup.set()
+
+    def forget(self, driver_id: int):
+        # Called when the driver expires from liveness, so memory follows the
+        # drivers online, not every driver ever seen. Dispatch falls back to
+        # the stored position.
+        location_history.forget(driver_id)
+        if driver_id in self.dirty:
+            self.evicting.add(driver_id)
+        else:
+            self.positions.pop(driver_id, None)
+
+    def get(self, driver_id: int):
+        position = self.positions.get(driver_id)
+        return (position[0], position[1]) if position else None
+
+    def position_of(self, driver):
+        # Live position if we have one, else what the database last had
+        live = self.get(driver.id)
+        if live:
+            return live
+        if driver.location and driver.location.latitude is not None and driver.location.longitude is not None:
+            return driver.location.latitude, driver.location.longitude
+        return None
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        # Let a flush that was under way finish, then write what's left;
+        # nothing recorded may be lost on clean shutdown
+        if self.flushing is not None:
+            await asyncio.gather(self.flushing, return_exceptions=True)
+            self.flushing = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            # Shielded: the flush owns driver ids already taken out of
+            # dirty, so stop() must not cancel it halfway
+            self.flushing = asyncio.ensure_future(self.flush())
+            await asyncio.shield(self.flushing)
+
+    async def flush(self):
+        await self._flush_positions()
+        # Own transaction, so a failing history write can't hold up positions
+        await location_history.flush()
+
+    async def _flush_positions(self):
+        if not self.dirty:
+            return
+        driver_ids, self.dirty = self.dirty, set()
+        self.oldest_dirty_at = None
+        rows = []
+        for driver_id in driver_ids:
+            lat, lon, updated_at = self.positions[driver_id]
+            rows.append({"driver_id": driver_id, "latitude": lat, "longitude": lon, "updated_at": updated_at})
+
+        try:
+            async with AsyncSessionLocal() as db:
+                for i in range(0, len(rows), LOCATION_UPSERT_BATCH_ROWS):
+                    await upsert_driver_locations(db, rows[i:i + LOCATION_UPSERT_BATCH_ROWS])
+                await db.commit()
+        except Exception as e:
+            print(f"Failed to flush {len(rows)} driver locations: {e}")
+            self.counters["flush_errors"] += 1
+            # Retry on the next flush; newer pings for these drivers win anyway
+            self.dirty |= driver_ids
+            if self.oldest_dirty_at is None:
+                self.oldest_dirty_at = time.monotonic()
+            return
+        for driver_id in driver_ids & self.evicting:
+            if driver_id not in self.dirty:
+                self.positions.pop(driver_id, None)
+                self.evicting.discard(driver_id)
+        self.counters["flushes"] += 1
+        self.counters["rows_flushed"] += len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "drivers": len(self.positions),
+            "pending": len(self.dirty),
+            "lag_seconds": round(time.monotonic() - self.oldest_dirty_at, 3) if self.oldest_dirty_at else 0,
+            "flush_interval_seconds": self.flush_interval,
+            "max_lag_seconds": self.max_lag,
+            **self.counters,
+        }
+
+
+live_locations = LiveLocationStore()
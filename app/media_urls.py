@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import hmac
+import mimetypes
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers, QueryParams
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+
+from .auth import SECRET_KEY
+from .derivatives import DERIVATIVE_SIZES, derivative_path
+
+# "url" sends drivers signed download links, "inline" streams the bytes
+# over the socket as binary frames
+MEDIA_DELIVERY = os.getenv("MEDIA_DELIVERY", "url")
+MEDIA_URL_SECRET = os.getenv("MEDIA_URL_SECRET") or SECRET_KEY
+MEDIA_URL_TTL_SECONDS = int(os.getenv("MEDIA_URL_TTL_SECONDS", "900"))
+# Prefix for the links, e.g. https://api.example.com; relative when empty
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "").rstrip("/")
+# Refuse unsigned /uploads requests. Off by default: stored audio paths and
+# the links older clients build are served unsigned; a signature that is
+# present is always checked.
+MEDIA_REQUIRE_SIGNED_URLS = os.getenv("MEDIA_REQUIRE_SIGNED_URLS", "0") == "1"
+MEDIA_DIGEST_CACHE_SIZE = int(os.getenv("MEDIA_DIGEST_CACHE_SIZE", "10000"))
+HASH_CHUNK_BYTES = 1024 * 1024
+
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+
+
+def _signature(path: str, expires: int) -> str:
+    return hmac.new(MEDIA_URL_SECRET.encode(), f"{path}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def signed_media_url(stored_path: str) -> tuple[str, int]:
+    # stored_path is what the database holds, e.g. "uploads/images/<uuid>.png".
+    # Expiry is rounded up to a TTL boundary so re-sends within a window get
+    # the same URL and hit the client's HTTP cache.
+    path = stored_path.strip().lstrip("/")
+    if path.startswith("uploads/"):
+        path = path[len("uploads/"):]
+    expires = (int(time.time()) // MEDIA_URL_TTL_SECONDS + 2) * MEDIA_URL_TTL_SECONDS
+    query = urlencode({"exp": expires, "sig": _signature(path, expires)})
+    return f"{MEDIA_BASE_URL}/uploads/{path}?{query}", expires
+
+
+def verify_media_signature(path: str, expires, signature) -> bool:
+    if not expires or not signature:
+        return False
+    try:
+        expires = int(expires)
+    except ValueError:
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_signature(path, expires), signature)
+
+
+def stored_image_paths(image_path) -> list[str]:
+    # "uploads/images/<file>" for each entry of MediaData.image_path. Older
+    # rows hold the Postgres array literal "{a,b}" as one string.
+    return [
+        os.path.join("uploads", "images", os.path.basename(part.strip()))
+        for entry in image_path or []
+        for part in entry.strip("{}").split(",")
+        if part.strip()
+    ]
+
+
+class DigestCache:
+    # sha256 per file, keyed by path, mtime and size so a rewritten file is
+    # never served with a stale hash
+    def __init__(self, max_entries: int = MEDIA_DIGEST_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple, str] = OrderedDict()
+
+    def _key(self, path: str, stat_result: os.stat_result) -> tuple:
+        return os.path.realpath(path), stat_result.st_mtime_ns, stat_result.st_size
+
+    def get(self, path: str, stat_result: os.stat_result):
+        key = self._key(path, stat_result)
+        digest = self.entries.get(key)
+        if digest is not None:
+            self.entries.move_to_end(key)
+        return digest
+
+    def put(self, path: str, stat_result: os.stat_result, digest: str):
+        self.entries[self._key(path, stat_result)] = digest
+        self.entries.move_to_end(self._key(path, stat_result))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+digest_cache = DigestCache()
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def _file_reference(stored_path: str) -> dict:
+    absolute_path = os.path.join(UPLOADS_DIR, os.path.relpath(stored_path.strip(), "uploads"))
+    stat_result = await asyncio.to_thread(os.stat, absolute_path)
+    digest = digest_cache.get(absolute_path, stat_result)
+    if digest is None:
+        digest = await asyncio.to_thread(_hash_file, absolute_path)
+        digest_cache.put(absolute_path, stat_result, digest)
+    url, expires = signed_media_url(stored_path)
+    return {
+        "filename": os.path.basename(absolute_path),
+        "size": stat_result.st_size,
+        "sha256": digest,
+        "content_type": mimetypes.guess_type(absolute_path)[0] or "application/octet-stream",
+        "url": url,
+        "expires_at": expires,
+    }
+
+
+async def media_reference(stored_path: str):
+    # {"filename", "size", "sha256", "content_type", "url", "expires_at"} for
+    # one stored file, or None if it is gone. Hashes come from the upload
+    # when this worker saved the file, otherwise they are computed once.
+    # "variants" holds the same for each derivative rendered so far,
+    # smallest first, for clients to fetch before the original.
+    try:
+        reference = await _file_reference(stored_path)
+    except OSError as e:
+        print(f"Skipping media file {stored_path}: {e}")
+        return None
+    reference["variants"] = {}
+    for kind in DERIVATIVE_SIZES:
+        try:
+            reference["variants"][kind] = await _file_reference(derivative_path(stored_path, kind))
+        except OSError:
+            pass
+    return reference
+
+
+async def media_references(stored_paths: list[str]) -> list[dict]:
+    references = [await media_reference(path) for path in stored_paths]
+    return [reference for reference in references if reference]
+
+
+class SignedStaticFiles(StaticFiles):
+    # /uploads with signed, expiring URLs (?exp=&sig=). Responses carry the
+    # file's sha256 as ETag when known and a private Cache-Control; Range
+    # and If-None-Match come from Starlette's FileResponse/StaticFiles.
+
+    async def get_response(self, path: str, scope):
+        params = QueryParams(scope.get("query_string", b""))
+        if MEDIA_REQUIRE_SIGNED_URLS or "sig" in params:
+            url_path = path.replace(os.sep, "/")
+            if not verify_media_signature(url_path, params.get("exp"), params.get("sig")):
+                raise HTTPException(status_code=403)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        headers = {"cache-control": f"private, max-age={MEDIA_URL_TTL_SECONDS}, immutable"}
+        digest = digest_cache.get(str(full_path), stat_result)
+        if digest:
+            headers["etag"] = f'"{digest}"'
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
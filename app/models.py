@@ -20,7 +20,7 @@ class Location(Base):
     __tablename__ = "locations"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, unique=True)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
     landmark = Column(String, nullable=True)
@@ -34,7 +34,7 @@ class MediaData(Base):
     __tablename__ = "media_data"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, unique=True)
     media_id = Column(String, nullable=True, unique=True)
     mobile_number = Column(String, nullable=True)
     image_path = Column(ARRAY(String), nullable=True)  # <- changed to list
@@ -72,12 +72,59 @@ class DriverLocation(Base):
     # Back-reference to Driver
     driver = relationship("Driver", back_populates="location")
 
+
+class DriverLocationHistory(Base):
+    # Partitioned by day; partitions are created on demand by app/location_history.py
+    __tablename__ = "driver_location_history"
+    driver_id = Column(Integer, primary_key=True)
+    recorded_at = Column(DateTime, primary_key=True)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+
+    __table_args__ = {"postgresql_partition_by": "RANGE (recorded_at)"}
+
+
+class DriverConnection(Base):
+    # Which worker holds each driver's WebSocket (Postgres backplane registry)
+    __tablename__ = "driver_connections"
+    driver_id = Column(Integer, primary_key=True)
+    worker_id = Column(String, nullable=False)
+    connected_at = Column(DateTime, default=datetime.utcnow)
+
+
+class BackplaneWorker(Base):
+    # Last heartbeat of each worker; registrations of silent workers are stale
+    __tablename__ = "backplane_workers"
+    worker_id = Column(String, primary_key=True)
+    heartbeat_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class DriverOutboxMessage(Base):
+    # Unacked driver messages when OUTBOX_STORE=db; id is the sequence number
+    __tablename__ = "driver_outbox"
+    id = Column(Integer, primary_key=True)
+    driver_id = Column(Integer, nullable=False, index=True)
+    payload = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class BackplaneMessage(Base):
+    # Messages too large for a NOTIFY payload, picked up by the target worker
+    __tablename__ = "backplane_messages"
+    id = Column(Integer, primary_key=True)
+    payload = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class Assignment(Base):
     __tablename__ = "assignments"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, unique=True)
     driver_id = Column(Integer, ForeignKey("drivers.id"), nullable=False)
+    status = Column(String, default="pending")  # pending, accepted, denied
+    assigned_at = Column(DateTime, default=datetime.utcnow)
     responded_at = Column(DateTime, nullable=True)
     user = relationship("User", back_populates="assignment")
     driver = relationship("Driver", back_populates="assignments")
@@ -0,0 +1,219 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.future import select
+
+from .db import AsyncSessionLocal
+from .models import DriverOutboxMessage
+
+# "memory" keeps the outbox in this process; "db" shares it between workers
+# (needed when a driver may reconnect to a different worker)
+OUTBOX_STORE = os.getenv("OUTBOX_STORE", "memory")
+# Unacked messages are replayed for this long, then dropped
+OUTBOX_TTL_SECONDS = float(os.getenv("OUTBOX_TTL_SECONDS", "120"))
+OUTBOX_MAX_PER_DRIVER = int(os.getenv("OUTBOX_MAX_PER_DRIVER", "100"))
+OUTBOX_SWEEP_SECONDS = float(os.getenv("OUTBOX_SWEEP_SECONDS", "30"))
+
+
+class MemoryOutboxStore:
+    # Sequence numbers restart with the process and differ between workers,
+    # so they only mean something together with this store's epoch
+    name = "memory"
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.sequence = itertools.count(1)
+        self.entries: dict[int, deque[tuple[int, dict, float]]] = {}
+        self.counters = {"overflowed": 0, "expired": 0}
+
+    async def append(self, driver_id: int, message: dict) -> int:
+        seq = next(self.sequence)
+        entries = self.entries.setdefault(driver_id, deque())
+        entries.append((seq, message, time.monotonic() + OUTBOX_TTL_SECONDS))
+        if len(entries) > OUTBOX_MAX_PER_DRIVER:
+            entries.popleft()
+            self.counters["overflowed"] += 1
+        return seq
+
+    async def ack(self, driver_id: int, seq: int) -> int:
+        entries = self.entries.get(driver_id)
+        acked = 0
+        while entries and entries[0][0] <= seq:
+            entries.popleft()
+            acked += 1
+        if entries is not None and not entries:
+            del self.entries[driver_id]
+        return acked
+
+    async def pending(self, driver_id: int, after_seq: int = 0) -> list[tuple[int, dict]]:
+        now = time.monotonic()
+        return [
+            (seq, message)
+            for seq, message, expires_at in self.entries.get(driver_id, ())
+            if seq > after_seq and expires_at > now
+        ]
+
+    async def purge_expired(self):
+        now = time.monotonic()
+        for driver_id in list(self.entries):
+            entries = self.entries[driver_id]
+            while entries and entries[0][2] <= now:
+                entries.popleft()
+                self.counters["expired"] += 1
+            if not entries:
+                del self.entries[driver_id]
+
+    async def stats(self) -> dict:
+        return {
+            "drivers": len(self.entries),
+            "unacked": sum(len(entries) for entries in self.entries.values()),
+            **self.counters,
+        }
+
+
+class DbOutboxStore:
+    # The row id doubles as the sequence number, so it is increasing per
+    # driver and unique across workers and restarts: one epoch for all
+    name = "db"
+    epoch = "db"
+
+    def __init__(self):
+        self.counters = {"overflowed": 0, "expired": 0}
+
+    async def append(self, driver_id: int, message: dict) -> int:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                pg_insert(DriverOutboxMessage)
+                .values(
+                    driver_id=driver_id,
+                    payload=json.dumps(message, default=str),
+                    expires_at=datetime.utcnow() + timedelta(seconds=OUTBOX_TTL_SECONDS),
+                )
+                .returning(DriverOutboxMessage.id)
+            )
+            seq = result.scalar_one()
+            await db.commit()
+        return seq
+
+    async def ack(self, driver_id: int, seq: int) -> int:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(delete(DriverOutboxMessage).where(
+                DriverOutboxMessage.driver_id == driver_id, DriverOutboxMessage.id <= seq
+            ))
+            await db.commit()
+        return result.rowcount
+
+    async def pending(self, driver_id: int, after_seq: int = 0) -> list[tuple[int, dict]]:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(DriverOutboxMessage.id, DriverOutboxMessage.payload)
+                .where(
+                    DriverOutboxMessage.driver_id == driver_id,
+                    DriverOutboxMessage.id > after_seq,
+                    DriverOutboxMessage.expires_at > datetime.utcnow(),
+                )
+                .order_by(DriverOutboxMessage.id)
+                .limit(OUTBOX_MAX_PER_DRIVER)
+            )
+            return [(seq, json.loads(payload)) for seq, payload in result.all()]
+
+    async def purge_expired(self):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(DriverOutboxMessage).where(DriverOutboxMessage.expires_at <= datetime.utcnow())
+            )
+            await db.commit()
+        self.counters["expired"] += result.rowcount
+
+    async def stats(self) -> dict:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(
+                func.count(func.distinct(DriverOutboxMessage.driver_id)), func.count()
+            ))
+            drivers, unacked = result.one()
+        return {"drivers": drivers, "unacked": unacked, **self.counters}
+
+
+class DriverOutbox:
+    # Reliable driver messages (assignments) get a sequence number and the
+    # store's epoch, and stay here until the driver acks them with
+    # {"type": "ack", "seq": N, "epoch": E}, which acks everything up to N.
+    # On reconnect, whatever is still unacked after the client's resume
+    # cursor is replayed; a cursor from another epoch (restarted process,
+    # other worker) replays everything. Clients drop seqs they've already
+    # seen within an epoch and reset their cursor when the epoch changes.
+
+    def __init__(self, store):
+        self.store = store
+        self.task: asyncio.Task | None = None
+        self.counters = {"appended": 0, "acked": 0, "replayed": 0, "foreign_acks": 0, "errors": 0}
+
+    async def append(self, driver_id: int, message: dict) -> dict:
+        try:
+            seq = await self.store.append(driver_id, message)
+        except Exception as e:
+            # Still deliver live, just without the replay guarantee
+            self.counters["errors"] += 1
+            print(f"Failed to store outbox message for driver {driver_id}: {e}")
+            return message
+        self.counters["appended"] += 1
+        return {**message, "seq": seq, "epoch": self.store.epoch}
+
+    async def ack(self, driver_id: int, seq: int, epoch: str | None = None):
+        if epoch is not None and epoch != self.store.epoch:
+            # Seq from another process's numbering; it means nothing here
+            self.counters["foreign_acks"] += 1
+            return
+        try:
+            self.counters["acked"] += await self.store.ack(driver_id, seq)
+        except Exception as e:
+            self.counters["errors"] += 1
+            print(f"Failed to ack outbox seq {seq} for driver {driver_id}: {e}")
+
+    async def replay(self, driver_id: int, after_seq: int = 0, epoch: str | None = None) -> list[dict]:
+        if epoch != self.store.epoch:
+            after_seq = 0
+        try:
+            pending = await self.store.pending(driver_id, after_seq)
+        except Exception as e:
+            self.counters["errors"] += 1
+            print(f"Failed to load outbox for driver {driver_id}: {e}")
+            return []
+        self.counters["replayed"] += len(pending)
+        return [{**message, "seq": seq, "epoch": self.store.epoch} for seq, message in pending]
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(OUTBOX_SWEEP_SECONDS)
+            try:
+                await self.store.purge_expired()
+            except Exception as e:
+                print(f"Outbox sweep failed: {e}")
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def stats(self) -> dict:
+        try:
+            store_stats = await self.store.stats()
+        except Exception as e:
+            store_stats = {"error": str(e)}
+        return {"store": self.store.name, "epoch": self.store.epoch, "ttl_seconds": OUTBOX_TTL_SECONDS, **store_stats, **self.counters}
+
+
+outbox = DriverOutbox(DbOutboxStore() if OUTBOX_STORE == "db" else MemoryOutboxStore())
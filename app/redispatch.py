@@ -0,0 +1,178 @@
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy.future import select
+
+from .db import AsyncSessionLocal
+from .liveness import live_cutoff
+from .models import Assignment, Driver, DriverLocation
+
+# How long a dispatch's ranked candidates stay usable for re-dispatch
+REDISPATCH_TTL_SECONDS = float(os.getenv("REDISPATCH_TTL_SECONDS", "300"))
+# Offer the ride to the next driver if nobody answered in this long (0 = off)
+RIDE_RESPONSE_TIMEOUT_SECONDS = float(os.getenv("RIDE_RESPONSE_TIMEOUT_SECONDS", "30"))
+
+
+class RankedCandidates:
+    def __init__(self, user_id: int, media_id, ranked_driver_ids: list[int]):
+        self.user_id = user_id
+        self.media_id = media_id
+        self.ranked_driver_ids = ranked_driver_ids
+        self.tried: set[int] = set()
+        self.created_at = time.monotonic()
+
+
+class Redispatcher:
+    # Keeps the ETA-ranked driver list of each dispatch for a short while, so
+    # a denial or an unanswered offer moves the ride to the next still
+    # available driver without recomputing any ETAs.
+    #
+    # Rankings and offer timers live in the worker that dispatched the ride.
+    # Each timer is keyed to the offer as stored in the assignment row
+    # (driver and assigned_at), which reassign() re-checks under the row
+    # lock. If the ride was answered or moved on by any worker in between,
+    # the timer does nothing. A denial handled by a worker without the
+    # rankings leaves the ride to that timer. With several workers, a denied
+    # ride therefore moves on after RIDE_RESPONSE_TIMEOUT_SECONDS rather than
+    # at once.
+    #
+    # notify(db, driver_id, user_id, media_id, assignment_id) comes from the
+    # service so this module doesn't depend on it.
+
+    def __init__(self, notify, ttl_seconds: float = REDISPATCH_TTL_SECONDS,
+                 response_timeout: float = RIDE_RESPONSE_TIMEOUT_SECONDS):
+        self.notify = notify
+        self.ttl_seconds = ttl_seconds
+        self.response_timeout = response_timeout
+        self.entries: dict[int, RankedCandidates] = {}
+        self.timers: dict[int, asyncio.Task] = {}
+        self.reassign_ms = deque(maxlen=500)
+        self.counters = {"reassigned": 0, "exhausted": 0, "timeouts": 0, "stale_timers": 0, "expired": 0}
+
+    def remember(self, assignment_id: int, user_id: int, media_id, ranked_driver_ids: list[int],
+                 offered_at: datetime | None = None):
+        self._purge_expired()
+        entry = RankedCandidates(user_id, media_id, ranked_driver_ids)
+        if ranked_driver_ids:
+            entry.tried.add(ranked_driver_ids[0])
+        self.entries[assignment_id] = entry
+        if ranked_driver_ids:
+            self._start_timer(assignment_id, ranked_driver_ids[0], offered_at)
+
+    def forget(self, assignment_id: int):
+        self.entries.pop(assignment_id, None)
+        self.cancel_timer(assignment_id)
+
+    def cancel_timer(self, assignment_id: int):
+        # The driver answered; the offer must not also time out
+        timer = self.timers.pop(assignment_id, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for assignment_id, entry in list(self.entries.items()):
+            if now - entry.created_at > self.ttl_seconds:
+                self.forget(assignment_id)
+                self.counters["expired"] += 1
+
+    def _start_timer(self, assignment_id: int, driver_id: int, offered_at: datetime | None = None):
+        if not self.response_timeout:
+            return
+        timer = self.timers.pop(assignment_id, None)
+        if timer is not None:
+            timer.cancel()
+        self.timers[assignment_id] = asyncio.create_task(self._expire_offer(assignment_id, driver_id, offered_at))
+
+    async def _expire_offer(self, assignment_id: int, driver_id: int, offered_at: datetime | None):
+        await asyncio.sleep(self.response_timeout)
+        self.timers.pop(assignment_id, None)
+        self.counters["timeouts"] += 1
+        await self.reassign(assignment_id, driver_id, offered_at)
+
+    async def reassign(self, assignment_id: int, from_driver_id: int, offered_at: datetime | None = None):
+        # Called when from_driver_id denied or ignored the offer. With
+        # offered_at (timeouts), only that exact offer is moved on.
+        started = time.perf_counter()
+        entry = self.entries.get(assignment_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created_at > self.ttl_seconds:
+            self.forget(assignment_id)
+            self.counters["expired"] += 1
+            return None
+
+        async with AsyncSessionLocal() as db:
+            # Row lock until commit, so a denial and an expired offer (or two
+            # workers) can't both move the ride
+            result = await db.execute(
+                select(Assignment).where(Assignment.id == assignment_id).with_for_update()
+            )
+            assignment = result.scalar_one_or_none()
+            # Someone else already moved this ride on (or offered it again),
+            # or the driver accepted
+            if (
+                assignment is None
+                or assignment.driver_id != from_driver_id
+                or assignment.status == "accepted"
+                or (offered_at is not None and assignment.assigned_at != offered_at)
+            ):
+                if offered_at is not None:
+                    self.counters["stale_timers"] += 1
+                return None
+
+            remaining = [d for d in entry.ranked_driver_ids if d not in entry.tried]
+            available = set()
+            if remaining:
+                query = (
+                    select(Driver.id)
+                    .join(DriverLocation, DriverLocation.driver_id == Driver.id)
+                    .where(Driver.id.in_(remaining), Driver.is_available == True)
+                )
+                fresh_after = live_cutoff()
+                if fresh_after is not None:
+                    query = query.where(DriverLocation.updated_at >= fresh_after)
+                result = await db.execute(query)
+                available = set(result.scalars().all())
+            next_driver_id = next((d for d in remaining if d in available), None)
+            if next_driver_id is None:
+                print(f"No more candidates to re-dispatch assignment {assignment_id}")
+                self.counters["exhausted"] += 1
+                self.forget(assignment_id)
+                return None
+
+            entry.tried.add(next_driver_id)
+            assignment.driver_id = next_driver_id
+            assignment.status = "pending"
+            assignment.assigned_at = datetime.utcnow()
+            assignment.responded_at = None
+            await db.commit()
+            offered_at = assignment.assigned_at
+
+            await self.notify(
+                db=db,
+                driver_id=next_driver_id,
+                user_id=entry.user_id,
+                media_id=str(entry.media_id),
+                assignment_id=assignment_id
+            )
+
+        self.reassign_ms.append((time.perf_counter() - started) * 1000)
+        self.counters["reassigned"] += 1
+        self._start_timer(assignment_id, next_driver_id, offered_at)
+        return next_driver_id
+
+    def stats(self) -> dict:
+        samples = sorted(self.reassign_ms)
+        return {
+            "tracked_assignments": len(self.entries),
+            "time_to_reassign_ms": {
+                "p50": round(samples[len(samples) // 2], 2) if samples else None,
+                "max": round(samples[-1], 2) if samples else None,
+                "samples": len(samples),
+            },
+            **self.counters,
+        }
@@ -0,0 +1,191 @@
+import heapq
+import math
+import os
+import sys
+
+import numpy as np
+
+from .spatial_index import KM_PER_DEGREE_LAT, haversine_km
+
+ROAD_GRAPH_DIR = os.getenv("ROAD_GRAPH_DIR", "data/road_graph")
+# Max distance from a coordinate to the road node it snaps to
+ROAD_GRAPH_SNAP_KM = float(os.getenv("ROAD_GRAPH_SNAP_KM", "1.0"))
+# Stop searching beyond this travel time; farther drivers fall back to estimates
+ROAD_GRAPH_MAX_SECONDS = float(os.getenv("ROAD_GRAPH_MAX_SECONDS", "7200"))
+
+# Default speeds used when building from OSM, by highway tag
+HIGHWAY_SPEED_KMH = {
+    "motorway": 90, "motorway_link": 50,
+    "trunk": 70, "trunk_link": 40,
+    "primary": 55, "primary_link": 35,
+    "secondary": 45, "secondary_link": 30,
+    "tertiary": 35, "tertiary_link": 25,
+    "unclassified": 30, "residential": 25,
+    "living_street": 10, "service": 15, "road": 25,
+}
+
+# Graph directory layout, one .npy per array so each can be memory-mapped:
+#   node_lat, node_lon    float64[n], nodes sorted by latitude
+#   rev_indptr            int64[n + 1], CSR offsets of incoming edges per node
+#   rev_indices           int32[m], source node of each incoming edge
+#   rev_seconds           float32[m], travel time of each incoming edge
+GRAPH_ARRAYS = ("node_lat", "node_lon", "rev_indptr", "rev_indices", "rev_seconds")
+
+
+class RoadGraph:
+    # Directed road network stored as a reverse CSR adjacency, so a single
+    # Dijkstra search outwards from the user answers "how long from each
+    # driver to here" for all candidates at once.
+
+    def __init__(self, node_lat, node_lon, rev_indptr, rev_indices, rev_seconds):
+        self.node_lat = node_lat
+        self.node_lon = node_lon
+        self.rev_indptr = rev_indptr
+        self.rev_indices = rev_indices
+        self.rev_seconds = rev_seconds
+
+    @classmethod
+    def load(cls, directory: str = ROAD_GRAPH_DIR):
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in GRAPH_ARRAYS
+        }
+        graph = cls(**arrays)
+        print(f"Loaded road graph with {len(graph.node_lat)} nodes and {len(graph.rev_indices)} edges")
+        return graph
+
+    def snap(self, lat: float, lon: float):
+        # Nearest node within ROAD_GRAPH_SNAP_KM, or None. Nodes are sorted by
+        # latitude so only a thin band of the arrays is touched.
+        lat_band = ROAD_GRAPH_SNAP_KM / KM_PER_DEGREE_LAT
+        lo = int(np.searchsorted(self.node_lat, lat - lat_band, side="left"))
+        hi = int(np.searchsorted(self.node_lat, lat + lat_band, side="right"))
+        if lo >= hi:
+            return None
+
+        lats = np.asarray(self.node_lat[lo:hi])
+        lons = np.asarray(self.node_lon[lo:hi])
+        # Equirectangular distance is plenty for picking the closest node
+        dx = (lons - lon) * math.cos(math.radians(lat))
+        dy = lats - lat
+        best = int(np.argmin(dx * dx + dy * dy))
+        node = lo + best
+        if haversine_km(lat, lon, float(self.node_lat[node]), float(self.node_lon[node])) > ROAD_GRAPH_SNAP_KM:
+            return None
+        return node
+
+    def seconds_to(self, target: int, sources: set[int], max_seconds: float = ROAD_GRAPH_MAX_SECONDS) -> dict[int, float]:
+        # Multi-target Dijkstra over incoming edges from `target`; stops once
+        # every source is settled or the time cap is reached.
+        remaining = set(sources)
+        settled = {}
+        best = {target: 0.0}
+        heap = [(0.0, target)]
+        while heap and remaining:
+            seconds, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            if seconds > max_seconds:
+                break
+            settled[node] = seconds
+            remaining.discard(node)
+
+            start, end = int(self.rev_indptr[node]), int(self.rev_indptr[node + 1])
+            for prev, cost in zip(self.rev_indices[start:end].tolist(), self.rev_seconds[start:end].tolist()):
+                candidate = seconds + cost
+                if prev not in settled and candidate < best.get(prev, math.inf):
+                    best[prev] = candidate
+                    heapq.heappush(heap, (candidate, prev))
+
+        return {node: settled[node] for node in sources if node in settled}
+
+    def score(self, user_lat: float, user_lon: float, drivers) -> dict[int, int]:
+        # drivers: list of (driver_id, latitude, longitude)
+        # Drivers off the network or out of reach are left out.
+        target = self.snap(user_lat, user_lon)
+        if target is None:
+            return {}
+        driver_nodes = {}
+        for driver_id, lat, lon in drivers:
+            node = self.snap(lat, lon)
+            if node is not None:
+                driver_nodes[driver_id] = node
+
+        seconds = self.seconds_to(target, set(driver_nodes.values()))
+        return {
+            driver_id: round(seconds[node] / 60)
+            for driver_id, node in driver_nodes.items()
+            if node in seconds
+        }
+
+
+def _parse_maxspeed(value):
+    if not value:
+        return None
+    try:
+        speed = float(value.split()[0])
+    except ValueError:
+        return None
+    return speed * 1.609 if "mph" in value else speed
+
+
+def build_graph_from_osm(pbf_path: str, out_dir: str = ROAD_GRAPH_DIR):
+    # Offline preprocessing step: OSM extract -> graph directory for RoadGraph.load
+    import osmium  # optional dependency, only needed to build graphs
+
+    coords = {}
+    edges = []  # (from_ref, to_ref, seconds)
+
+    class WayHandler(osmium.SimpleHandler):
+        def way(self, way):
+            highway = way.tags.get("highway")
+            if highway not in HIGHWAY_SPEED_KMH:
+                return
+            speed = _parse_maxspeed(way.tags.get("maxspeed")) or HIGHWAY_SPEED_KMH[highway]
+            oneway = way.tags.get("oneway")
+            if oneway is None and (way.tags.get("junction") == "roundabout" or highway.startswith("motorway")):
+                oneway = "yes"
+
+            nodes = [(n.ref, n.lat, n.lon) for n in way.nodes if n.location.valid()]
+            for (ref_a, lat_a, lon_a), (ref_b, lat_b, lon_b) in zip(nodes, nodes[1:]):
+                coords[ref_a] = (lat_a, lon_a)
+                coords[ref_b] = (lat_b, lon_b)
+                seconds = haversine_km(lat_a, lon_a, lat_b, lon_b) / speed * 3600
+                if oneway != "-1":
+                    edges.append((ref_a, ref_b, seconds))
+                if oneway not in ("yes", "true", "1"):
+                    edges.append((ref_b, ref_a, seconds))
+
+    WayHandler().apply_file(pbf_path, locations=True)
+
+    refs = np.fromiter(coords.keys(), dtype=np.int64, count=len(coords))
+    lats = np.fromiter((c[0] for c in coords.values()), dtype=np.float64, count=len(coords))
+    lons = np.fromiter((c[1] for c in coords.values()), dtype=np.float64, count=len(coords))
+
+    order = np.argsort(lats, kind="stable")
+    index_of_ref = {int(ref): i for i, ref in enumerate(refs[order])}
+
+    src = np.fromiter((index_of_ref[e[0]] for e in edges), dtype=np.int32, count=len(edges))
+    dst = np.fromiter((index_of_ref[e[1]] for e in edges), dtype=np.int32, count=len(edges))
+    seconds = np.fromiter((e[2] for e in edges), dtype=np.float32, count=len(edges))
+
+    by_dst = np.argsort(dst, kind="stable")
+    rev_indptr = np.zeros(len(refs) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(dst, minlength=len(refs)), out=rev_indptr[1:])
+
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = {
+        "node_lat": lats[order],
+        "node_lon": lons[order],
+        "rev_indptr": rev_indptr,
+        "rev_indices": src[by_dst],
+        "rev_seconds": seconds[by_dst],
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), array)
+    print(f"Wrote road graph with {len(refs)} nodes and {len(edges)} edges to {out_dir}")
+
+
+if __name__ == "__main__":
+    # python -m app.road_graph extract.osm.pbf [out_dir]
+    build_graph_from_osm(*sys.argv[1:3])
@@ -0,0 +1,155 @@
+import asyncio
+import os
+
+from .eta_cache import eta_cache
+from .routing_client import RoutingClient
+from .local_eta import local_eta_engine
+from .road_graph import RoadGraph
+
+ORS_API_KEY = os.getenv("ORS_API_KEY", "5b3ce3597851110001cf62483670764117264d618322ac641fb0f58c")
+ORS_BASE_URL = os.getenv("ORS_BASE_URL", "https://api.openrouteservice.org")
+# Max drivers (sources) per matrix request; ORS rejects larger matrices
+ORS_MATRIX_MAX_SOURCES = int(os.getenv("ORS_MATRIX_MAX_SOURCES", "50"))
+# Max matrix requests in flight per dispatch
+ETA_CONCURRENCY = int(os.getenv("ETA_CONCURRENCY", "4"))
+# Overall budget for remote ETAs; anything slower gets a local estimate
+DISPATCH_DEADLINE_MS = int(os.getenv("DISPATCH_DEADLINE_MS", "800"))
+# Only the best ETA_PREFILTER_K candidates by local estimate go to ORS
+ETA_PREFILTER_K = int(os.getenv("ETA_PREFILTER_K", "10"))
+# "ors" for remote ETAs, "graph" for the in-process road graph (ROAD_GRAPH_DIR),
+# "local" to score with the local engine only; the last two need no network
+ROUTING_BACKEND = os.getenv("ROUTING_BACKEND", "ors")
+
+routing_client = RoutingClient(ORS_BASE_URL, ORS_API_KEY)
+road_graph: RoadGraph | None = None
+
+
+def load_road_graph():
+    global road_graph
+    if ROUTING_BACKEND == "graph" and road_graph is None:
+        road_graph = RoadGraph.load()
+
+
+async def _fetch_directions_eta(user_lat, user_lon, driver_lat, driver_lon):
+    body = {
+        "coordinates": [
+            [driver_lon, driver_lat],  # Origin
+            [user_lon, user_lat]       # Destination
+        ]
+    }
+    data = await routing_client.post_json("/v2/directions/driving-car/geojson", body)
+    duration_seconds = data["features"][0]["properties"]["summary"]["duration"]
+    return round(duration_seconds / 60)
+
+
+async def get_eta_from_openrouteservice(user_lat, user_lon, driver_lat, driver_lon):
+    key = eta_cache.key(driver_lat, driver_lon, user_lat, user_lon)
+    return await eta_cache.get_or_fetch(
+        key, lambda: _fetch_directions_eta(user_lat, user_lon, driver_lat, driver_lon)
+    )
+
+
+async def _matrix_chunk(user_lat, user_lon, drivers):
+    # Location 0 is the user, 1..n are the drivers; every driver is a source
+    # and the user is the only destination.
+    body = {
+        "locations": [[user_lon, user_lat]] + [[lon, lat] for _, lat, lon in drivers],
+        "sources": list(range(1, len(drivers) + 1)),
+        "destinations": [0],
+        "metrics": ["duration"],
+    }
+    data = await routing_client.post_json("/v2/matrix/driving-car", body)
+
+    etas = {}
+    for (driver_id, _, _), row in zip(drivers, data["durations"]):
+        if row and row[0] is not None:  # None means no route found
+            etas[driver_id] = round(row[0] / 60)
+    return etas
+
+
+async def score_drivers_eta(user_lat, user_lon, drivers, deadline_ms: int = DISPATCH_DEADLINE_MS):
+    # drivers: list of (driver_id, latitude, longitude)
+    # Every driver gets a local estimate first. With the graph backend one
+    # search scores all of them in-process. With ORS the ETA_PREFILTER_K best
+    # by local estimate are refined remotely: served from the ETA cache where
+    # possible, joining lookups other dispatches already have in flight, and
+    # fetching the rest as matrix chunks run concurrently (at most
+    # ETA_CONCURRENCY at a time) until the deadline.
+    # Returns ({driver_id: eta_minutes}, set of driver ids whose ETA is a
+    # local estimate).
+    local_etas = local_eta_engine.score(user_lat, user_lon, drivers)
+    if ROUTING_BACKEND == "local":
+        return local_etas, set(local_etas)
+    if ROUTING_BACKEND == "graph":
+        graph_etas = await asyncio.to_thread(road_graph.score, user_lat, user_lon, drivers)
+        estimated = {driver_id for driver_id in local_etas if driver_id not in graph_etas}
+        return {**local_etas, **graph_etas}, estimated
+
+    remote_candidates = sorted(drivers, key=lambda d: local_etas[d[0]])[:ETA_PREFILTER_K]
+
+    etas = {}
+    drivers_by_key = {}  # cache key -> driver ids sharing it
+    owned = []  # (cache key, lat, lon) this call fetches
+    shared = {}  # cache key -> future owned by another dispatch
+    for driver_id, lat, lon in remote_candidates:
+        key = eta_cache.key(lat, lon, user_lat, user_lon)
+        cached = eta_cache.get(key)
+        if cached is not None:
+            etas[driver_id] = cached
+            continue
+        if key not in drivers_by_key:
+            future = eta_cache.pending(key)
+            if future is not None:
+                shared[key] = future
+            else:
+                eta_cache.claim(key)
+                owned.append((key, lat, lon))
+        drivers_by_key.setdefault(key, []).append(driver_id)
+
+    chunks = [
+        owned[i:i + ORS_MATRIX_MAX_SOURCES]
+        for i in range(0, len(owned), ORS_MATRIX_MAX_SOURCES)
+    ]
+    semaphore = asyncio.Semaphore(ETA_CONCURRENCY)
+    resolved = {}
+
+    async def run_chunk(chunk):
+        async with semaphore:
+            return await _matrix_chunk(user_lat, user_lon, chunk)
+
+    tasks = [asyncio.create_task(run_chunk(chunk)) for chunk in chunks]
+    try:
+        waiting = tasks + list(shared.values())
+        if waiting:
+            # asyncio.wait never cancels, so other dispatches' futures are safe here
+            done, _ = await asyncio.wait(waiting, timeout=deadline_ms / 1000)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            for chunk, task in zip(chunks, tasks):
+                if task not in done:
+                    print(f"ORS matrix request missed the {deadline_ms} ms deadline for {len(chunk)} drivers")
+                elif task.exception():
+                    print(f"ORS matrix request failed for {len(chunk)} drivers: {task.exception()}")
+                else:
+                    resolved.update(task.result())
+            for key, future in shared.items():
+                if future in done and future.result() is not None:
+                    resolved[key] = future.result()
+    finally:
+        for key, _, _ in owned:
+            eta_cache.release(key, resolved.get(key))
+
+    for key, driver_ids in drivers_by_key.items():
+        if key in resolved:
+            for driver_id in driver_ids:
+                etas[driver_id] = resolved[key]
+
+    estimated = set()
+    for driver_id, _, _ in drivers:
+        if driver_id not in etas:
+            etas[driver_id] = local_etas[driver_id]
+            estimated.add(driver_id)
+    return etas, estimated
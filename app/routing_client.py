@@ -0,0 +1,254 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+
+import httpx
+
+ROUTING_MAX_CONNECTIONS = int(os.getenv("ROUTING_MAX_CONNECTIONS", "20"))
+ROUTING_MAX_KEEPALIVE = int(os.getenv("ROUTING_MAX_KEEPALIVE", "10"))
+ROUTING_KEEPALIVE_EXPIRY = float(os.getenv("ROUTING_KEEPALIVE_EXPIRY", "30"))
+ROUTING_TIMEOUT = float(os.getenv("ROUTING_TIMEOUT", "5"))
+ROUTING_RETRIES = int(os.getenv("ROUTING_RETRIES", "2"))
+ROUTING_BACKOFF_MS = int(os.getenv("ROUTING_BACKOFF_MS", "50"))
+# Send a second copy of a request that hasn't answered after this long (0 = off)
+ROUTING_HEDGE_AFTER_MS = int(os.getenv("ROUTING_HEDGE_AFTER_MS", "0"))
+
+BREAKER_WINDOW = int(os.getenv("ROUTING_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("ROUTING_BREAKER_MIN_CALLS", "10"))
+BREAKER_ERROR_RATE = float(os.getenv("ROUTING_BREAKER_ERROR_RATE", "0.5"))
+BREAKER_RESET_SECONDS = float(os.getenv("ROUTING_BREAKER_RESET_SECONDS", "30"))
+
+
+class RoutingError(Exception):
+    pass
+
+
+class RetryableRoutingError(RoutingError):
+    pass
+
+
+class CircuitOpenError(RoutingError):
+    pass
+
+
+class CircuitBreaker:
+    # Opens when the error rate over the last `window` calls passes
+    # `error_rate`; after `reset_seconds` a single probe call is let through
+    # and its outcome decides whether to close again.
+
+    def __init__(
+        self,
+        window: int = BREAKER_WINDOW,
+        min_calls: int = BREAKER_MIN_CALLS,
+        error_rate: float = BREAKER_ERROR_RATE,
+        reset_seconds: float = BREAKER_RESET_SECONDS,
+    ):
+        self.outcomes = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+        if self.state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        return False
+
+    def record(self, success: bool):
+        if self.state == "open":
+            # Calls let through before it opened are still finishing; their
+            # outcomes must not push the reset further out
+            return
+        if self.state == "half_open":
+            self.probe_in_flight = False
+            if success:
+                self.state = "closed"
+                self.outcomes.clear()
+            else:
+                self._open()
+            return
+
+        self.outcomes.append(success)
+        failures = self.outcomes.count(False)
+        if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.error_rate:
+            self._open()
+
+    def end_probe(self):
+        # The probe ended without an outcome being recorded; let the next
+        # call probe instead of staying half-open forever
+        if self.state == "half_open":
+            self.probe_in_flight = False
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "window_calls": len(self.outcomes),
+            "window_failures": self.outcomes.count(False),
+            "times_opened": self.times_opened,
+        }
+
+
+class RoutingClient:
+    # Long-lived HTTP client for the routing provider. Opened and closed in
+    # the app lifespan so connections are kept alive across dispatches.
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        retries: int = ROUTING_RETRIES,
+        backoff_ms: int = ROUTING_BACKOFF_MS,
+        hedge_after_ms: int = ROUTING_HEDGE_AFTER_MS,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.retries = retries
+        self.backoff_ms = backoff_ms
+        self.hedge_after_ms = hedge_after_ms
+        self.breaker = CircuitBreaker()
+        self.client: httpx.AsyncClient | None = None
+        self.in_flight = 0
+        self.counters = {
+            "requests": 0,
+            "failures": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "rejected_by_breaker": 0,
+        }
+
+    async def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    "Authorization": self.api_key,
+                    "Content-Type": "application/json"
+                },
+                limits=httpx.Limits(
+                    max_connections=ROUTING_MAX_CONNECTIONS,
+                    max_keepalive_connections=ROUTING_MAX_KEEPALIVE,
+                    keepalive_expiry=ROUTING_KEEPALIVE_EXPIRY,
+                ),
+                timeout=ROUTING_TIMEOUT,
+            )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def post_json(self, path: str, body: dict) -> dict:
+        if self.client is None:
+            await self.start()
+        if not self.breaker.allow():
+            self.counters["rejected_by_breaker"] += 1
+            raise CircuitOpenError("Routing circuit breaker is open")
+        probe = self.breaker.state == "half_open"
+
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    response = await self._send(path, body)
+                    if response.status_code == 429 or response.status_code >= 500:
+                        raise RetryableRoutingError(f"ORS Error: {response.status_code} {response.text}")
+                    # 4xx means a bad request, not an unhealthy provider
+                    self.breaker.record(True)
+                    if response.status_code != 200:
+                        raise RoutingError(f"ORS Error: {response.status_code} {response.text}")
+                    return response.json()
+                except asyncio.CancelledError:
+                    # The dispatch deadline ran out while ORS was still
+                    # answering: a provider that slow counts as failing
+                    self.counters["failures"] += 1
+                    self.breaker.record(False)
+                    raise
+                except (httpx.TransportError, asyncio.TimeoutError, RetryableRoutingError):
+                    # httpx timeouts are TransportErrors
+                    self.counters["failures"] += 1
+                    self.breaker.record(False)
+                    if attempt == self.retries or self.breaker.state != "closed":
+                        raise
+                self.counters["retries"] += 1
+                # Exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, self.backoff_ms * 2 ** attempt) / 1000)
+        finally:
+            if probe:
+                self.breaker.end_probe()
+
+    async def _post(self, path: str, body: dict) -> httpx.Response:
+        self.counters["requests"] += 1
+        self.in_flight += 1
+        try:
+            return await self.client.post(path, json=body)
+        finally:
+            self.in_flight -= 1
+
+    async def _send(self, path: str, body: dict) -> httpx.Response:
+        if not self.hedge_after_ms:
+            return await self._post(path, body)
+
+        first = asyncio.create_task(self._post(path, body))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after_ms / 1000)
+            if done:
+                return first.result()
+
+            self.counters["hedges"] += 1
+            hedge = asyncio.create_task(self._post(path, body))
+            tasks.append(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+            # Both copies failed; surface the original request's error
+            return first.result()
+        finally:
+            # Also when the caller is cancelled: a copy left running would
+            # hold its pooled connection until ORS answers
+            unfinished = [task for task in tasks if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                await asyncio.gather(*unfinished, return_exceptions=True)
+
+    def pool_stats(self) -> dict:
+        stats = {
+            "max_connections": ROUTING_MAX_CONNECTIONS,
+            "max_keepalive_connections": ROUTING_MAX_KEEPALIVE,
+            "in_flight_requests": self.in_flight,
+        }
+        # httpx doesn't expose pool state publicly; read it from httpcore
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            stats["open_connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for conn in connections if conn.is_idle())
+        return stats
+
+    def stats(self) -> dict:
+        return {
+            "pool": self.pool_stats(),
+            "breaker": self.breaker.stats(),
+            **self.counters,
+        }
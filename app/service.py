@@ -1,10 +1,16 @@
+import asyncio
+import json
 import os
-from datetime import datetime
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from typing import List, Optional
 
 from fastapi import FastAPI, Depends,Header,WebSocket,WebSocketDisconnect,BackgroundTasks
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db import get_db
+from app.db import get_db, AsyncSessionLocal
 from .crud import update_or_create_media
 from .models import User, Driver, DriverLocation, Location, MediaData, Assignment
 from sqlalchemy.future import select
@@ -13,18 +19,148 @@ from uuid import UUID
 from .schemas import AuthRequest, AuthResponse, UserCreate, UserOut, LocationOut, LocationCreate, MediaOut, \
     DriverCreate, DriverOut, TokenRequest, DriverWithTokenOut, LocationUpdateRequest, UserTokenInput, DriverTokenInput, \
     AssignmentUpdate, AssignmentOut
-from .auth import create_access_token, get_current_user, create_driver_access_token, decode_token, get_current_driver
+from .auth import create_access_token, get_current_user, create_driver_access_token, decode_token, get_current_driver, \
+    get_driver_from_token
 from . import crud
 from .admin import setup_admin
 from .wesocket_manager import manager
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import joinedload
-
-app = FastAPI()
-app.mount("/uploads", StaticFiles(directory="app/uploads"), name="uploads")
+from .backplane import backplane
+from .outbox import outbox
+from .media_urls import SignedStaticFiles, MEDIA_DELIVERY, media_references, stored_image_paths
+from .derivatives import image_derivatives, derivative_path, IMAGE_DERIVATIVE_WAIT_SECONDS
+from sqlalchemy.orm import contains_eager
+from .spatial_index import driver_index, DISPATCH_CANDIDATES_K, DISPATCH_RADIUS_KM
+from .eta_cache import eta_cache
+from .batch_matching import BatchDispatcher, DISPATCH_MODE
+from .redispatch import Redispatcher
+from .location_store import live_locations
+from .location_history import location_history, HISTORY_MAX_WINDOW_HOURS
+from .liveness import driver_liveness, live_cutoff
+from .routing import score_drivers_eta, routing_client, load_road_graph
+
+
+async def load_driver_index(db: AsyncSession):
+    result = await db.execute(
+        select(DriverLocation.driver_id, DriverLocation.latitude, DriverLocation.longitude)
+        .join(Driver, Driver.id == DriverLocation.driver_id)
+        .where(Driver.is_available == True)
+    )
+    driver_index.clear()
+    for driver_id, lat, lon in result.all():
+        if lat is not None and lon is not None:
+            driver_index.update(driver_id, lat, lon)
+            driver_liveness.touch(driver_id)  # one TTL of grace to send a first ping
+    print(f"Loaded {len(driver_index)} available drivers into spatial index")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DISPATCH_CANDIDATE_SOURCE == "memory" and WEB_CONCURRENCY > 1:
+        print(
+            f"Warning: DISPATCH_CANDIDATE_SOURCE=memory with {WEB_CONCURRENCY} workers; each worker only "
+            "indexes drivers whose pings reach it. Use DISPATCH_CANDIDATE_SOURCE=db."
+        )
+    if WEB_CONCURRENCY > 1:
+        print(
+            f"Note: re-dispatch rankings and offer timers are per worker; with {WEB_CONCURRENCY} workers a ride "
+            "denied on a worker that didn't dispatch it moves on when its offer times out"
+        )
+    async with AsyncSessionLocal() as db:
+        await load_driver_index(db)
+    load_road_graph()
+    await routing_client.start()
+    await live_locations.start()
+    await location_history.start()
+    await driver_liveness.start(live_locations.forget)
+    await backplane.start(manager.deliver_local)
+    await outbox.start()
+    await manager.start()
+    await image_derivatives.start()
+    yield
+    await image_derivatives.stop()
+    await manager.stop()
+    await outbox.stop()
+    await backplane.stop()
+    await driver_liveness.stop()
+    await location_history.stop()
+    await live_locations.stop()
+    await routing_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.mount("/uploads", SignedStaticFiles(directory="app/uploads"), name="uploads")
 setup_admin(app)
+
+
+class UploadSizeLimit:
+    # Plain ASGI middleware, so every other route passes straight through
+    # without the per-request overhead of BaseHTTPMiddleware. Upload bodies
+    # are refused on their Content-Length before the multipart parser spools
+    # them, and bodies without one are cut off once they pass the limit.
+
+    def __init__(self, app, max_bytes: int, prefix: str = "/me/upload/"):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+        length = Headers(scope=scope).get("content-length")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            response = JSONResponse(status_code=413, content={"detail": "Upload exceeds the request size limit"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Upload exceeds the request size limit")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(UploadSizeLimit, max_bytes=crud.MAX_UPLOAD_REQUEST_BYTES)
+
+
 connected_drivers = {}  # driver_id -> websocket
 
+def process_stats() -> dict:
+    # Current RSS and open descriptors of this worker (Linux /proc)
+    stats = {"pid": os.getpid(), "rss_bytes": None, "open_fds": None}
+    try:
+        with open("/proc/self/statm") as f:
+            stats["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        stats["open_fds"] = len(os.listdir("/proc/self/fd"))
+    except OSError:
+        pass
+    return stats
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        "process": process_stats(),
+        "routing": routing_client.stats(),
+        "locations": live_locations.stats(),
+        "location_history": location_history.stats(),
+        "liveness": driver_liveness.stats(),
+        "backplane": backplane.stats(),
+        "websockets": manager.stats(),
+        "outbox": await outbox.stats(),
+        "eta_cache": eta_cache.stats(),
+        "dispatch": batch_dispatcher.stats(),
+        "redispatch": redispatcher.stats(),
+        "derivatives": image_derivatives.stats(),
+    }
+
 @app.get("/users")
 async def get_users(db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(User))
@@ -101,62 +237,52 @@ async def get_my_location(
         raise HTTPException(status_code=404, detail="Location not set")
     return location
 
-#
-DEFAULT_ETA_MINUTES = 100  # fallback ETA in minutes
-# @app.post("/me/location")
-# async def set_or_update_location(
-#     location_data: LocationCreate,
-#     db: AsyncSession = Depends(get_db),
-#     current_user: User = Depends(get_current_user)
-# ):
-#     media_id = await crud.create_or_update_location(db, current_user.id, location_data)
-#
-#     # Get driver
-#     result = await db.execute(select(Driver).where(Driver.id == 2))
-#     print(result,"result")
-#     driver = result.scalar_one_or_none()
-#     print(driver.id,"driver id")
-#     if not driver:
-#         raise HTTPException(status_code=404, detail="Driver not found")
-#
-#     # Get user location
-#     user_result = await db.execute(select(Location).where(Location.user_id == current_user.id))
-#     user_location = user_result.scalar_one_or_none()
-#     print(user_location,"user loc")
-#     if not user_location:
-#         raise HTTPException(status_code=404, detail="User location not found")
-#
-#     # Get driver location
-#     driver_result = await db.execute(select(DriverLocation).where(DriverLocation.driver_id == driver.id))
-#     print(driver_result,"drive result")
-#     driver_location = driver_result.scalar_one_or_none()
-#     print(driver_location, "driv loc")
-#     if not driver_location:
-#         raise HTTPException(status_code=404, detail="Driver location not found")
-#
-#     # Calculate ETA
-#     try:
-#         print("in of tryy")
-#         eta = await get_eta_from_openrouteservice(
-#             user_location.latitude,
-#             user_location.longitude,
-#             driver_location.latitude,
-#             driver_location.longitude
-#             # 10.1000, 76.3500,  # user latitude, longitude
-#             # 9.9700, 76.2800  # driver latitude, longitude
-#         )
-#         print("try end")
-#     except Exception as e:
-#         print(f"ETA calculation error: {e}")
-#         eta = DEFAULT_ETA_MINUTES  # fallback
-#
-#     return {
-#         "first_name": driver.first_name,
-#         "mobile": driver.mobile,
-#         "ambulance_number": driver.ambulance_number,
-#         "media_id": media_id,
-#         "eta_minutes": eta,
-#     }
+# Worker processes serving the app (uvicorn --workers and gunicorn read it too)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# "memory" uses the in-process spatial index, "db" asks Postgres
+# (earthdistance). The index and the liveness wheel only see the pings that
+# reach this process, so with several workers the default is "db".
+DISPATCH_CANDIDATE_SOURCE = os.getenv("DISPATCH_CANDIDATE_SOURCE", "db" if WEB_CONCURRENCY > 1 else "memory")
+
+
+async def get_dispatch_candidates(db: AsyncSession, lat: float, lon: float) -> List[Driver]:
+    # Only the K nearest available drivers go to ETA scoring; fall back to the
+    # whole fleet if nothing is found nearby. Drivers without a recent
+    # position are presumed offline and left out before either step.
+    fresh_after = live_cutoff()
+    available_query = (
+        select(Driver)
+        .join(Driver.location)
+        .options(contains_eager(Driver.location))
+        .where(Driver.is_available == True)
+    )
+    if fresh_after is not None:
+        available_query = available_query.where(DriverLocation.updated_at >= fresh_after)
+    drivers: List[Driver] = []
+
+    if DISPATCH_CANDIDATE_SOURCE == "db":
+        drivers = await crud.get_nearest_available_drivers(
+            db, lat, lon, DISPATCH_CANDIDATES_K, DISPATCH_RADIUS_KM, fresh_after
+        )
+    else:
+        nearby = driver_index.nearest(lat, lon)
+        if nearby:
+            nearby_ids = [driver_id for driver_id, _ in nearby]
+            result = await db.execute(available_query.where(Driver.id.in_(nearby_ids)))
+            drivers = result.scalars().all()
+
+            # Drop index entries that turned unavailable (e.g. via admin) or
+            # went stale behind our back
+            found_ids = {driver.id for driver in drivers}
+            for driver_id in nearby_ids:
+                if driver_id not in found_ids:
+                    driver_index.remove(driver_id)
+
+    if not drivers:
+        result = await db.execute(available_query)
+        drivers = result.scalars().all()
+    return drivers
+
 
 @app.post("/me/location")
 async def set_or_update_location(
@@ -165,45 +291,35 @@ async def set_or_update_location(
         current_user: User = Depends(get_current_user)
 ):
     media_id = await crud.create_or_update_location(db, current_user.id, location_data)
-    result = await db.execute(
-        select(Driver).options(joinedload(Driver.location)).where(Driver.is_available == True)
-    )
-    drivers: List[Driver] = result.scalars().all()
+
+    if DISPATCH_MODE == "batch":
+        return await batch_dispatcher.submit(
+            current_user.id, location_data.latitude, location_data.longitude, media_id
+        )
+
+    drivers = await get_dispatch_candidates(db, location_data.latitude, location_data.longitude)
 
     if not drivers:
         raise HTTPException(status_code=404, detail="No available drivers found")
 
-    # Get user location
-    user_result = await db.execute(select(Location).where(Location.user_id == current_user.id))
-    user_location = user_result.scalar_one_or_none()
-    print(user_location, "user loc")
-    if not user_location:
-        raise HTTPException(status_code=404, detail="User location not found")
-
     # Get driver location
-    driver_eta_list = []
-
-    for driver in drivers:
-        print(driver.driver_name,"driver name")
-        if not driver.location:
-            continue  # skip if location is not available
-
-        try:
-            eta = await get_eta_from_openrouteservice(
-                user_location.latitude, user_location.longitude,
-                driver.location.latitude, driver.location.longitude
-            )
-        except Exception as e:
-            print(f"Error calculating ETA for driver {driver.id}: {e}")
-            eta = DEFAULT_ETA_MINUTES
+    positions = {driver.id: live_locations.position_of(driver) for driver in drivers}
+    located_drivers = [driver for driver in drivers if positions[driver.id]]  # skip if location is not available
+    etas, estimated_ids = await score_drivers_eta(
+        location_data.latitude, location_data.longitude,
+        [(driver.id, *positions[driver.id]) for driver in located_drivers]
+    )
 
+    driver_eta_list = []
+    for driver in located_drivers:
         driver_eta_list.append({
             "media_id":media_id,
             "driver_id": driver.id,
             "first_name": driver.driver_name,
             "mobile": driver.mobile,
             "ambulance_number": driver.ambulance_number,
-            "eta_minutes": eta
+            "eta_minutes": etas[driver.id],
+            "eta_estimated": driver.id in estimated_ids
         })
     if not driver_eta_list:
         raise HTTPException(status_code=404, detail="No driver locations available")
@@ -215,23 +331,10 @@ async def set_or_update_location(
     print(best_driver,"best_drivers")
 
     # 🔁 Create or update the assignment record
-    assignment_result = await db.execute(
-        select(Assignment).where(Assignment.user_id == current_user.id)
-    )
-    assignment = assignment_result.scalar_one_or_none()
-
-    if assignment:
-        assignment.driver_id = best_driver["driver_id"]
-        assignment.assigned_at = datetime.utcnow()
-    else:
-        assignment = Assignment(
-            user_id=current_user.id,
-            driver_id=best_driver["driver_id"]
-        )
-        db.add(assignment)
-
+    assignment = await crud.upsert_assignment(db, current_user.id, best_driver["driver_id"])
     await db.commit()
     best_driver["assignment_id"] = assignment.id
+    best_driver["estimated_eta_driver_ids"] = sorted(estimated_ids)
     await notify_driver_of_assignment(
         db=db,
         driver_id=best_driver["driver_id"],
@@ -239,6 +342,10 @@ async def set_or_update_location(
         media_id=str(media_id),
         assignment_id=assignment.id
     )
+    redispatcher.remember(
+        assignment.id, current_user.id, media_id, [entry["driver_id"] for entry in sorted_drivers],
+        assignment.assigned_at
+    )
 
     return best_driver
 
@@ -307,7 +414,6 @@ from fastapi import UploadFile, File, Form
 #     return {"message": "Images uploaded successfully"}
 
 from fastapi import WebSocket
-import base64
 
 @app.post("/me/upload/image")
 async def upload_image(
@@ -338,49 +444,19 @@ async def upload_image(
     if assignment:
         driver_id = assignment.driver_id
         print(driver_id,"driver id")
-        images = media.image_path if media.image_path else []
-        print(images,"images")
-        # Step 1: Join back into a full string
-        stringified = ''.join(images)
-
-        # Step 2: Remove `{` and `}`
-        cleaned = stringified.strip("{}")
-
-        # Step 3: Split by comma to get proper list
-        image_paths = cleaned.split(',')
-
-        # Result
+        image_paths = stored_image_paths(media.image_path)
         print(image_paths)
 
-        image_bytes_list = []
-        # BASE_DIR = os.getcwd()  # or use your project root explicitly
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # directory of this file
-
-        for img_path in image_paths:
-            # full_path = os.path.join(BASE_DIR, img_path)  # builds full path like 'uploads/images/xyz.png'
-            full_path = os.path.join(BASE_DIR, "uploads", "images", os.path.basename(img_path.strip()))
-
-            try:
-                with open(full_path, "rb") as f:
-                    content = f.read()
-                    base64_encoded = base64.b64encode(content).decode("utf-8")
-                    image_bytes_list.append({
-                        "filename": os.path.basename(img_path),
-                        "data": base64_encoded
-                    })
-            except Exception as e:
-                print(f"Failed to read image {img_path}: {e}")
-
-        # Step 4: Send via WebSocket using background task
+        # Step 4: Send links (or the bytes) to the driver using a background task
         background_tasks.add_task(
             send_images_via_websocket_to_driver,
             driver_id,
             {
                 "user_id": current_user.id,
                 "media_id": str(media_id),
-                "images": image_bytes_list,
                 "message": "User uploaded new images"
-            }
+            },
+            image_paths
         )
 
     return {"message": "Images uploaded and sent to driver"}
@@ -394,13 +470,43 @@ async def upload_image(
 #     else:
 #         print(f"No active WebSocket connection for driver {driver_id}")
 
-async def send_images_via_websocket_to_driver(driver_id: int, payload: dict):
-    socket = manager.get_socket_by_driver_id(driver_id)
-    if socket:
-        await manager.send_message(driver_id, payload)
+async def send_images_via_websocket_to_driver(driver_id: int, header: dict, image_paths: List[str]):
+    # Delivered by whichever worker holds the driver's socket. With signed
+    # URLs the message is small and goes through the outbox like an
+    # assignment; inline bytes stay droppable and send the preview instead
+    # of the original when there is one. Never waits for derivatives: the
+    # links go out with whatever exists and are sent again once the rest
+    # are rendered.
+    rendering = image_derivatives.rendering(image_paths)
+    if MEDIA_DELIVERY == "url":
+        sent = await manager.send_message(driver_id, {
+            **header,
+            "type": "media_urls",
+            "files": await media_references(image_paths),
+        })
+    else:
+        BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # directory of this file
+        full_paths = []
+        for path in image_paths:
+            preview = os.path.join(BASE_DIR, derivative_path(path, "preview"))
+            full_paths.append(preview if os.path.exists(preview) else os.path.join(BASE_DIR, path))
+        sent = await manager.send_media(driver_id, header, full_paths)
+    if sent:
         print("success")
     else:
         print(f"No active WebSocket connection for driver {driver_id}")
+        return
+    # Inline sends already carried the full image
+    if MEDIA_DELIVERY != "url" or not rendering:
+        return
+    done, _ = await asyncio.wait(rendering, timeout=IMAGE_DERIVATIVE_WAIT_SECONDS)
+    if any(not future.cancelled() and future.result() for future in done):
+        await manager.send_message(driver_id, {
+            **header,
+            "type": "media_urls",
+            "message": "Smaller versions of the images are ready",
+            "files": await media_references(image_paths),
+        })
 
 @app.post("/me/upload/audio")
 async def upload_audio(
@@ -468,6 +574,23 @@ async def register_driver(driver: DriverCreate, db: AsyncSession = Depends(get_d
 async def list_all_drivers(db: AsyncSession = Depends(get_db)):
     return await crud.get_all_drivers(db)
 
+
+@app.get("/drivers/{driver_id}/track")
+async def get_driver_track(
+    driver_id: int,
+    start: datetime,
+    end: datetime,
+    db: AsyncSession = Depends(get_db),
+    current_driver = Depends(get_current_driver)
+):
+    if driver_id != current_driver.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if end - start > timedelta(hours=HISTORY_MAX_WINDOW_HOURS):
+        raise HTTPException(status_code=400, detail=f"Window is longer than {HISTORY_MAX_WINDOW_HOURS:g} hours")
+    return await location_history.track(db, driver_id, start, end)
+
 # app/websocket_manager.py
 
 
@@ -488,17 +611,114 @@ async def list_all_drivers(db: AsyncSession = Depends(get_db)):
 #     except WebSocketDisconnect:
 #         connected_drivers.pop(int(driver_id), None)
 
-@app.websocket("/ws/driver/{driver_id}")
-async def websocket_endpoint(websocket: WebSocket, driver_id: int):
+# How often a driver's socket re-reads is_available (changed by admin or on
+# another worker) before indexing its location frames
+DRIVER_AVAILABILITY_REFRESH_SECONDS = float(os.getenv("DRIVER_AVAILABILITY_REFRESH_SECONDS", "10"))
+
+
+async def refresh_availability(driver: Driver):
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Driver.is_available).where(Driver.id == driver.id))
+        driver.is_available = bool(result.scalar_one_or_none())
+
 
-    await manager.connect(driver_id, websocket)
+@app.websocket("/ws/driver/{driver_id}")
+async def websocket_endpoint(
+    websocket: WebSocket, driver_id: int, token: Optional[str] = None,
+    resume: Optional[int] = None, epoch: Optional[str] = None,
+):
+    # Drivers that pass their token (?token=...) are authenticated once here
+    # and may then stream location frames and acks over the socket. Without
+    # a token the socket only receives live messages. Authenticated clients
+    # that pass ?resume=<seq>&epoch=<epoch> get unacked messages replayed on
+    # connect.
+    driver = None
+    if token:
+        async with AsyncSessionLocal() as db:
+            try:
+                driver = await get_driver_from_token(token, db)
+            except HTTPException:
+                driver = None
+        if driver is None or driver.id != driver_id:
+            await websocket.close(code=1008)  # policy violation
+            return
+
+    await manager.connect(
+        driver_id, websocket, resume_after=resume, resume_epoch=epoch, authenticated=driver is not None
+    )
+    driver_liveness.touch(driver_id)
     print(f"Driver {driver_id} connected via WebSocket")
+    availability_checked_at = time.monotonic()
     try:
         while True:
-            await websocket.receive_text()  # Keep alive
+            message = await websocket.receive_text()
+            # Any frame, including {"type": "pong"}, answers the keepalive ping
+            manager.seen(driver_id, websocket)
+            driver_liveness.touch(driver_id)
+            if driver is None:
+                continue  # Keep alive
+            ack = parse_ack_frame(message)
+            if ack is not None:
+                await outbox.ack(driver_id, *ack)
+                continue
+            location = parse_location_frame(message)
+            if location:
+                if time.monotonic() - availability_checked_at >= DRIVER_AVAILABILITY_REFRESH_SECONDS:
+                    availability_checked_at = time.monotonic()
+                    try:
+                        await refresh_availability(driver)
+                    except Exception as e:
+                        print(f"Failed to refresh availability of driver {driver_id}: {e}")
+                record_driver_location(driver, *location)
     except WebSocketDisconnect:
-        manager.disconnect(driver_id)
         print(f"Driver {driver_id} disconnected")
+    finally:
+        # No-op if this socket was already reaped or replaced
+        await manager.disconnect(driver_id, websocket)
+        if driver_id not in manager.active_connections:
+            driver_liveness.disconnected(driver_id)
+
+
+def parse_ack_frame(message: str):
+    # {"type": "ack", "seq": N, "epoch": E} acknowledges every outbox
+    # message up to N; returns (seq, epoch)
+    if '"ack"' not in message:
+        return None
+    try:
+        frame = json.loads(message)
+        if isinstance(frame, dict) and frame.get("type") == "ack":
+            epoch = frame.get("epoch")
+            return int(frame["seq"]), str(epoch) if epoch is not None else None
+    except (ValueError, TypeError, KeyError):
+        pass
+    return None
+
+
+def parse_location_frame(message: str):
+    # Accepts [lat, lon] or {"lat": .., "lon": ..}; anything else is ignored
+    try:
+        frame = json.loads(message)
+        if isinstance(frame, list) and len(frame) == 2:
+            lat, lon = frame
+        elif isinstance(frame, dict) and "lat" in frame and "lon" in frame:
+            lat, lon = frame["lat"], frame["lon"]
+        else:
+            return None
+        lat, lon = float(lat), float(lon)
+    except (ValueError, TypeError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def record_driver_location(driver: Driver, lat: float, lon: float):
+    # Written behind to driver_locations by live_locations' flusher. The
+    # socket path refreshes driver.is_available every few seconds; the HTTP
+    # path loads the driver per request.
+    live_locations.record(driver.id, lat, lon)
+    driver_liveness.touch(driver.id)
+    driver_index.set_available(driver.id, driver.is_available, lat, lon)
 
 
 # async def notify_driver(driver_id: int, message: dict):
@@ -511,27 +731,7 @@ async def update_driver_location(
     db: AsyncSession = Depends(get_db),
     driver = Depends(get_current_driver)
 ):
-    lat = data.latitude
-    lon = data.longitude
-
-    # Check if record exists
-    result = await db.execute(
-        select(DriverLocation).where(DriverLocation.driver_id == driver.id)
-    )
-    loc = result.scalar_one_or_none()
-
-    if loc:
-        loc.latitude = lat
-        loc.longitude = lon
-    else:
-        loc = DriverLocation(
-            driver_id=driver.id,
-            latitude=lat,
-            longitude=lon
-        )
-        db.add(loc)
-
-    await db.commit()
+    record_driver_location(driver, data.latitude, data.longitude)
     return {"status": "Location updated"}
 
 
@@ -584,35 +784,6 @@ async def driver_login(
 
     raise HTTPException(status_code=404, detail="Driver not found")
 
-import httpx
-
-ORS_API_KEY = "5b3ce3597851110001cf62483670764117264d618322ac641fb0f58c"
-
-async def get_eta_from_openrouteservice(user_lat, user_lon, driver_lat, driver_lon):
-    url = "https://api.openrouteservice.org/v2/directions/driving-car/geojson"
-    headers = {
-        "Authorization": ORS_API_KEY,
-        "Content-Type": "application/json"
-    }
-    body = {
-        "coordinates": [
-            [driver_lon, driver_lat],  # Origin
-            [user_lon, user_lat]       # Destination
-        ]
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, json=body, headers=headers)
-
-    if response.status_code == 200:
-        data = response.json()
-        duration_seconds = data["features"][0]["properties"]["summary"]["duration"]
-        eta_minutes = round(duration_seconds / 60)
-        return eta_minutes
-    else:
-        raise Exception(f"ORS Error: {response.status_code} {response.text}")
-
-
 @app.post("/test/generate-driver-token")
 async def generate_driver_token(data: DriverTokenInput):
     token = create_driver_access_token(
@@ -650,12 +821,13 @@ async def generate_user_token(data: UserTokenInput):
 @app.post("/ride/respond")
 async def respond_to_ride(
     data: AssignmentUpdate,
+    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
     current_driver = Depends(get_current_driver)
 ):
-    # Step 1: Fetch assignment
+    # Step 1: Fetch assignment (locked, so a re-dispatch can't move it mid-answer)
     result = await db.execute(
-        select(Assignment).where(Assignment.id == data.assignment_id)
+        select(Assignment).where(Assignment.id == data.assignment_id).with_for_update()
     )
     assignment = result.scalar_one_or_none()
 
@@ -672,9 +844,9 @@ async def respond_to_ride(
     assignment.status = data.status
     assignment.responded_at = datetime.utcnow()
     await db.commit()
-    await db.refresh(assignment)
 
     if data.status == "accepted":
+        redispatcher.forget(assignment.id)
         # Step 3: Get user details
         user_result = await db.execute(select(User).where(User.id == assignment.user_id))
         user = user_result.scalar_one_or_none()
@@ -701,8 +873,16 @@ async def respond_to_ride(
         }
 
     else:
+        # Offer the ride to the next cached candidate right away, instead of
+        # also when the offer times out
+        redispatcher.cancel_timer(assignment.id)
+        background_tasks.add_task(redispatcher.reassign, assignment.id, current_driver.id)
         return {"message": "Ride request denied by driver"}
 
+# Follow-up media sends still running, referenced until they finish
+media_sends: set[asyncio.Task] = set()
+
+
 async def notify_driver_of_assignment(
     db: AsyncSession,
     driver_id: int,
@@ -711,6 +891,9 @@ async def notify_driver_of_assignment(
     assignment_id: int
 ):
     print("in of notify")
+    # Callers notify right after committing the assignment; drivers use
+    # this to measure delivery latency
+    committed_at = time.time()
     # Fetch user and location
     user_result = await db.execute(select(User).where(User.id == user_id))
     user = user_result.scalar_one_or_none()
@@ -721,6 +904,13 @@ async def notify_driver_of_assignment(
     if not user or not location:
         print(f"Failed to fetch user or location for driver {driver_id}")
         return
+
+    # What the user already uploaded, so a reassigned driver gets the
+    # media without anyone re-sending it
+    image_paths = []
+    if MEDIA_DELIVERY == "url":
+        media_result = await db.execute(select(MediaData.image_path).where(MediaData.user_id == user_id))
+        image_paths = [path for image_path in media_result.scalars() for path in stored_image_paths(image_path)]
     print({
         "user_id": user.id,
         "first_name": user.first_name,
@@ -747,4 +937,24 @@ async def notify_driver_of_assignment(
         "message": "You have a new ride request from a user.",
         "assignment_id": assignment_id,
         "media_id": media_id,
-    })
\ No newline at end of file
+        "committed_at": committed_at,
+    })
+    # Links follow as their own message: building them stats and hashes
+    # every file, which must not delay the assignment
+    if image_paths:
+        task = asyncio.create_task(send_images_via_websocket_to_driver(
+            driver_id,
+            {
+                "user_id": user.id,
+                "media_id": str(media_id),
+                "assignment_id": assignment_id,
+                "message": "Media the user uploaded before this assignment",
+            },
+            image_paths,
+        ))
+        media_sends.add(task)
+        task.add_done_callback(media_sends.discard)
+
+
+redispatcher = Redispatcher(notify_driver_of_assignment)
+batch_dispatcher = BatchDispatcher(get_dispatch_candidates, notify_driver_of_assignment, redispatcher.remember)
@@ -0,0 +1,125 @@
+import heapq
+import math
+import os
+from collections import defaultdict
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.32
+
+# Grid cell size in degrees (0.05 deg ~ 5.5 km of latitude)
+SPATIAL_CELL_SIZE_DEG = float(os.getenv("SPATIAL_CELL_SIZE_DEG", "0.05"))
+DISPATCH_CANDIDATES_K = int(os.getenv("DISPATCH_CANDIDATES_K", "10"))
+DISPATCH_RADIUS_KM = float(os.getenv("DISPATCH_RADIUS_KM", "50"))
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class DriverSpatialIndex:
+    # Grid bucket map of available drivers: (row, col) cell -> driver ids.
+    # Lookups walk rings of cells outwards from the caller's cell, so the
+    # cost depends on local density, not on the size of the fleet.
+
+    def __init__(self, cell_size_deg: float = SPATIAL_CELL_SIZE_DEG):
+        self.cell_size = cell_size_deg
+        self.cells: dict[tuple[int, int], set[int]] = defaultdict(set)
+        self.positions: dict[int, tuple[float, float, tuple[int, int]]] = {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, driver_id: int):
+        return driver_id in self.positions
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def update(self, driver_id: int, lat: float, lon: float):
+        cell = self._cell(lat, lon)
+        current = self.positions.get(driver_id)
+        if current and current[2] != cell:
+            self._discard(driver_id, current[2])
+        self.cells[cell].add(driver_id)
+        self.positions[driver_id] = (lat, lon, cell)
+
+    def remove(self, driver_id: int):
+        current = self.positions.pop(driver_id, None)
+        if current:
+            self._discard(driver_id, current[2])
+
+    def _discard(self, driver_id: int, cell: tuple[int, int]):
+        bucket = self.cells.get(cell)
+        if bucket is None:
+            return
+        bucket.discard(driver_id)
+        if not bucket:
+            del self.cells[cell]
+
+    def set_available(self, driver_id: int, available: bool, lat: float = None, lon: float = None):
+        if not available:
+            self.remove(driver_id)
+        elif lat is not None and lon is not None:
+            self.update(driver_id, lat, lon)
+
+    def clear(self):
+        self.cells.clear()
+        self.positions.clear()
+
+    def _ring(self, row: int, col: int, r: int):
+        if r == 0:
+            yield row, col
+            return
+        for dc in range(-r, r + 1):
+            yield row - r, col + dc
+            yield row + r, col + dc
+        for dr in range(-r + 1, r):
+            yield row + dr, col - r
+            yield row + dr, col + r
+
+    def nearest(
+        self,
+        lat: float,
+        lon: float,
+        k: int = DISPATCH_CANDIDATES_K,
+        radius_km: float = DISPATCH_RADIUS_KM,
+    ) -> list[tuple[int, float]]:
+        # Returns up to k (driver_id, distance_km) pairs within radius_km,
+        # closest first.
+        if not self.positions or k <= 0:
+            return []
+
+        # Smallest ground distance covered by one cell, used to bound how far
+        # away anything in an unvisited ring can possibly be.
+        km_per_deg_lon = KM_PER_DEGREE_LAT * max(math.cos(math.radians(min(abs(lat), 89.0))), 0.01)
+        cell_km = self.cell_size * min(KM_PER_DEGREE_LAT, km_per_deg_lon)
+        max_ring = math.ceil(radius_km / cell_km) + 1
+
+        row, col = self._cell(lat, lon)
+        best: list[tuple[float, int]] = []  # max-heap on distance via negation
+        for r in range(max_ring + 1):
+            for cell in self._ring(row, col, r):
+                for driver_id in self.cells.get(cell, ()):
+                    d_lat, d_lon, _ = self.positions[driver_id]
+                    dist = haversine_km(lat, lon, d_lat, d_lon)
+                    if dist > radius_km:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-dist, driver_id))
+                    elif dist < -best[0][0]:
+                        heapq.heapreplace(best, (-dist, driver_id))
+            # Anything beyond ring r is at least r cells away
+            if len(best) >= k and -best[0][0] <= r * cell_km:
+                break
+            if len(best) == len(self.positions):
+                break
+
+        return sorted(((driver_id, -neg) for neg, driver_id in best), key=lambda x: x[1])
+
+
+driver_index = DriverSpatialIndex()
@@ -1,27 +1,351 @@
+import asyncio
+import mimetypes
+import os
+import time
+import uuid
+from collections import deque
+
 from fastapi import WebSocket
+
+from .backplane import backplane
+from .outbox import outbox
+
+# Outbound messages buffered per driver socket
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+# A socket that can't take one message in this long is disconnected
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+# When the queue is full: "drop_oldest" evicts the oldest droppable (media)
+# message, "drop_new" refuses the new droppable message. Assignments are
+# never dropped.
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+# Dead connections are found by uvicorn's protocol-level pings
+# (--ws-ping-interval / --ws-ping-timeout, 20s each by default), which
+# WebSocket stacks answer on their own. The app-level ping below is opt-in
+# for clients that answer it: sockets silent this long get a
+# {"type": "ping"}, any frame back counts as the pong, and sockets that
+# don't answer within the timeout are closed. 0 = off.
+WS_PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", "0"))
+WS_PONG_TIMEOUT_SECONDS = float(os.getenv("WS_PONG_TIMEOUT_SECONDS", "10"))
+# Close code sent to the older socket when a driver connects again
+WS_CLOSE_REPLACED = 4000
+# Unsent messages of a dropped socket wait this long for the driver to
+# reconnect, in case the disconnect is noticed before the new connection
+WS_HANDOVER_SECONDS = float(os.getenv("WS_HANDOVER_SECONDS", "30"))
+# Binary frame size for media files
+WS_MEDIA_CHUNK_BYTES = int(os.getenv("WS_MEDIA_CHUNK_BYTES", str(64 * 1024)))
+
+
+class MediaTransfer:
+    # Media sent as binary frames instead of base64 inside JSON:
+    #   text   {"type": "media", "transfer_id", "files": [{"filename", "size", "content_type"}], ...}
+    #   binary each file's bytes in order, in chunks of at most chunk_size
+    #   text   {"type": "media_end", "transfer_id"}
+    # Files are read one chunk at a time when the writer gets to them.
+
+    MARKER = "__media_transfer__"
+
+    def __init__(self, header: dict, paths: list[str]):
+        self.header = header
+        self.paths = paths
+
+    def to_message(self) -> dict:
+        # JSON-safe form for the backplane
+        return {self.MARKER: {"header": self.header, "paths": self.paths}}
+
+    @classmethod
+    def from_message(cls, message: dict):
+        if isinstance(message, dict) and cls.MARKER in message:
+            return cls(message[cls.MARKER]["header"], message[cls.MARKER]["paths"])
+        return None
+
+    async def frames(self):
+        files = []
+        for path in self.paths:
+            try:
+                size = os.path.getsize(path)
+            except OSError as e:
+                print(f"Skipping media file {path}: {e}")
+                continue
+            files.append((path, {
+                "filename": os.path.basename(path),
+                "size": size,
+                "content_type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+            }))
+        transfer_id = uuid.uuid4().hex
+        yield {
+            **self.header,
+            "type": "media",
+            "transfer_id": transfer_id,
+            "chunk_size": WS_MEDIA_CHUNK_BYTES,
+            "files": [meta for _, meta in files],
+        }
+        for path, meta in files:
+            with open(path, "rb") as f:
+                remaining = meta["size"]
+                while remaining > 0:
+                    chunk = await asyncio.to_thread(f.read, min(WS_MEDIA_CHUNK_BYTES, remaining))
+                    if not chunk:
+                        raise OSError(f"{path} shrank while being sent")
+                    remaining -= len(chunk)
+                    yield chunk
+        yield {"type": "media_end", "transfer_id": transfer_id}
+
+
+class DriverSocket:
+    # One driver connection with its own bounded outbound queue. A writer
+    # task drains the queue, so senders never wait on the network.
+
+    def __init__(self, driver_id: int, websocket: WebSocket, on_dead):
+        self.driver_id = driver_id
+        self.websocket = websocket
+        self.on_dead = on_dead
+        self.queue: deque[tuple[dict | MediaTransfer, bool]] = deque()
+        # queue[0] is being sent; it stays queued until the send succeeds,
+        # so a cancelled writer hands it on instead of losing it
+        self.sending = False
+        self.ready = asyncio.Event()
+        self.writer: asyncio.Task | None = None
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self.pinged_at: float | None = None
+        self.counters = {
+            "sent": 0, "dropped": 0, "send_timeouts": 0, "send_errors": 0, "max_depth": 0, "media_bytes": 0,
+        }
+
+    def start(self):
+        self.writer = asyncio.create_task(self._drain())
+
+    def stop(self):
+        if self.writer is not None and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        self.writer = None
+
+    def offer(self, message: dict | MediaTransfer, droppable: bool = False) -> bool:
+        if len(self.queue) >= WS_SEND_QUEUE_SIZE:
+            victim = None
+            if WS_OVERFLOW_POLICY == "drop_oldest":
+                start = 1 if self.sending else 0
+                victim = next(
+                    (i for i, (_, can_drop) in enumerate(self.queue) if can_drop and i >= start), None
+                )
+            if victim is not None:
+                del self.queue[victim]
+                self.counters["dropped"] += 1
+            elif droppable:
+                self.counters["dropped"] += 1
+                return False
+            # else: only assignments queued; go over the bound rather than lose one
+        self.queue.append((message, droppable))
+        self.counters["max_depth"] = max(self.counters["max_depth"], len(self.queue))
+        self.ready.set()
+        return True
+
+    async def _drain(self):
+        while True:
+            if not self.queue:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            message, _ = self.queue[0]
+            self.sending = True
+            try:
+                await self._send(message)
+            except asyncio.TimeoutError:
+                self.counters["send_timeouts"] += 1
+                await self._close(f"send timed out after {WS_SEND_TIMEOUT_SECONDS}s")
+                return
+            except Exception as e:
+                self.counters["send_errors"] += 1
+                await self._close(f"send failed: {e}")
+                return
+            finally:
+                self.sending = False
+            self.queue.popleft()
+            self.counters["sent"] += 1
+
+    async def _send(self, message: dict | MediaTransfer):
+        # The timeout applies per frame, so large media isn't cut off
+        if not isinstance(message, MediaTransfer):
+            await asyncio.wait_for(self.websocket.send_json(message), WS_SEND_TIMEOUT_SECONDS)
+            return
+        async for frame in message.frames():
+            if isinstance(frame, bytes):
+                await asyncio.wait_for(self.websocket.send_bytes(frame), WS_SEND_TIMEOUT_SECONDS)
+                self.counters["media_bytes"] += len(frame)
+            else:
+                await asyncio.wait_for(self.websocket.send_json(frame), WS_SEND_TIMEOUT_SECONDS)
+
+    async def _close(self, reason: str, code: int = 1011):
+        print(f"Disconnecting driver {self.driver_id}: {reason} ({len(self.queue)} messages unsent)")
+        await self.on_dead(self)
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), 1)
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "depth": len(self.queue),
+            "connected_seconds": round(now - self.connected_at, 1),
+            "idle_seconds": round(now - self.last_seen, 1),
+            **self.counters,
+        }
+
+
 # app/websocket_manager.py
 class ConnectionManager:
+    # Sockets held by this worker. Messages for drivers connected to another
+    # worker go through the backplane.
     def __init__(self):
         self.active_connections: dict[int, WebSocket] = {}
+        self.sockets: dict[int, DriverSocket] = {}
+        self.keepalive_task: asyncio.Task | None = None
+        # driver_id -> (unsent messages, monotonic time) of dropped sockets
+        self.orphaned: dict[int, tuple[deque, float]] = {}
+        self.counters = {"pings": 0, "reaped": 0, "replaced": 0, "handed_over": 0}
 
-    async def connect(self, driver_id: int, websocket: WebSocket):
+    async def connect(
+        self, driver_id: int, websocket: WebSocket, resume_after: int | None = None,
+        resume_epoch: str | None = None, authenticated: bool = False,
+    ):
+        # Only authenticated sockets get messages sent before they connected
+        # (unsent queue, outbox replay); replay also needs the client to ask
+        # for it with resume_after, since old clients never ack
         await websocket.accept()
+        connection = DriverSocket(driver_id, websocket, self._drop)
+        previous = self.sockets.get(driver_id)
+        if previous is not None:
+            # Same driver again (app restart, network switch): keep the new
+            # socket, hand it the unsent messages and close the old one
+            previous.stop()
+            if authenticated:
+                connection.queue.extend(previous.queue)
+            elif previous.queue:
+                self.orphaned[driver_id] = (previous.queue, time.monotonic())
+            self.counters["replaced"] += 1
+            asyncio.create_task(previous._close("replaced by a new connection", WS_CLOSE_REPLACED))
+        elif authenticated:
+            # The old socket was dropped before this one arrived
+            self._purge_orphaned()
+            orphaned = self.orphaned.pop(driver_id, None)
+            if orphaned is not None:
+                connection.queue.extend(orphaned[0])
+                self.counters["handed_over"] += 1
         self.active_connections[driver_id] = websocket
+        self.sockets[driver_id] = connection
+        if authenticated and resume_after is not None:
+            # Replay what the driver hasn't acked, skipping what's already queued
+            queued = {message.get("seq") for message, _ in connection.queue if isinstance(message, dict)}
+            for message in await outbox.replay(driver_id, resume_after, resume_epoch):
+                if message["seq"] not in queued:
+                    connection.offer(message)
+        connection.start()
+        try:
+            await backplane.register(driver_id)
+        except Exception as e:
+            print(f"Failed to register driver {driver_id} with the backplane: {e}")
         print("Active driver connections:", manager.active_connections.keys())
 
-    def disconnect(self, driver_id: int):
+    async def disconnect(self, driver_id: int, websocket: WebSocket = None):
+        # With a websocket, only disconnect if it is still the driver's
+        # current one; a replaced socket must not evict its successor
+        if websocket is not None and self.active_connections.get(driver_id) is not websocket:
+            return
         self.active_connections.pop(driver_id, None)
+        connection = self.sockets.pop(driver_id, None)
+        if connection is not None:
+            connection.stop()
+            # Kept for a reconnect within WS_HANDOVER_SECONDS
+            self._purge_orphaned()
+            if connection.queue:
+                self.orphaned[driver_id] = (connection.queue, time.monotonic())
+        try:
+            await backplane.unregister(driver_id)
+        except Exception as e:
+            print(f"Failed to unregister driver {driver_id} from the backplane: {e}")
+
+    def _purge_orphaned(self):
+        now = time.monotonic()
+        for driver_id, (_, dropped_at) in list(self.orphaned.items()):
+            if now - dropped_at > WS_HANDOVER_SECONDS:
+                del self.orphaned[driver_id]
+
+    async def _drop(self, connection: DriverSocket):
+        # Writer or reaper gave up on a socket
+        await self.disconnect(connection.driver_id, connection.websocket)
 
-    async def send_message(self, driver_id: int, message: dict):
+    def seen(self, driver_id: int, websocket: WebSocket):
+        connection = self.sockets.get(driver_id)
+        if connection is not None and connection.websocket is websocket:
+            connection.last_seen = time.monotonic()
+            connection.pinged_at = None
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(min(WS_PING_INTERVAL_SECONDS, WS_PONG_TIMEOUT_SECONDS) / 2)
+            now = time.monotonic()
+            silent = []
+            for connection in list(self.sockets.values()):
+                if connection.pinged_at is not None:
+                    if now - connection.pinged_at > WS_PONG_TIMEOUT_SECONDS:
+                        silent.append(connection)
+                elif now - connection.last_seen >= WS_PING_INTERVAL_SECONDS:
+                    connection.pinged_at = now
+                    connection.offer({"type": "ping"}, droppable=True)
+                    self.counters["pings"] += 1
+            if silent:
+                self.counters["reaped"] += len(silent)
+                await asyncio.gather(*(connection._close("no pong", code=1001) for connection in silent))
+
+    async def start(self):
+        if self.keepalive_task is None and WS_PING_INTERVAL_SECONDS > 0:
+            self.keepalive_task = asyncio.create_task(self._keepalive())
+
+    async def stop(self):
+        if self.keepalive_task is not None:
+            self.keepalive_task.cancel()
+            await asyncio.gather(self.keepalive_task, return_exceptions=True)
+            self.keepalive_task = None
+
+    async def send_message(self, driver_id: int, message: dict, droppable: bool = False) -> bool:
+        # Returns once the message is queued, not when it is sent. Messages
+        # that must not be dropped go through the outbox first, so they are
+        # replayed if the driver is offline or disconnects before acking.
         print(self.active_connections,"active connectionss")
-        websocket = self.active_connections.get(driver_id)
-        if websocket:
-            print("in of if socket")
-            await websocket.send_json(message)
+        if not droppable:
+            message = await outbox.append(driver_id, message)
+        if driver_id in self.sockets:
+            return await self.deliver_local(driver_id, message, droppable)
+        try:
+            return await backplane.publish(driver_id, message, droppable)
+        except Exception as e:
+            print(f"Backplane publish to driver {driver_id} failed: {e}")
+            return False
+
+    async def send_media(self, driver_id: int, header: dict, paths: list[str]) -> bool:
+        # Media is always droppable; a newer upload supersedes it
+        return await self.send_message(driver_id, MediaTransfer(header, paths).to_message(), droppable=True)
+
+    async def deliver_local(self, driver_id: int, message: dict, droppable: bool = False) -> bool:
+        connection = self.sockets.get(driver_id)
+        if connection is None:
+            return False
+        return connection.offer(MediaTransfer.from_message(message) or message, droppable)
 
     def get_socket_by_driver_id(self, driver_id: int):
         return self.active_connections.get(driver_id)
 
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.sockets),
+            **self.counters,
+            "queued": sum(len(connection.queue) for connection in self.sockets.values()),
+            "orphaned": len(self.orphaned),
+            "overflow_policy": WS_OVERFLOW_POLICY,
+            "per_connection": {driver_id: connection.stats() for driver_id, connection in self.sockets.items()},
+        }
+
 # connected_drivers = {}  # driver_id -> websocket
 #
 # async def notify_driver(driver_id: int, payload: dict):
@@ -30,4 +354,3 @@ class ConnectionManager:
 #         await ws.send_json(payload)
 #
 manager = ConnectionManager()
-
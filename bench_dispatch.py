@@ -0,0 +1,181 @@
+# End-to-end dispatch load benchmark.
+#
+# Seeds N drivers with DriverLocation rows, then runs M users through
+# POST /users -> POST /me/location against the app in-process, with routing
+# going to a local ors_stub on --stub-port. Prints a JSON report with latency
+# percentiles, DB query counts and throughput.
+#
+#   DATABASE_URL=postgresql+asyncpg://... python bench_dispatch.py --drivers 1000 --users 200
+#
+# Seeded rows are tagged with the run id in mobile/ambulance numbers and are
+# left in the database, with the drivers marked unavailable at the end so
+# real rides are never dispatched to them.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+
+# Rough bounding box around Kochi
+LAT_RANGE = (9.85, 10.15)
+LON_RANGE = (76.2, 76.45)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Dispatch load benchmark")
+    parser.add_argument("--drivers", type=int, default=500)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--stub-port", type=int, default=8081)
+    parser.add_argument("--stub-latency-ms", type=float, default=50)
+    parser.add_argument("--stub-jitter-ms", type=float, default=50)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Write the JSON report here as well as stdout")
+    return parser.parse_args()
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        value = samples[0] if samples else None
+        return {"p50": value, "p95": value, "p99": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50": round(cuts[49], 2),
+        "p95": round(cuts[94], 2),
+        "p99": round(cuts[98], 2),
+        "max": round(max(samples), 2),
+    }
+
+
+async def main(args):
+    os.environ["ORS_BASE_URL"] = f"http://127.0.0.1:{args.stub_port}"
+    os.environ["ORS_STUB_LATENCY_MS"] = str(args.stub_latency_ms)
+    os.environ["ORS_STUB_JITTER_MS"] = str(args.stub_jitter_ms)
+    os.environ["ORS_STUB_ERROR_RATE"] = str(args.stub_error_rate)
+
+    # Imported after the environment is set; both read their config at import
+    import httpx
+    import uvicorn
+    from sqlalchemy import event, update
+
+    import ors_stub
+    from app.db import AsyncSessionLocal, engine
+    from app.models import Driver, DriverLocation
+    from app.service import app, lifespan
+
+    stub = uvicorn.Server(uvicorn.Config(ors_stub.app, port=args.stub_port, log_level="warning"))
+    stub_task = asyncio.create_task(stub.serve())
+    while not stub.started:
+        await asyncio.sleep(0.05)
+
+    run_id = uuid.uuid4().hex[:8]
+    async with AsyncSessionLocal() as db:
+        drivers = [
+            Driver(
+                owner_name="bench", owner_number="0", owner_email="bench@example.com",
+                driver_name=f"bench-{run_id}-{i}", mobile=f"b{run_id}{i}",
+                ambulance_number=f"BENCH-{run_id}-{i}", is_available=True,
+            )
+            for i in range(args.drivers)
+        ]
+        db.add_all(drivers)
+        await db.flush()
+        driver_ids = [driver.id for driver in drivers]
+        db.add_all(
+            DriverLocation(
+                driver_id=driver.id,
+                latitude=random.uniform(*LAT_RANGE),
+                longitude=random.uniform(*LON_RANGE),
+            )
+            for driver in drivers
+        )
+        await db.commit()
+
+    try:
+        query_count = 0
+
+        def count_query(*_):
+            nonlocal query_count
+            query_count += 1
+
+        event.listen(engine.sync_engine, "before_cursor_execute", count_query)
+
+        timings = {"create_user": [], "dispatch": [], "total": []}
+        statuses = {}
+        estimated_share = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+
+                async def run_user(i):
+                    async with semaphore:
+                        start = time.perf_counter()
+                        response = await client.post("/users", json={
+                            "first_name": "Bench", "last_name": str(i), "mobile": f"u{run_id}{i}",
+                        })
+                        created = time.perf_counter()
+                        timings["create_user"].append((created - start) * 1000)
+                        if response.status_code != 200:
+                            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                            return
+
+                        token = response.json()["access_token"]
+                        response = await client.post(
+                            "/me/location",
+                            json={"latitude": random.uniform(*LAT_RANGE), "longitude": random.uniform(*LON_RANGE)},
+                            headers={"Authorization": f"Bearer {token}"},
+                        )
+                        done = time.perf_counter()
+                        timings["dispatch"].append((done - created) * 1000)
+                        timings["total"].append((done - start) * 1000)
+                        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                        if response.status_code == 200:
+                            body = response.json()
+                            estimated_share.append(1.0 if body.get("eta_estimated") else 0.0)
+
+                queries_before = query_count
+                wall_start = time.perf_counter()
+                await asyncio.gather(*(run_user(i) for i in range(args.users)))
+                wall = time.perf_counter() - wall_start
+                metrics = (await client.get("/metrics")).json()
+
+        event.remove(engine.sync_engine, "before_cursor_execute", count_query)
+        stub.should_exit = True
+        await stub_task
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Driver).where(Driver.id.in_(driver_ids)).values(is_available=False)
+            )
+            await db.commit()
+
+    dispatched = len(timings["dispatch"])
+    report = {
+        "run_id": run_id,
+        "config": vars(args),
+        "wall_seconds": round(wall, 3),
+        "throughput_dispatches_per_second": round(dispatched / wall, 2) if wall else None,
+        "status_codes": statuses,
+        "latency_ms": {name: percentiles(samples) for name, samples in timings.items()},
+        "db_queries": {
+            "total": query_count - queries_before,
+            "per_user": round((query_count - queries_before) / args.users, 2) if args.users else None,
+        },
+        "best_driver_eta_estimated_share": round(statistics.mean(estimated_share), 3) if estimated_share else None,
+        "metrics": metrics,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,244 @@
+# Driver WebSocket load harness.
+#
+# Registers N drivers against a running server, opens one socket per driver
+# (the DriverSession client from test_driver_ws.py), streams location frames
+# at --location-hz per driver and books --rides rides through POST /users ->
+# POST /me/location. Prints a JSON report with connect times, assignment
+# delivery latency (assignment commit -> frame received, from the message's
+# committed_at), location frame throughput, and server RSS / descriptors per
+# connection from /metrics.
+#
+#   DATABASE_URL=postgresql+asyncpg://... python bench_driver_ws.py --base-url http://localhost:8000 --drivers 2000 --rides 200
+#
+# Run the server with a single worker so /metrics covers every socket, and
+# on the same host (or with synced clocks) for the latency numbers. Drivers
+# and users are registered with the run id in their mobile numbers and are
+# left in the database, with the drivers marked unavailable at the end (set
+# DATABASE_URL to the server's database) so real rides never go to them.
+
+import argparse
+import asyncio
+import json
+import random
+import resource
+import time
+
+import httpx
+import websockets
+
+from bench_dispatch import LAT_RANGE, LON_RANGE, percentiles
+from test_driver_ws import DriverSession
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Driver WebSocket load harness")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--drivers", type=int, default=1000)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--location-hz", type=float, default=0.2, help="Location frames per driver per second")
+    parser.add_argument("--rides", type=int, default=100)
+    parser.add_argument("--ride-concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to stream locations after connecting")
+    parser.add_argument("--output", help="Write the JSON report here as well as stdout")
+    return parser.parse_args()
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+class SimulatedDriver(DriverSession):
+    def __init__(self, base_uri, token, stats):
+        super().__init__(base_uri, token, save_media=False)
+        self.stats = stats
+        self.lat = random.uniform(*LAT_RANGE)
+        self.lon = random.uniform(*LON_RANGE)
+
+    def on_message(self, data):
+        self.stats["assignments"] += 1
+        if "committed_at" in data:
+            self.stats["delivery_ms"].append((time.time() - data["committed_at"]) * 1000)
+
+    async def send_locations(self, websocket, hz, stop_at):
+        # Random walk, first frame at a random offset so drivers don't beat in step
+        await asyncio.sleep(random.uniform(0, 1 / hz))
+        while time.monotonic() < stop_at:
+            self.lat += random.uniform(-0.0005, 0.0005)
+            self.lon += random.uniform(-0.0005, 0.0005)
+            await websocket.send(json.dumps([self.lat, self.lon]))
+            self.stats["location_frames"] += 1
+            await asyncio.sleep(1 / hz)
+
+
+async def register_driver(client, run_id, i):
+    response = await client.post("/drivers", json={
+        "owner_name": "bench", "owner_number": "0", "owner_email": "bench@example.com",
+        "driver_name": f"ws-bench-{run_id}-{i}", "mobile": f"7{run_id}{i:06d}",
+        "ambulance_number": f"WSB-{run_id}-{i}",
+    })
+    response.raise_for_status()
+    body = response.json()
+    return body["driver"]["id"], body["access_token"]
+
+
+async def book_ride(client, run_id, i, statuses):
+    response = await client.post("/users", json={
+        "first_name": "Bench", "last_name": str(i), "mobile": f"8{run_id}{i:06d}",
+    })
+    if response.status_code == 200:
+        token = response.json()["access_token"]
+        response = await client.post(
+            "/me/location",
+            json={"latitude": random.uniform(*LAT_RANGE), "longitude": random.uniform(*LON_RANGE)},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def retire_drivers(driver_ids):
+    # Registered drivers start out available; leaving them so would let real
+    # rides be dispatched to them. Needs the server's DATABASE_URL.
+    if not driver_ids:
+        return
+    try:
+        from sqlalchemy import update
+
+        from app.db import AsyncSessionLocal
+        from app.models import Driver
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Driver).where(Driver.id.in_(driver_ids)).values(is_available=False))
+            await db.commit()
+    except Exception as e:
+        print(f"Failed to mark {len(driver_ids)} bench drivers unavailable: {e}")
+
+
+def summarize_metrics(metrics):
+    websockets_section = dict(metrics.get("websockets", {}))
+    websockets_section.pop("per_connection", None)
+    return {
+        "process": metrics.get("process"),
+        "websockets": websockets_section,
+        "locations": metrics.get("locations"),
+        "liveness": metrics.get("liveness"),
+        "outbox": metrics.get("outbox"),
+    }
+
+
+async def main(args):
+    fd_limit = raise_fd_limit()
+    run_id = f"{random.randint(0, 9999):04d}"
+    ws_base = args.base_url.replace("http", "ws", 1)
+    stats = {"assignments": 0, "delivery_ms": [], "location_frames": 0}
+    connect_ms = []
+    connect_errors = {}
+    ride_statuses = {}
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        before = (await client.get("/metrics")).json()
+
+        driver_ids = []
+        try:
+            semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+            async def register(i):
+                async with semaphore:
+                    driver_id, token = await register_driver(client, run_id, i)
+                driver_ids.append(driver_id)
+                return driver_id, token
+
+            credentials = await asyncio.gather(*(register(i) for i in range(args.drivers)))
+
+            sockets = []
+
+            async def connect(driver_id, token):
+                driver = SimulatedDriver(f"{ws_base}/ws/driver/{driver_id}", token, stats)
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        websocket = await websockets.connect(driver.uri(), open_timeout=30)
+                    except Exception as e:
+                        name = type(e).__name__
+                        connect_errors[name] = connect_errors.get(name, 0) + 1
+                        return
+                    connect_ms.append((time.perf_counter() - start) * 1000)
+                sockets.append((driver, websocket))
+
+            connect_start = time.perf_counter()
+            await asyncio.gather(*(connect(driver_id, token) for driver_id, token in credentials))
+            connect_wall = time.perf_counter() - connect_start
+            await asyncio.sleep(1)
+            connected = (await client.get("/metrics")).json()
+
+            stop_at = time.monotonic() + args.duration
+            tasks = []
+            for driver, websocket in sockets:
+                tasks.append(asyncio.create_task(driver.receive(websocket)))
+                if args.location_hz > 0:
+                    tasks.append(asyncio.create_task(driver.send_locations(websocket, args.location_hz, stop_at)))
+
+            ride_semaphore = asyncio.Semaphore(args.ride_concurrency)
+
+            async def ride(i):
+                # Spread bookings over the first half of the run
+                await asyncio.sleep(random.uniform(0, args.duration / 2))
+                async with ride_semaphore:
+                    await book_ride(client, run_id, i, ride_statuses)
+
+            await asyncio.gather(*(ride(i) for i in range(args.rides)))
+            await asyncio.sleep(max(0.0, stop_at - time.monotonic()))
+            during = (await client.get("/metrics")).json()
+
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.gather(*(websocket.close() for _, websocket in sockets), return_exceptions=True)
+        finally:
+            await retire_drivers(driver_ids)
+
+    rss_before = before["process"]["rss_bytes"]
+    rss_connected = connected["process"]["rss_bytes"]
+    report = {
+        "run_id": run_id,
+        "config": vars(args),
+        "client_fd_limit": fd_limit,
+        "connections": {
+            "opened": len(sockets),
+            "errors": connect_errors,
+            "wall_seconds": round(connect_wall, 3),
+            "connect_ms": percentiles(connect_ms),
+        },
+        "server_per_connection": {
+            "rss_bytes": round((rss_connected - rss_before) / len(sockets))
+            if sockets and rss_before and rss_connected else None,
+            "open_fds": round(
+                (connected["process"]["open_fds"] - before["process"]["open_fds"]) / len(sockets), 2
+            ) if sockets and before["process"]["open_fds"] is not None else None,
+        },
+        "locations": {
+            "frames_sent": stats["location_frames"],
+            "frames_per_second": round(stats["location_frames"] / args.duration, 1) if args.duration else None,
+        },
+        "rides": {
+            "status_codes": ride_statuses,
+            "assignments_received": stats["assignments"],
+            "delivery_ms": percentiles(stats["delivery_ms"]),
+        },
+        "server": {
+            "before": summarize_metrics(before),
+            "connected": summarize_metrics(connected),
+            "during": summarize_metrics(during),
+        },
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
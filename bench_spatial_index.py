@@ -0,0 +1,34 @@
+import random
+import time
+
+from app.spatial_index import DriverSpatialIndex
+
+# Rough bounding box around Kerala
+LAT_RANGE = (8.2, 12.8)
+LON_RANGE = (74.8, 77.4)
+QUERIES = 1000
+
+
+def build_index(n: int) -> DriverSpatialIndex:
+    index = DriverSpatialIndex()
+    for driver_id in range(n):
+        index.update(driver_id, random.uniform(*LAT_RANGE), random.uniform(*LON_RANGE))
+    return index
+
+
+def bench(n: int):
+    index = build_index(n)
+    points = [(random.uniform(*LAT_RANGE), random.uniform(*LON_RANGE)) for _ in range(QUERIES)]
+
+    start = time.perf_counter()
+    for lat, lon in points:
+        index.nearest(lat, lon, k=10, radius_km=50)
+    elapsed = time.perf_counter() - start
+
+    print(f"{n:>7} drivers: {elapsed / QUERIES * 1e6:9.1f} us per nearest(k=10) lookup")
+
+
+if __name__ == "__main__":
+    random.seed(42)
+    for n in (100, 10_000, 100_000):
+        bench(n)
@@ -0,0 +1,11 @@
+-- Nearest-driver lookups in Postgres (DISPATCH_CANDIDATE_SOURCE=db).
+-- GiST index over the earth point of each driver location, so
+-- earth_box(...) @> ll_to_earth(latitude, longitude) is index-assisted.
+CREATE EXTENSION IF NOT EXISTS cube;
+CREATE EXTENSION IF NOT EXISTS earthdistance;
+
+CREATE INDEX IF NOT EXISTS ix_driver_locations_earth
+    ON driver_locations USING gist (ll_to_earth(latitude, longitude));
+
+-- Rollback:
+-- DROP INDEX IF EXISTS ix_driver_locations_earth;
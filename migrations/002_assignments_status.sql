@@ -0,0 +1,7 @@
+-- Columns the dispatch code already relies on (Assignment.status / assigned_at).
+ALTER TABLE assignments ADD COLUMN IF NOT EXISTS status VARCHAR DEFAULT 'pending';
+ALTER TABLE assignments ADD COLUMN IF NOT EXISTS assigned_at TIMESTAMP DEFAULT now();
+
+-- Rollback:
+-- ALTER TABLE assignments DROP COLUMN IF EXISTS assigned_at;
+-- ALTER TABLE assignments DROP COLUMN IF EXISTS status;
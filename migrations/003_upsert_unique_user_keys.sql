@@ -0,0 +1,8 @@
+-- ON CONFLICT (user_id) upserts in app/crud.py need one row per user.
+-- Remove duplicate rows (keeping the newest) before running this.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_locations_user_id ON locations (user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_media_data_user_id ON media_data (user_id);
+
+-- Rollback:
+-- DROP INDEX IF EXISTS uq_media_data_user_id;
+-- DROP INDEX IF EXISTS uq_locations_user_id;
@@ -0,0 +1,13 @@
+-- Day-partitioned driver track history. Daily partitions are created on
+-- demand by the app (driver_location_history_YYYYMMDD) and dropped once
+-- older than HISTORY_RETENTION_DAYS.
+CREATE TABLE IF NOT EXISTS driver_location_history (
+    driver_id INTEGER NOT NULL,
+    recorded_at TIMESTAMP NOT NULL,
+    latitude DOUBLE PRECISION NOT NULL,
+    longitude DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (driver_id, recorded_at)
+) PARTITION BY RANGE (recorded_at);
+
+-- Rollback:
+-- DROP TABLE IF EXISTS driver_location_history;
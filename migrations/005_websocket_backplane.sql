@@ -0,0 +1,18 @@
+-- Registry and spill table for WS_BACKPLANE=postgres (app/backplane.py).
+CREATE TABLE IF NOT EXISTS driver_connections (
+    driver_id INTEGER PRIMARY KEY,
+    worker_id VARCHAR NOT NULL,
+    connected_at TIMESTAMP DEFAULT now()
+);
+
+-- Payloads over the NOTIFY size limit are stored here and the NOTIFY
+-- carries only the row id.
+CREATE TABLE IF NOT EXISTS backplane_messages (
+    id SERIAL PRIMARY KEY,
+    payload VARCHAR NOT NULL,
+    created_at TIMESTAMP DEFAULT now()
+);
+
+-- Rollback:
+-- DROP TABLE IF EXISTS backplane_messages;
+-- DROP TABLE IF EXISTS driver_connections;
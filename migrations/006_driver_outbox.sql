@@ -0,0 +1,13 @@
+-- Unacked driver messages for OUTBOX_STORE=db (app/outbox.py). The id is
+-- the sequence number clients ack and resume from.
+CREATE TABLE IF NOT EXISTS driver_outbox (
+    id SERIAL PRIMARY KEY,
+    driver_id INTEGER NOT NULL,
+    payload VARCHAR NOT NULL,
+    created_at TIMESTAMP DEFAULT now(),
+    expires_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_driver_outbox_driver_id ON driver_outbox (driver_id);
+
+-- Rollback:
+-- DROP TABLE IF EXISTS driver_outbox;
@@ -0,0 +1,9 @@
+-- Worker heartbeats for WS_BACKPLANE=postgres (app/backplane.py). A
+-- driver_connections row whose worker stopped heartbeating is stale.
+CREATE TABLE IF NOT EXISTS backplane_workers (
+    worker_id VARCHAR PRIMARY KEY,
+    heartbeat_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Rollback:
+-- DROP TABLE IF EXISTS backplane_workers;
@@ -0,0 +1,80 @@
+# Local stand-in for the openrouteservice endpoints used by app/routing.py.
+# Durations are straight-line distance scaled by a circuity factor at a fixed
+# speed, so results are deterministic and need no network.
+#
+#   uvicorn ors_stub:app --port 8081
+#   ORS_BASE_URL=http://localhost:8081 uvicorn app.service:app
+#
+# ORS_STUB_LATENCY_MS, ORS_STUB_JITTER_MS and ORS_STUB_ERROR_RATE simulate a
+# slow or failing provider.
+
+import asyncio
+import os
+import random
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+from app.spatial_index import haversine_km
+
+STUB_SPEED_KMH = float(os.getenv("ORS_STUB_SPEED_KMH", "40"))
+STUB_CIRCUITY = float(os.getenv("ORS_STUB_CIRCUITY", "1.3"))
+STUB_MAX_MATRIX_ROUTES = int(os.getenv("ORS_STUB_MAX_MATRIX_ROUTES", "3500"))
+# Simulated provider behaviour for load runs
+STUB_LATENCY_MS = float(os.getenv("ORS_STUB_LATENCY_MS", "0"))
+STUB_JITTER_MS = float(os.getenv("ORS_STUB_JITTER_MS", "0"))
+STUB_ERROR_RATE = float(os.getenv("ORS_STUB_ERROR_RATE", "0"))
+
+app = FastAPI()
+
+
+def _duration_seconds(a, b):
+    # a, b are [lon, lat] like ORS
+    km = haversine_km(a[1], a[0], b[1], b[0]) * STUB_CIRCUITY
+    return km / STUB_SPEED_KMH * 3600
+
+
+async def _simulate_provider():
+    delay_ms = STUB_LATENCY_MS + random.uniform(0, STUB_JITTER_MS)
+    if delay_ms:
+        await asyncio.sleep(delay_ms / 1000)
+    if random.random() < STUB_ERROR_RATE:
+        raise HTTPException(status_code=503, detail="Simulated provider error")
+
+
+class DirectionsRequest(BaseModel):
+    coordinates: list[list[float]]
+
+
+class MatrixRequest(BaseModel):
+    locations: list[list[float]]
+    sources: list[int] | None = None
+    destinations: list[int] | None = None
+    metrics: list[str] = ["duration"]
+
+
+@app.post("/v2/directions/driving-car/geojson")
+async def directions(body: DirectionsRequest):
+    await _simulate_provider()
+    duration = sum(
+        _duration_seconds(a, b) for a, b in zip(body.coordinates, body.coordinates[1:])
+    )
+    return {
+        "type": "FeatureCollection",
+        "features": [{"properties": {"summary": {"duration": duration}}}]
+    }
+
+
+@app.post("/v2/matrix/driving-car")
+async def matrix(body: MatrixRequest):
+    await _simulate_provider()
+    sources = body.sources if body.sources is not None else list(range(len(body.locations)))
+    destinations = body.destinations if body.destinations is not None else list(range(len(body.locations)))
+    if len(sources) * len(destinations) > STUB_MAX_MATRIX_ROUTES:
+        raise HTTPException(status_code=400, detail="Request parameters exceed the server configuration limits")
+
+    durations = [
+        [_duration_seconds(body.locations[s], body.locations[d]) for d in destinations]
+        for s in sources
+    ]
+    return {"durations": durations}
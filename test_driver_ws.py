@@ -1,21 +1,202 @@
 import asyncio
+import hashlib
+import os
+import httpx
 import websockets
 import json
-import base64
+from urllib.parse import urlencode, urljoin
 
-async def test_driver_ws():
-    uri = "ws://localhost:8000/ws/driver/2"
-    # uri = "ws://13.203.89.173:8001/ws/driver/17"
-    async with websockets.connect(uri) as websocket:
-        print("Connected as driver 2")
+
+class MediaReceiver:
+    # Reassembles media sent as a {"type": "media"} header, raw binary
+    # chunks for each file in order, then {"type": "media_end"}.
+    def __init__(self, save=True):
+        self.save = save
+        self.files = []
+        self.current = None
+        self.remaining = 0
+        self.bytes_received = 0
+
+    def start(self, header):
+        self.files = list(header["files"])
+        if self.save:
+            print(f"Receiving {len(self.files)} files from user {header['user_id']}: {header['message']}")
+        self._next_file()
+
+    def _next_file(self):
+        if self.current:
+            self.current.close()
+            self.current = None
+        while self.files:
+            meta = self.files.pop(0)
+            self.remaining = meta["size"]
+            if self.save:
+                filename = f"received_{meta['filename']}"
+                self.current = open(filename, "wb")
+                print(f"Saving image: {filename} ({meta['size']} bytes)")
+            if self.remaining:
+                return
+            if self.current:
+                self.current.close()
+                self.current = None
+
+    def feed(self, chunk):
+        if self.current:
+            self.current.write(chunk)
+        self.bytes_received += len(chunk)
+        self.remaining -= len(chunk)
+        if self.remaining <= 0:
+            self._next_file()
+
+
+class MediaDownloader:
+    # Fetches {"type": "media_urls"} links, derivatives before originals.
+    # Files already on disk with the same sha256 are skipped, partial
+    # downloads resume with a Range request and every file is checked
+    # against its sha256.
+    def __init__(self, http_base, save=True, directory="."):
+        self.http_base = http_base
+        self.save = save
+        self.directory = directory
+
+    def _path(self, meta):
+        return os.path.join(self.directory, f"received_{meta['filename']}")
+
+    @staticmethod
+    def _sha256(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    async def fetch(self, files):
+        # Smallest first: every thumbnail, then every preview, then the originals
+        if not self.save:
+            return
+        tiers = {}
+        for meta in files:
+            for kind, variant in meta.get("variants", {}).items():
+                tiers.setdefault(kind, []).append(variant)
+        tiers["original"] = files
+        async with httpx.AsyncClient(timeout=60) as client:
+            for tier in tiers.values():
+                for meta in tier:
+                    await self._fetch_one(client, meta)
+
+    async def _fetch_one(self, client, meta):
+        path = self._path(meta)
+        if os.path.exists(path) and self._sha256(path) == meta["sha256"]:
+            print(f"Already have {path}")
+            return
+        part = f"{path}.part"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Range": f"bytes={offset}-"} if 0 < offset < meta["size"] else {}
+        async with client.stream("GET", urljoin(self.http_base, meta["url"]), headers=headers) as response:
+            if response.status_code not in (200, 206):
+                print(f"Download of {meta['filename']} failed: HTTP {response.status_code}")
+                return
+            with open(part, "ab" if response.status_code == 206 else "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    f.write(chunk)
+        if self._sha256(part) != meta["sha256"]:
+            print(f"Checksum mismatch for {meta['filename']}, discarding")
+            os.remove(part)
+            return
+        os.replace(part, path)
+        print(f"Saved image: {path} ({meta['size']} bytes)")
+
+
+def http_base_for(ws_uri):
+    # ws://host:port/ws/driver/1 -> http://host:port/
+    scheme, rest = ws_uri.split("://", 1)
+    return f"{'https' if scheme == 'wss' else 'http'}://{rest.split('/', 1)[0]}/"
+
+
+class DriverSession:
+    # Reference client for /ws/driver/{id}: answers pings, reassembles
+    # binary media, downloads media links, acks outbox messages, drops
+    # duplicates and resumes from the last seq it handled when it
+    # reconnects. Acks and replay need the driver's token.
+    def __init__(self, base_uri, token=None, save_media=True):
+        self.base_uri = base_uri
+        self.token = token
+        self.media = MediaReceiver(save_media)
+        self.downloads = MediaDownloader(http_base_for(base_uri), save_media)
+        self.tasks = set()
+        # Outbox cursor; seqs only compare within one epoch
+        self.epoch = None
+        self.last_seq = 0
+
+    def uri(self):
+        params = {"resume": self.last_seq}
+        if self.epoch:
+            params["epoch"] = self.epoch
+        if self.token:
+            params["token"] = self.token
+        return f"{self.base_uri}?{urlencode(params)}"
+
+    def on_message(self, data):
+        print(f"Received from user {data.get('user_id')}: {data.get('message', data)}")
+
+    def download(self, files):
+        # In the background, so pings keep being answered meanwhile
+        task = asyncio.create_task(self.downloads.fetch(files))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handle(self, websocket, message):
+        if isinstance(message, bytes):
+            self.media.feed(message)
+            return
+        data = json.loads(message)
+        if data.get("type") == "ping":
+            await websocket.send(json.dumps({"type": "pong"}))
+            return
+        if data.get("type") == "media":
+            self.media.start(data)
+            return
+        if data.get("type") == "media_end":
+            if self.media.save:
+                print(f"Media transfer {data['transfer_id']} complete")
+            return
+        seq = data.get("seq")
+        if seq is not None:
+            if data.get("epoch") != self.epoch:
+                # Server restarted or another worker's numbering: new cursor
+                self.epoch = data.get("epoch")
+                self.last_seq = 0
+            elif seq <= self.last_seq:
+                return  # already handled (replayed and delivered live)
+        if data.get("type") == "media_urls":
+            print(f"Received {len(data['files'])} media links from user {data['user_id']}: {data['message']}")
+            self.download(data["files"])
+        else:
+            self.on_message(data)
+        if seq is not None:
+            self.last_seq = seq
+            await websocket.send(json.dumps({"type": "ack", "seq": seq, "epoch": self.epoch}))
+
+    async def receive(self, websocket):
+        async for message in websocket:
+            await self.handle(websocket, message)
+
+    async def run_forever(self):
         while True:
-            message = await websocket.recv()
-            data = json.loads(message)
-            print(f"Received from user {data['user_id']}: {data['message']}")
-            for img in data.get("images", []):
-                filename = f"received_{img['filename']}"
-                with open(filename, "wb") as f:
-                    f.write(base64.b64decode(img["data"]))
-                print(f"Saved image: {filename}")
-
-asyncio.run(test_driver_ws())
+            try:
+                async with websockets.connect(self.uri()) as websocket:
+                    print(f"Connected to {self.base_uri} (resume={self.last_seq})")
+                    await self.receive(websocket)
+            except (websockets.ConnectionClosed, OSError) as e:
+                print(f"Disconnected ({e}), reconnecting")
+            await asyncio.sleep(1)
+
+
+async def test_driver_ws():
+    session = DriverSession("ws://localhost:8000/ws/driver/2")
+    # session = DriverSession("ws://13.203.89.173:8001/ws/driver/17")
+    await session.run_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(test_driver_ws())
@@ -0,0 +1,5 @@
+import os
+
+# app.db builds its engine from DATABASE_URL at import. Unit tests never
+# connect; the query-count tests point it at TEST_DATABASE_URL.
+os.environ.setdefault("DATABASE_URL", os.getenv("TEST_DATABASE_URL") or "postgresql+asyncpg://localhost/unused")
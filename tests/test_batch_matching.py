@@ -0,0 +1,48 @@
+# solve_assignment against every possible matching of small cost matrices.
+
+import itertools
+import random
+
+import pytest
+
+solve_assignment = pytest.importorskip("app.batch_matching").solve_assignment
+
+
+def brute_force_cost(cost):
+    n, m = len(cost), len(cost[0])
+    if n <= m:
+        return min(sum(cost[row][col] for row, col in enumerate(cols)) for cols in itertools.permutations(range(m), n))
+    return min(sum(cost[row][col] for col, row in enumerate(rows)) for rows in itertools.permutations(range(n), m))
+
+
+def check(cost):
+    pairs = solve_assignment(cost)
+    rows = [row for row, _ in pairs]
+    cols = [col for _, col in pairs]
+    assert len(set(rows)) == len(rows) and len(set(cols)) == len(cols)
+    assert len(pairs) == min(len(cost), len(cost[0]))
+    assert sum(cost[row][col] for row, col in pairs) == pytest.approx(brute_force_cost(cost))
+
+
+def test_square_matrices_are_optimal():
+    rng = random.Random(3)
+    for n in range(1, 7):
+        for _ in range(20):
+            check([[rng.randint(0, 50) for _ in range(n)] for _ in range(n)])
+
+
+def test_rectangular_matrices_are_optimal():
+    rng = random.Random(5)
+    for n, m in [(1, 4), (2, 5), (3, 6), (4, 2), (6, 3)]:
+        for _ in range(20):
+            check([[rng.uniform(0, 30) for _ in range(m)] for _ in range(n)])
+
+
+def test_greedy_choice_is_not_taken():
+    # Row 0's cheapest column would leave row 1 with its worst one
+    assert sorted(solve_assignment([[1, 2], [1, 100]])) == [(0, 1), (1, 0)]
+
+
+def test_empty_matrix():
+    assert solve_assignment([]) == []
+    assert solve_assignment([[]]) == []
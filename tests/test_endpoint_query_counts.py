@@ -0,0 +1,180 @@
+# Statement counts for the endpoints that write through the single-statement
+# upserts in app/crud.py. Requests go through the app itself (no lifespan, so
+# no background workers) with a before_cursor_execute listener counting what
+# reaches Postgres. Only statements against the table an endpoint writes are
+# counted; the auth lookup and dispatch reads are not what this guards.
+#
+# Runs against a scratch Postgres database (tables are created if missing):
+#
+#   TEST_DATABASE_URL=postgresql+asyncpg://... python -m pytest tests
+
+import asyncio
+import io
+import os
+import re
+import uuid
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+@pytest.fixture(scope="module")
+def run():
+    # app.db builds its engine from DATABASE_URL at import
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    from app.db import Base, engine
+
+    loop = asyncio.new_event_loop()
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    loop.run_until_complete(create_tables())
+    yield loop.run_until_complete
+    loop.run_until_complete(engine.dispose())
+    loop.close()
+
+
+class StatementCounter:
+    def __init__(self):
+        from sqlalchemy import event
+
+        from app.db import engine
+
+        self.event = event
+        self.engine = engine.sync_engine
+        self.statements = []
+
+    def _count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def on(self, table: str) -> list:
+        pattern = re.compile(rf"\b(INSERT INTO|UPDATE|FROM|JOIN)\s+{table}\b", re.IGNORECASE)
+        return [statement for statement in self.statements if pattern.search(statement)]
+
+    def __enter__(self):
+        self.event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        self.event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+def client():
+    import httpx
+
+    from app.service import app
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def make_user(db):
+    from app.auth import create_access_token
+    from app.models import User
+
+    user = User(first_name="Test", last_name="User", mobile=f"t-{uuid.uuid4().hex[:12]}")
+    db.add(user)
+    await db.commit()
+    return user, {"Authorization": f"Bearer {create_access_token(user.id, user.mobile)}"}
+
+
+async def make_driver(db):
+    from app.auth import create_driver_access_token
+    from app.models import Driver
+
+    tag = uuid.uuid4().hex[:12]
+    # Never dispatchable, in case the database is shared
+    driver = Driver(driver_name="Test", mobile=f"t-{tag}", ambulance_number=f"T-{tag}", is_available=False)
+    db.add(driver)
+    await db.commit()
+    token = create_driver_access_token(driver.id, driver.mobile, driver.ambulance_number)
+    return driver, {"Authorization": f"Bearer {token}"}
+
+
+def test_set_location_upserts_location_and_media_once(run, monkeypatch):
+    from app import service
+    from app.db import AsyncSessionLocal
+
+    async def no_drivers(db, lat, lon):
+        return []
+
+    # Dispatch reads locations too; with nobody to dispatch to it stops at a 404
+    monkeypatch.setattr(service, "get_dispatch_candidates", no_drivers)
+
+    async def scenario():
+        async with AsyncSessionLocal() as db, client() as http:
+            user, headers = await make_user(db)
+            for lat in (10.0, 10.1):  # insert, then update
+                with StatementCounter() as counter:
+                    response = await http.post("/me/location", json={"latitude": lat, "longitude": 76.3}, headers=headers)
+                assert response.status_code == 404, response.text
+                assert len(counter.on("locations")) == 1, counter.statements
+                assert len(counter.on("media_data")) == 1, counter.statements
+
+    run(scenario())
+
+
+def test_driver_location_is_written_behind_in_one_statement(run):
+    from app.db import AsyncSessionLocal
+    from app.location_store import live_locations
+
+    async def scenario():
+        async with AsyncSessionLocal() as db, client() as http:
+            drivers = [await make_driver(db) for _ in range(3)]
+            with StatementCounter() as counter:
+                for _, headers in drivers:
+                    response = await http.post("/driver/location", json={"latitude": 10.0, "longitude": 76.3}, headers=headers)
+                    assert response.status_code == 200, response.text
+            assert counter.on("driver_locations") == [], counter.statements
+            with StatementCounter() as counter:
+                await live_locations.flush()
+            assert len(counter.on("driver_locations")) == 1, counter.statements
+
+    run(scenario())
+
+
+def test_upload_image_upserts_media_once(run, tmp_path, monkeypatch):
+    from app import crud
+    from app.db import AsyncSessionLocal
+
+    monkeypatch.setattr(crud, "BASE_DIR", str(tmp_path))
+
+    async def scenario():
+        async with AsyncSessionLocal() as db, client() as http:
+            user, headers = await make_user(db)
+            with StatementCounter() as counter:
+                response = await http.post(
+                    "/me/upload/image",
+                    data={"media_id": str(uuid.uuid4())},
+                    files={"images": ("a.png", io.BytesIO(b"not really a png"), "image/png")},
+                    headers=headers,
+                )
+            assert response.status_code == 200, response.text
+            assert len(counter.on("media_data")) == 1, counter.statements
+
+    run(scenario())
+
+
+def test_respond_to_ride_locks_and_updates_the_assignment(run):
+    from app import crud
+    from app.db import AsyncSessionLocal
+
+    async def scenario():
+        async with AsyncSessionLocal() as db, client() as http:
+            user, _ = await make_user(db)
+            driver, headers = await make_driver(db)
+            assignment = await crud.upsert_assignment(db, user.id, driver.id)
+            await db.commit()
+            with StatementCounter() as counter:
+                response = await http.post(
+                    "/ride/respond", json={"assignment_id": assignment.id, "status": "accepted"}, headers=headers
+                )
+            assert response.status_code == 200, response.text
+            # Read it, then the UPDATE; no refresh after the commit
+            assert len(counter.on("assignments")) <= 2, counter.statements
+
+    run(scenario())
@@ -0,0 +1,69 @@
+# EtaCache: single-flight lookups, expiry and LRU eviction.
+
+import asyncio
+
+from app.eta_cache import EtaCache
+
+
+def test_concurrent_lookups_share_one_fetch():
+    cache = EtaCache()
+    key = cache.key(10.0, 76.0, 10.1, 76.1)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 7
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_fetch(key, fetch) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [7] * 5
+    assert len(calls) == 1
+    assert cache.inflight == {}
+    assert cache.get(key) == 7
+
+
+def test_waiters_fetch_themselves_when_the_owner_fails():
+    cache = EtaCache()
+    key = cache.key(10.0, 76.0, 10.1, 76.1)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise RuntimeError("provider down")
+        return 9
+
+    async def scenario():
+        return await asyncio.gather(
+            cache.get_or_fetch(key, fetch), cache.get_or_fetch(key, fetch), return_exceptions=True
+        )
+
+    owner, waiter = asyncio.run(scenario())
+    assert isinstance(owner, RuntimeError)
+    assert waiter == 9
+    assert cache.inflight == {}
+
+
+def test_nearby_points_share_a_key():
+    cache = EtaCache(cell_meters=100)
+    assert cache.key(10.00001, 76.00001, 10.1, 76.1) == cache.key(10.00002, 76.00002, 10.1, 76.1)
+    assert cache.key(10.0, 76.0, 10.1, 76.1) != cache.key(10.01, 76.0, 10.1, 76.1)
+
+
+def test_entries_expire_and_evict_least_recently_used():
+    cache = EtaCache(ttl_seconds=-1)
+    cache.set(("a",), 1)
+    assert cache.get(("a",)) is None
+    assert cache.counters["expired"] == 1
+
+    cache = EtaCache(max_entries=2)
+    cache.set(("a",), 1)
+    cache.set(("b",), 2)
+    cache.get(("a",))
+    cache.set(("c",), 3)
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) == 1
+    assert cache.counters["evictions"] == 1
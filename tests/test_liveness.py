@@ -0,0 +1,66 @@
+# DriverLiveness timing wheel: expiry timing, rejoin and disconnect handling.
+
+from app.liveness import DriverLiveness
+from app.spatial_index import driver_index
+
+
+def make_wheel(expired=None):
+    wheel = DriverLiveness(ttl_seconds=3, tick_seconds=1)
+    if expired is not None:
+        wheel.on_expire = expired.append
+    return wheel
+
+
+def test_driver_expires_after_ttl_ticks():
+    expired = []
+    wheel = make_wheel(expired)
+    driver_index.update(1, 10.0, 76.0)
+    wheel.touch(1)
+    for _ in range(2):
+        assert wheel.tick() == []
+    assert wheel.is_live(1)
+    assert wheel.tick() == [1]
+    assert not wheel.is_live(1)
+    assert 1 not in driver_index
+    assert expired == [1]
+
+
+def test_touch_pushes_expiry_back():
+    wheel = make_wheel()
+    wheel.touch(1)
+    wheel.tick()
+    wheel.tick()
+    wheel.touch(1)
+    assert wheel.tick() == []
+    assert wheel.tick() == []
+    assert wheel.tick() == [1]
+
+
+def test_stale_driver_rejoins_on_ping():
+    wheel = make_wheel()
+    wheel.touch(1)
+    for _ in range(3):
+        wheel.tick()
+    assert wheel.stats()["stale"] == 1
+    assert wheel.touch(1) is True
+    assert wheel.touch(1) is False
+    assert wheel.stats()["stale"] == 0
+    assert wheel.counters["rejoined"] == 1
+
+
+def test_disconnected_driver_is_not_kept_as_stale():
+    wheel = make_wheel()
+    wheel.touch(1)
+    wheel.disconnected(1)
+    for _ in range(3):
+        wheel.tick()
+    assert not wheel.is_live(1)
+    assert wheel.stats()["stale"] == 0
+    assert wheel.stats()["departed"] == 0
+
+
+def test_disabled_wheel_treats_everyone_as_live():
+    wheel = DriverLiveness(ttl_seconds=0)
+    assert not wheel.enabled
+    assert wheel.touch(1) is False
+    assert wheel.is_live(2)
@@ -0,0 +1,53 @@
+# Signed media URLs: verification, tampering and expiry.
+
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+media_urls = pytest.importorskip("app.media_urls")
+
+
+def split(url):
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    return parts.path[len("/uploads/"):], query["exp"][0], query["sig"][0]
+
+
+def test_signed_url_verifies():
+    url, expires = media_urls.signed_media_url("uploads/images/a.png")
+    path, exp, sig = split(url)
+    assert path == "images/a.png"
+    assert int(exp) == expires
+    assert media_urls.verify_media_signature(path, exp, sig)
+
+
+def test_tampered_url_is_rejected():
+    path, exp, sig = split(media_urls.signed_media_url("uploads/images/a.png")[0])
+    assert not media_urls.verify_media_signature("images/b.png", exp, sig)
+    assert not media_urls.verify_media_signature(path, str(int(exp) + 1), sig)
+    assert not media_urls.verify_media_signature(path, exp, "0" * len(sig))
+    assert not media_urls.verify_media_signature(path, exp, None)
+    assert not media_urls.verify_media_signature(path, "soon", sig)
+
+
+def test_expired_url_is_rejected(monkeypatch):
+    path, exp, sig = split(media_urls.signed_media_url("uploads/images/a.png")[0])
+    monkeypatch.setattr(media_urls.time, "time", lambda: int(exp) + 1)
+    assert not media_urls.verify_media_signature(path, exp, sig)
+
+
+def test_url_is_stable_within_a_ttl_window(monkeypatch):
+    ttl = media_urls.MEDIA_URL_TTL_SECONDS
+    monkeypatch.setattr(media_urls.time, "time", lambda: 100 * ttl + 1)
+    first = media_urls.signed_media_url("uploads/images/a.png")
+    monkeypatch.setattr(media_urls.time, "time", lambda: 101 * ttl - 1)
+    assert media_urls.signed_media_url("uploads/images/a.png") == first
+    # Still valid for at least one more window after the last reuse
+    assert first[1] - (101 * ttl - 1) > ttl
+
+
+def test_stored_image_paths_handles_array_literals():
+    assert media_urls.stored_image_paths(["{uploads/images/a.png,uploads/images/b.png}", "c.png"]) == [
+        "uploads/images/a.png", "uploads/images/b.png", "uploads/images/c.png",
+    ]
+    assert media_urls.stored_image_paths(None) == []
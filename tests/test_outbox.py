@@ -0,0 +1,91 @@
+# MemoryOutboxStore behind DriverOutbox: ack, replay and epochs.
+
+import asyncio
+
+import pytest
+
+outbox = pytest.importorskip("app.outbox")
+
+
+def make_outbox():
+    return outbox.DriverOutbox(outbox.MemoryOutboxStore())
+
+
+def test_messages_get_increasing_seqs_and_the_epoch():
+    box = make_outbox()
+
+    async def scenario():
+        return [await box.append(1, {"n": n}) for n in range(3)]
+
+    messages = asyncio.run(scenario())
+    assert [message["seq"] for message in messages] == [1, 2, 3]
+    assert {message["epoch"] for message in messages} == {box.store.epoch}
+    assert [message["n"] for message in messages] == [0, 1, 2]
+
+
+def test_ack_covers_everything_up_to_seq():
+    box = make_outbox()
+
+    async def scenario():
+        for n in range(3):
+            await box.append(1, {"n": n})
+        await box.append(2, {"n": "other driver"})
+        await box.ack(1, 2, box.store.epoch)
+        return await box.replay(1, 0, box.store.epoch), await box.replay(2, 0, box.store.epoch)
+
+    driver_1, driver_2 = asyncio.run(scenario())
+    assert [message["n"] for message in driver_1] == [2]
+    assert [message["n"] for message in driver_2] == ["other driver"]
+
+
+def test_replay_resumes_after_the_cursor_of_the_same_epoch():
+    box = make_outbox()
+
+    async def scenario():
+        for n in range(4):
+            await box.append(1, {"n": n})
+        return await box.replay(1, 2, box.store.epoch)
+
+    assert [message["seq"] for message in asyncio.run(scenario())] == [3, 4]
+
+
+def test_cursor_from_another_epoch_replays_everything():
+    box = make_outbox()
+
+    async def scenario():
+        for n in range(3):
+            await box.append(1, {"n": n})
+        return await box.replay(1, 2, "restarted"), await box.replay(1, 2)
+
+    foreign, no_epoch = asyncio.run(scenario())
+    assert [message["seq"] for message in foreign] == [1, 2, 3]
+    assert [message["seq"] for message in no_epoch] == [1, 2, 3]
+
+
+def test_ack_from_another_epoch_is_ignored():
+    box = make_outbox()
+
+    async def scenario():
+        await box.append(1, {"n": 0})
+        await box.ack(1, 1, "restarted")
+        return await box.replay(1, 0, box.store.epoch)
+
+    assert len(asyncio.run(scenario())) == 1
+    assert box.counters["foreign_acks"] == 1
+
+
+def test_each_store_has_its_own_epoch():
+    assert outbox.MemoryOutboxStore().epoch != outbox.MemoryOutboxStore().epoch
+
+
+def test_oldest_messages_overflow(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_PER_DRIVER", 2)
+    box = make_outbox()
+
+    async def scenario():
+        for n in range(3):
+            await box.append(1, {"n": n})
+        return await box.replay(1)
+
+    assert [message["n"] for message in asyncio.run(scenario())] == [1, 2]
+    assert box.store.counters["overflowed"] == 1
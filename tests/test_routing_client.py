@@ -0,0 +1,102 @@
+# CircuitBreaker state transitions and cancellation of hedged requests.
+
+import asyncio
+
+import pytest
+
+routing_client = pytest.importorskip("app.routing_client")
+CircuitBreaker = routing_client.CircuitBreaker
+
+
+def open_breaker(**kwargs):
+    breaker = CircuitBreaker(window=4, min_calls=2, error_rate=0.5, **kwargs)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == "open"
+    return breaker
+
+
+def test_opens_on_error_rate_after_min_calls():
+    breaker = CircuitBreaker(window=4, min_calls=4, error_rate=0.5)
+    for success in (False, True, False):
+        breaker.record(success)
+        assert breaker.state == "closed"
+    breaker.record(True)
+    assert breaker.state == "open"
+    assert breaker.times_opened == 1
+
+
+def test_open_breaker_rejects_until_reset():
+    breaker = open_breaker(reset_seconds=60)
+    assert not breaker.allow()
+    assert breaker.state == "open"
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = open_breaker(reset_seconds=0)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+
+def test_probe_outcome_closes_or_reopens():
+    breaker = open_breaker(reset_seconds=0)
+    breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert len(breaker.outcomes) == 0
+
+    breaker = open_breaker(reset_seconds=0)
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.times_opened == 2
+
+
+def test_probe_without_outcome_is_released():
+    breaker = open_breaker(reset_seconds=0)
+    breaker.allow()
+    breaker.end_probe()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_outcomes_while_open_do_not_extend_it():
+    breaker = open_breaker(reset_seconds=60)
+    opened_at = breaker.opened_at
+    breaker.record(False)
+    breaker.record(True)
+    assert breaker.state == "open"
+    assert breaker.opened_at == opened_at
+    assert breaker.times_opened == 1
+
+
+class SlowClient:
+    def __init__(self):
+        self.started = 0
+        self.cancelled = 0
+
+    async def post(self, path, json):
+        self.started += 1
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+@pytest.mark.parametrize("cancel_after", [0.005, 0.05])
+def test_cancelled_caller_cancels_every_copy(cancel_after):
+    # Before and after the hedge went out
+    client = routing_client.RoutingClient("http://ors", "key", hedge_after_ms=20)
+    client.client = SlowClient()
+
+    async def scenario():
+        task = asyncio.create_task(client._send("/matrix", {}))
+        await asyncio.sleep(cancel_after)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert client.client.started == client.client.cancelled
+    assert client.in_flight == 0
@@ -0,0 +1,68 @@
+# DriverSpatialIndex.nearest against a brute-force scan of every driver.
+
+import random
+
+from app.spatial_index import DriverSpatialIndex, haversine_km
+
+
+def brute_force(positions, lat, lon, k, radius_km):
+    in_range = [
+        (driver_id, haversine_km(lat, lon, d_lat, d_lon))
+        for driver_id, (d_lat, d_lon) in positions.items()
+    ]
+    in_range = [(driver_id, dist) for driver_id, dist in in_range if dist <= radius_km]
+    return sorted(in_range, key=lambda x: x[1])[:k]
+
+
+def assert_same(found, expected):
+    assert [driver_id for driver_id, _ in found] == [driver_id for driver_id, _ in expected]
+    for (_, got), (_, want) in zip(found, expected):
+        assert abs(got - want) < 1e-9
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(7)
+    index = DriverSpatialIndex(cell_size_deg=0.05)
+    positions = {}
+    for driver_id in range(2000):
+        lat, lon = rng.uniform(9.5, 10.5), rng.uniform(76.0, 77.0)
+        index.update(driver_id, lat, lon)
+        positions[driver_id] = (lat, lon)
+
+    for _ in range(200):
+        lat, lon = rng.uniform(9.4, 10.6), rng.uniform(75.9, 77.1)
+        k = rng.choice([1, 5, 10, 50])
+        radius_km = rng.choice([0.5, 3, 20, 200])
+        assert_same(index.nearest(lat, lon, k, radius_km), brute_force(positions, lat, lon, k, radius_km))
+
+
+def test_nearest_with_few_drivers_far_apart():
+    # Sparse fleet: the search has to walk many empty rings
+    index = DriverSpatialIndex(cell_size_deg=0.01)
+    positions = {1: (10.0, 76.0), 2: (10.3, 76.3), 3: (9.6, 75.8)}
+    for driver_id, (lat, lon) in positions.items():
+        index.update(driver_id, lat, lon)
+    for k in (1, 2, 3, 5):
+        assert_same(index.nearest(10.1, 76.1, k, 100), brute_force(positions, 10.1, 76.1, k, 100))
+
+
+def test_update_moves_and_remove_forgets():
+    index = DriverSpatialIndex(cell_size_deg=0.05)
+    index.update(1, 10.0, 76.0)
+    index.update(1, 10.5, 76.5)  # different cell
+    assert [driver_id for driver_id, _ in index.nearest(10.0, 76.0, 5, 5)] == []
+    assert [driver_id for driver_id, _ in index.nearest(10.5, 76.5, 5, 5)] == [1]
+    assert sum(len(bucket) for bucket in index.cells.values()) == 1
+
+    index.set_available(1, False)
+    assert 1 not in index
+    assert index.cells == {}
+    assert index.nearest(10.5, 76.5) == []
+
+
+def test_set_available_without_position_does_not_index():
+    index = DriverSpatialIndex()
+    index.set_available(1, True)
+    assert 1 not in index
+    index.set_available(1, True, 10.0, 76.0)
+    assert 1 in index